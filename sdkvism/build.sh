@@ -9,4 +9,6 @@ python manage.py migrate
 # Collect static files
 python manage.py collectstatic --noinput
 
-gunicorn sdkvism.wsgi:application --bind 0.0.0.0:10000
+# Rendering avoids pyplot global state, so each worker can serve requests on several threads.
+# --preload warms the plotting stack once in the master (RENDER_WARMUP) before forking workers
+RENDER_WARMUP=${RENDER_WARMUP:-1} gunicorn sdkvism.wsgi:application --preload --bind 0.0.0.0:10000 --workers ${WEB_CONCURRENCY:-2} --threads ${GUNICORN_THREADS:-4}
@@ -7,6 +7,7 @@ function App() {
   const API_BASE = process.env.REACT_APP_API_URL || 'http://127.0.0.1:8000';
 
   const [file, setFile] = useState(null);
+  const [datasetId, setDatasetId] = useState(null);
   const [graphType, setGraphType] = useState("line");
   const [graphImage, setGraphImage] = useState("");
   const [categories, setCategories] = useState([]);
@@ -14,6 +15,7 @@ function App() {
   const [yColumns, setYColumns] = useState([]);
   const [errorMessage, setErrorMessage] = useState("");
   const [isLoading, setIsLoading] = useState(false);
+  const [uploadProgress, setUploadProgress] = useState(null);
   const [recommendations, setRecommendations] = useState([]);
   const [showRecommendations, setShowRecommendations] = useState(false);
   
@@ -74,28 +76,57 @@ function App() {
         }
       });
       
-      setCategories(response.data.categories);
-      setXColumn(response.data.categories[0] || "");
-      const initialYColumns = [response.data.categories[1] || ""];
+      const newDatasetId = response.data.dataset_id;
+      const upload = await waitForUpload(response.data.status_url);
+      if (upload.status === "failed") {
+        setErrorMessage(`❌ ${upload.error}`);
+        return;
+      }
+
+      setDatasetId(newDatasetId);
+      setCategories(upload.categories);
+      setXColumn(upload.categories[0] || "");
+      const initialYColumns = [upload.categories[1] || ""];
       setYColumns(initialYColumns);
       setColors(defaultColors.slice(0, initialYColumns.length));
       
       // Generate initial graph
-      generateGraph(response.data.categories[0] || "", initialYColumns, "line");
+      generateGraph(upload.categories[0] || "", initialYColumns, "line", newDatasetId);
       
       // Get AI recommendations
-      getAIRecommendations(response.data.categories);
+      getAIRecommendations(upload.categories, newDatasetId);
     } catch (error) {
       console.error("Error uploading file:", error);
       setErrorMessage(error.response?.data?.error || "❌ File upload failed. Please try again.");
     } finally {
       setIsLoading(false);
+      setUploadProgress(null);
+    }
+  };
+
+  // Poll the upload's status resource until the background parse settles
+  const waitForUpload = async (statusUrl) => {
+    for (;;) {
+      const response = await axios.get(`${API_BASE}${statusUrl}`);
+      if (response.data.status !== "processing") {
+        return response.data;
+      }
+      const progress = response.data.progress;
+      if (progress && progress.bytes_total) {
+        setUploadProgress(Math.round((100 * progress.bytes_read) / progress.bytes_total));
+      }
+      // Column names arrive with the first parsed chunk, so axes can be picked early
+      if (progress && progress.columns) {
+        setCategories(progress.columns);
+      }
+      await new Promise((resolve) => setTimeout(resolve, 500));
     }
   };
 
-  const getAIRecommendations = async (columns) => {
+  const getAIRecommendations = async (columns, dataset = datasetId) => {
     try {
       const response = await axios.post(`${API_BASE}/sdkreact/get_recommendations/`, {
+        dataset_id: dataset,
         columns: columns
       });
       
@@ -158,7 +189,7 @@ function App() {
     generateGraph(xColumn, yColumns, newType);
   };
 
-  const generateGraph = async (xCol, yCols, type) => {
+  const generateGraph = async (xCol, yCols, type, dataset = datasetId) => {
     if (!xCol || yCols.length === 0) {
       return;
     }
@@ -183,6 +214,7 @@ function App() {
 
     try {
       const response = await axios.post(`${API_BASE}/sdkreact/generate_graph/`, {
+        dataset_id: dataset,
         graph_type: type,
         x_column: xCol,
         y_columns: yCols,
@@ -277,17 +309,19 @@ function App() {
                 type="file" 
                 id="file-upload"
                 onChange={handleFileChange} 
-                accept=".csv,.json"
+                accept=".csv,.json,.ndjson,.jsonl,.parquet,.feather,.arrow,.ipc,.gz,.zst"
               />
               <label htmlFor="file-upload" className="file-upload-label">
-                {file ? file.name : "Choose a file (CSV or JSON)"}
+                {file ? file.name : "Choose a file (CSV, JSON, Parquet or Arrow)"}
               </label>
               <button 
                 className="upload-btn" 
                 onClick={handleUpload}
                 disabled={!file || isLoading}
               >
-                {isLoading ? "⏳ Uploading..." : "🚀 Upload File"}
+                {isLoading
+                  ? (uploadProgress === null ? "⏳ Uploading..." : `⏳ Processing ${uploadProgress}%`)
+                  : "🚀 Upload File"}
               </button>
             </div>
           </div>
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+from .typed import TypedColumns
+
+AGGREGATIONS = ('sum', 'mean', 'count')
+METHODS = ('auto', 'none') + AGGREGATIONS
+
+# Chart types drawn with one artist per category, and how many categories
+# each keeps before folding the rest into OTHER_LABEL
+DEFAULT_TOP_N = {
+    'bar': 50,
+    'waterfall': 50,
+    'funnel': 15,
+    'pie': 10,
+    'sunburst': 10,
+}
+OTHER_LABEL = 'Other'
+
+
+def is_aggregated(spec):
+    return spec['graph_type'] in DEFAULT_TOP_N and spec['aggregate'] != 'none'
+
+
+def group_totals(typed, x_column, y_column, scale=1.0):
+    """Per-category sums and non-null counts of y, categories in order of first appearance
+
+    Sum and count are enough to derive every aggregation, so one grouping
+    serves sum, mean and count alike. The x category codes and numeric y come
+    from ``typed`` columns (see typed.py), which may be a filtered selection.
+    ``scale`` extrapolates totals taken over a sample to the full dataset.
+    """
+    codes, labels = typed.codes(x_column)
+    y = typed.numeric(y_column)
+    valid = (codes >= 0) & typed.valid(y_column)
+    sums = np.bincount(codes[valid], weights=y[valid], minlength=len(labels))
+    counts = np.bincount(codes[valid], minlength=len(labels))
+    # A row selection keeps every label of the full column; drop those it has no rows of
+    present = np.bincount(codes[codes >= 0], minlength=len(labels)) > 0
+    if not present.all():
+        labels, sums, counts = labels[present], sums[present], counts[present]
+    if scale != 1.0:
+        sums, counts = sums * scale, counts * scale
+    return labels.astype(str), sums, counts
+
+
+def merge_groups(old, new, labels):
+    """Group totals over old and appended rows from the totals of each
+
+    ``labels`` holds every category of the x column in order of first
+    appearance (see TypedColumns.codes), which fixes the merged order.
+    """
+    order = {label: i for i, label in enumerate(np.asarray(labels).astype(str))}
+    merged = sorted(set(old[0]) | set(new[0]), key=order.__getitem__)
+    position = {label: i for i, label in enumerate(merged)}
+    sums = np.zeros(len(merged))
+    counts = np.zeros(len(merged), dtype=np.result_type(old[2], new[2]))
+    for part_labels, part_sums, part_counts in (old, new):
+        at = np.array([position[label] for label in part_labels], dtype=np.int64)
+        sums[at] += part_sums
+        counts[at] += part_counts
+    return np.array(merged, dtype=str), sums, counts
+
+
+def _values(sums, counts, agg):
+    if agg == 'count':
+        return counts.astype('float64')
+    if agg == 'mean':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+    return sums
+
+
+def aggregate_frame(spec, groups):
+    """Build the frame a chart draws from its per-y-column group totals
+
+    ``groups`` holds one ``group_totals`` result per y column. When there
+    are more than ``top_n`` categories the largest (by the first y column)
+    are kept in their original order and the rest are summed into one
+    trailing OTHER_LABEL row.
+    """
+    agg, top_n = spec['aggregate'], spec['top_n']
+    labels = groups[0][0]
+    keep = None
+    if len(labels) > top_n:
+        ranking = np.abs(np.nan_to_num(_values(groups[0][1], groups[0][2], agg)))
+        keep = np.sort(np.argsort(-ranking, kind='stable')[:max(top_n - 1, 1)])
+        rest = np.ones(len(labels), dtype=bool)
+        rest[keep] = False
+        labels = np.append(labels[keep], OTHER_LABEL)
+
+    frame = {spec['x_column']: labels}
+    for y_col, (_, sums, counts) in zip(spec['y_columns'], groups):
+        if keep is not None:
+            sums = np.append(sums[keep], sums[rest].sum())
+            counts = np.append(counts[keep], counts[rest].sum())
+        frame[y_col] = _values(sums, counts, agg)
+    return pd.DataFrame(frame)
+
+
+def aggregate_spec(uploaded_data, spec, scale=1.0):
+    """Aggregate a raw frame for one spec without any caching"""
+    typed = TypedColumns(uploaded_data)
+    return aggregate_frame(spec, [group_totals(typed, spec['x_column'], y_col, scale)
+                                  for y_col in spec['y_columns']])
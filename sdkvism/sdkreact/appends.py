@@ -0,0 +1,472 @@
+import copy
+import json
+import os
+import tempfile
+import threading
+import weakref
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .aggregate import group_totals, merge_groups
+from .columnar import (
+    count_rows, link_file, link_sidecar, new_segment_path, newest_path, prune_segments, read_columns, read_manifest,
+    read_sketches, read_summaries, sidecar_path, sketch_metadata, summary_metadata, write_segments,
+)
+from .datasets import (
+    DatasetNotReady, dataset_key, dataset_prefix, dataset_store, ensure_sidecar, files_shared, get_profile,
+)
+from .distributions import ColumnSummary
+from .filters import concat_rows, select_rows
+from .ingest import _INT_TYPES, _YEAR_RANGE, ColumnStats, _column_kind, _json_scalar
+from .models import UploadedFile
+from .ohlc import append_ticks, base_frame
+from .readers import read_chunks
+from .sketches import HyperLogLog
+from . import timing
+from .typed import TypedColumns, extend_typed
+
+# Held only while an append holds or waits for them, so deleted datasets leave no entry behind
+_locks = weakref.WeakValueDictionary()
+_locks_lock = threading.Lock()
+
+
+@contextmanager
+def _dataset_lock(file_instance):
+    """Serialize appends to one dataset across threads, and across processes where flock exists
+
+    The dataset row is refreshed once the lock is held. Processes lock the
+    stored file, so if another one forked the dataset onto new files (see
+    _fork_files) while this one waited, the new file is locked instead.
+    """
+    with _locks_lock:
+        lock = _locks.get(file_instance.pk)
+        if lock is None:
+            lock = _locks[file_instance.pk] = threading.Lock()
+    with lock:
+        while True:
+            file_name = file_instance.file.name
+            with open(file_instance.file.path, 'rb') as handle:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_EX)
+                file_instance.refresh_from_db()
+                if file_instance.file.name == file_name:
+                    yield
+                    return
+
+
+def _fork_files(file_instance):
+    """Give a dataset that shares its stored files with others (see datasets.share_dataset) its own
+
+    The upload, its sidecar and segments are never written in place (appends
+    add segments and merges replace files), so hard links serve as copies
+    where the filesystem has them.
+    """
+    storage = file_instance.file.storage
+    old_path = file_instance.file.path
+    name = storage.get_available_name(file_instance.file.name)
+    new_path = storage.path(name)
+    link_file(old_path, new_path)
+    link_sidecar(old_path, new_path)
+    file_instance.file.name = name
+    file_instance.save(update_fields=['file'])
+
+
+def read_row_objects(rows):
+    """A frame of rows given as a list of ``{column: value}`` objects"""
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise ValueError("Provide a file or a list of row objects as rows")
+    return pd.DataFrame(rows)
+
+
+def read_upload(uploaded_file):
+    """Rows of an uploaded file, in any format an upload may have, as one frame"""
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        return _read_file(uploaded_file.temporary_file_path())
+    suffix = os.path.splitext(uploaded_file.name)[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix) as handle:
+        for chunk in uploaded_file.chunks():
+            handle.write(chunk)
+        handle.flush()
+        return _read_file(handle.name)
+
+
+def _read_file(file_path):
+    engine = settings.INGEST_CSV_ENGINE
+    try:
+        chunks = [chunk for chunk, _ in read_chunks(file_path, settings.INGEST_CHUNK_ROWS, csv_engine=engine)]
+    except pa.ArrowInvalid:
+        if engine != 'pyarrow':
+            raise
+        chunks = [chunk for chunk, _ in read_chunks(file_path, settings.INGEST_CHUNK_ROWS, csv_engine='pandas')]
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True)
+
+
+def append_rows(file_instance, frame):
+    """Append a frame of rows to a ready dataset and return how many were added
+
+    The columns must match the dataset's, and each is coerced to the type
+    already stored: integers widen to larger integers or floats and float32
+    to float64 when the new values need it, new categories extend the
+    dictionary, and values that cannot be read as the column's type raise
+    ValueError. The rows are written as one new segment file next to the
+    sidecar (see columnar.py), so an append writes only its own rows and
+    nothing is parsed again; the column profile is merged with the new
+    rows' statistics (distinct counts through the HyperLogLog sketches kept
+    with the newest segment), and so are the numeric columns' distribution
+    summaries saved beside them. Every APPEND_MAX_SEGMENTS appends the segments
+    are merged into one, or into the sidecar once they hold as many rows.
+
+    The segment is published before the row count is saved, and readers
+    never read past the row count they know, so nobody sees rows their
+    store keys do not account for. The row count is part of every store key
+    (see datasets.dataset_key), so other processes simply stop using what
+    they derived from fewer rows.
+    This process carries its derived data forward instead: typed arrays and
+    sort indexes, category groups, filter rows and OHLC bars over the full
+    dataset are extended with the new rows rather than rebuilt, and column
+    summaries merged with the new rows' own. Chart cache
+    keys hold the rows a chart reads, so filtered charts whose filter keeps
+    none of the new rows stay cached. The original upload is left as it
+    was; appended rows live in the segments only. A dataset sharing its
+    files with others gets its own copy first.
+    """
+    frame = frame.copy()
+    frame.columns = [str(col) for col in frame.columns]
+    if len(frame) == 0:
+        raise ValueError("No rows to append")
+
+    with _dataset_lock(file_instance):
+        if file_instance.status != UploadedFile.READY:
+            raise DatasetNotReady(f"Dataset {file_instance.pk} is not ready for appends")
+        ensure_sidecar(file_instance)
+        if files_shared(file_instance.file.name, file_instance.pk):
+            _fork_files(file_instance)
+        file_path = file_instance.file.path
+        profile = get_profile(file_instance)
+        offset = file_instance.rows
+        entries = dataset_store.entries(*dataset_prefix(file_instance))
+
+        with timing.stage('append'):
+            schema, new_batch, profile = _write_segment(file_path, frame, profile, offset)
+
+        file_instance.rows = offset + len(frame)
+        file_instance.profile = profile
+        # The stored bytes no longer match the upload, so it must not be reused as a duplicate
+        file_instance.content_hash = ''
+        file_instance.save(update_fields=['rows', 'profile', 'content_hash'])
+
+        chunk_frame = pa.Table.from_batches([new_batch], schema=schema).to_pandas(split_blocks=True)
+        with timing.stage('carry_forward'):
+            _carry_forward(file_instance, entries, offset, chunk_frame)
+        dataset_store.discard(file_instance.pk, file_instance.version, offset)
+    return len(frame)
+
+
+def _write_segment(file_path, frame, profile, rows):
+    """Write ``frame`` as a new segment after the first ``rows`` stored rows and publish it
+
+    Returns the segment's schema, its batch and the merged profile.
+    Segments past ``rows`` belong to an append that failed before saving
+    its row count; they are dropped.
+    """
+    base_rows, segments = _committed_segments(file_path, rows)
+    with pa.memory_map(newest_path(file_path, segments)) as source:
+        old_schema = pa.ipc.open_file(source).schema
+    missing = [col for col in old_schema.names if col not in frame.columns]
+    unexpected = [col for col in frame.columns if col not in old_schema.names]
+    if missing or unexpected:
+        problems = ([f"missing columns: {', '.join(missing)}"] if missing else []) + \
+                   ([f"unknown columns: {', '.join(unexpected)}"] if unexpected else [])
+        raise ValueError("Rows do not match the dataset's columns; " + "; ".join(problems))
+
+    sketches = read_sketches(file_path, segments)
+    summaries = read_summaries(file_path, segments)
+    fields, arrays, merged = [], [], {}
+    for field in old_schema:
+        col = field.name
+        values, kind = _coerce(frame[col], field)
+        stats = ColumnStats(col, settings.INGEST_CATEGORY_MAX)
+        stats.update(values, _column_kind(values))
+
+        arrow_type = _widened_type(field.type, kind, stats, profile[col])
+        if pa.types.is_dictionary(arrow_type):
+            dictionary = _extend_dictionary(values, newest_path(file_path, segments), col)
+            indices = pc.index_in(pa.array(values, type=pa.string(), from_pandas=True), value_set=dictionary)
+            arrays.append(pa.DictionaryArray.from_arrays(indices.cast(arrow_type.index_type), dictionary))
+            distinct = len(dictionary)
+        else:
+            arrays.append(pa.array(values, type=arrow_type, from_pandas=True))
+            distinct = None
+
+        sketch = sketches.get(col) or _rebuild_sketch(file_path, col, field.type, rows)
+        sketch.merge(stats.sketch)
+        sketches[col] = sketch
+        merged[col] = _merge_profile(profile[col], stats, kind, sketch, distinct)
+        summary = summaries.pop(col, None)
+        if summary is not None and stats.summary is not None and merged[col]['kind'] in ('int', 'float'):
+            summary.merge(stats.summary)
+            summaries[col] = summary
+        fields.append(pa.field(col, arrow_type))
+
+    schema = pa.schema(fields, metadata={**sketch_metadata(sketches), **summary_metadata(summaries)})
+    new_batch = pa.record_batch(arrays, schema=schema)
+    segment = new_segment_path(file_path)
+    with pa.ipc.new_file(segment, schema) as writer:
+        writer.write_batch(new_batch)
+
+    segments.append((segment, new_batch.num_rows))
+    if len(segments) >= settings.APPEND_MAX_SEGMENTS:
+        base_rows, segments = _merge_segments(file_path, base_rows, segments)
+    write_segments(file_path, segments, base_rows)
+    prune_segments(file_path)
+    return schema, new_batch, merged
+
+
+def _committed_segments(file_path, rows):
+    """``(base_rows, segments)`` of the manifest, without segments holding rows past the first ``rows``"""
+    base_rows, segments = read_manifest(file_path)
+    if base_rows is None:
+        base_rows = count_rows(sidecar_path(file_path))
+    committed, total = [], base_rows
+    for path, segment_rows in segments:
+        if total + segment_rows > rows:
+            break
+        committed.append((path, segment_rows))
+        total += segment_rows
+    return base_rows, committed
+
+
+def _merge_segments(file_path, base_rows, segments):
+    """Merge the segments into one, or into the sidecar once they hold as many rows as it does
+
+    Returns the new ``(base_rows, segments)`` to publish; the files they
+    replace are left for prune_segments.
+    """
+    segment_rows = sum(rows for _, rows in segments)
+    into_sidecar = segment_rows >= base_rows
+    paths = ([sidecar_path(file_path)] if into_sidecar else []) + [path for path, _ in segments]
+    with pa.memory_map(paths[-1]) as source:
+        metadata = pa.ipc.open_file(source).schema.metadata
+    table = pa.concat_tables([feather.read_table(path, memory_map=True) for path in paths],
+                             promote_options='permissive')
+    # The file format holds one dictionary per column for all batches
+    table = table.unify_dictionaries().replace_schema_metadata(metadata)
+
+    target = sidecar_path(file_path) if into_sidecar else new_segment_path(file_path)
+    tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with pa.ipc.new_file(tmp_path, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    if into_sidecar:
+        return table.num_rows, []
+    return base_rows, [(target, table.num_rows)]
+
+
+def _coerce(values, field):
+    """Appended values of one column as an upload would have parsed them, and their kind
+
+    Raises ValueError when a value cannot be read as the column's type.
+    """
+    arrow_type = field.type
+    if pa.types.is_dictionary(arrow_type) or pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return values.astype('string'), 'string'
+    if pa.types.is_boolean(arrow_type):
+        values = values.infer_objects()
+        if not pd.api.types.is_bool_dtype(values):
+            raise ValueError(f"Column {field.name} only holds true/false values")
+        return values, 'bool'
+    if pa.types.is_timestamp(arrow_type):
+        try:
+            dates = pd.to_datetime(values, errors='coerce', format='mixed')
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Column {field.name}: {e}")
+        _reject_unparsed(values, dates, field.name, 'date')
+        if arrow_type.tz is None and dates.dt.tz is not None:
+            dates = dates.dt.tz_convert(None)
+        elif arrow_type.tz is not None:
+            dates = dates.dt.tz_convert(arrow_type.tz) if dates.dt.tz is not None else dates.dt.tz_localize(arrow_type.tz)
+        return dates, 'datetime'
+    if pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type):
+        numbers = pd.to_numeric(values, errors='coerce')
+        _reject_unparsed(values, numbers, field.name, 'number')
+        numbers = numbers.astype('float64')
+        # Integer columns never hold nulls; like an upload, a null or a fraction makes them floats
+        if pa.types.is_integer(arrow_type) and numbers.notna().all() and (numbers % 1 == 0).all():
+            return numbers.astype('int64'), 'int'
+        return numbers, 'float'
+    raise ValueError(f"Column {field.name} has type {arrow_type}, which cannot be appended to")
+
+
+def _reject_unparsed(values, parsed, col, kind):
+    unparsed = parsed.isna() & values.notna()
+    if unparsed.any():
+        raise ValueError(f"Column {col}: {values[unparsed].iloc[0]!r} is not a {kind}")
+
+
+def _widened_type(arrow_type, kind, stats, profile):
+    """Arrow type holding the old and new values of a column
+
+    Older segments keep their narrower types; reads widen them (see columnar.read_table).
+    """
+    if pa.types.is_integer(arrow_type):
+        if kind == 'float':
+            return pa.float64()
+        lo = min(stats.min, profile['min']) if profile['min'] is not None else stats.min
+        hi = max(stats.max, profile['max']) if profile['max'] is not None else stats.max
+        for info, int_type in _INT_TYPES:
+            if lo is None or (info.min <= lo and hi <= info.max):
+                return arrow_type if int_type.bit_width <= arrow_type.bit_width else int_type
+    if pa.types.is_float32(arrow_type) and not stats.float32_exact:
+        return pa.float64()
+    return arrow_type
+
+
+def _extend_dictionary(values, path, col):
+    """The column's dictionary in the file at ``path`` followed by the new values; old values keep their indices"""
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        dictionary = reader.get_batch(0).column(col).dictionary if reader.num_record_batches else \
+            pa.array([], type=pa.string())
+    known = set(dictionary.to_pylist())
+    added = sorted(set(values.dropna().unique()) - known)
+    return pa.concat_arrays([dictionary, pa.array(added, type=pa.string())])
+
+
+def _rebuild_sketch(file_path, col, arrow_type, rows):
+    """Sketch of a stored column, for sidecars written before sketches were saved with them"""
+    values = read_columns(file_path, [col], limit=rows)[col]
+    if pa.types.is_integer(arrow_type):
+        values = values.astype('int64')
+    elif pa.types.is_floating(arrow_type):
+        values = values.astype('float64')
+    sketch = HyperLogLog()
+    sketch.update(values)
+    return sketch
+
+
+def _profile_value(value, kind):
+    return pd.Timestamp(value) if kind == 'datetime' else value
+
+
+def _merge_profile(old, stats, kind, sketch, distinct):
+    """A column's profile after appending rows described by ``stats``"""
+    profile = dict(old)
+    if old['kind'] is not None:
+        kind = 'float' if {old['kind'], kind} == {'int', 'float'} else old['kind']
+    profile['kind'] = kind
+    profile['rows'] = old['rows'] + stats.count
+    profile['nulls'] = old['nulls'] + stats.nulls
+
+    if kind in ('int', 'float', 'datetime') and stats.min is not None:
+        lo, hi = stats.min, stats.max
+        if old['min'] is None:
+            increasing, decreasing = stats.increasing, stats.decreasing
+        else:
+            old_lo, old_hi = _profile_value(old['min'], kind), _profile_value(old['max'], kind)
+            # Ingest reports a constant column as increasing, though it is just as much decreasing
+            was_decreasing = old['monotonic'] == 'decreasing' or (old['monotonic'] == 'increasing' and old_lo == old_hi)
+            increasing = old['monotonic'] == 'increasing' and stats.increasing and lo >= old_hi
+            decreasing = was_decreasing and stats.decreasing and hi <= old_lo
+            lo, hi = min(lo, old_lo), max(hi, old_hi)
+        profile['min'], profile['max'] = _json_scalar(lo), _json_scalar(hi)
+        profile['monotonic'] = 'increasing' if increasing else 'decreasing' if decreasing else None
+
+    profile['distinct'] = distinct if distinct is not None else sketch.estimate()
+    profile['distinct_exact'] = distinct is not None
+    profile['year_like'] = (kind in ('int', 'float') and profile['min'] is not None
+                            and _YEAR_RANGE[0] < profile['min'] and profile['max'] < _YEAR_RANGE[1])
+    return profile
+
+
+def _carry_forward(file_instance, entries, offset, chunk_frame):
+    """Store what this process derived from the old rows, extended with the appended ``chunk_frame``
+
+    ``entries`` are the store entries of the dataset before the append.
+    Preview samples, raw column Series and anything that cannot be
+    extended are dropped and rebuilt on demand.
+    """
+    chunk = TypedColumns(chunk_frame)
+    start = len(dataset_prefix(file_instance))
+    typed = {key[start + 2:]: value for key, value, _ in entries
+             if key[start:start + 2] == ('typed', False)}
+    extended = extend_typed(typed, chunk, offset)
+    for (kind, col), value in extended.items():
+        dataset_store.put(dataset_key(file_instance, 'typed', False, kind, col), value, _entry_bytes(value))
+
+    ticks = {}
+    for key, value, nbytes in entries:
+        kind, parts = key[start], key[start + 1:]
+        try:
+            if kind == 'columns':
+                new = value
+            elif kind == 'groups' and parts[2] is False:
+                new = _extend_groups(value, parts, chunk, extended)
+            elif kind == 'summary' and parts[1] is False:
+                new = _extend_summary(value, parts, chunk)
+            elif kind == 'filter' and parts[0] is False:
+                new = concat_rows(value, select_rows(chunk, json.loads(parts[1])), offset)
+            elif kind == 'ohlc':
+                x_column, columns, timeframe = parts
+                if (x_column, columns) not in ticks:
+                    ticks[x_column, columns] = base_frame(chunk_frame[x_column], chunk_frame[list(columns)],
+                                                          list(columns))
+                new = append_ticks(value, ticks[x_column, columns], timeframe, list(columns))
+            else:
+                new = None
+        except ValueError:
+            new = None
+        if new is not None:
+            dataset_store.put(dataset_key(file_instance, *key[start:]), new, _entry_bytes(new))
+
+
+def _extend_groups(groups, parts, chunk, extended):
+    x_column, y_column, _, row_filter = parts
+    selected = chunk if row_filter is None else chunk.select(select_rows(chunk, json.loads(row_filter)))
+    new = group_totals(selected, x_column, y_column)
+    codes = extended.get(('codes', x_column))
+    if codes is not None:
+        labels = codes[1]
+    elif row_filter is None:
+        # Unfiltered totals hold every old category, so new ones simply follow
+        labels = list(groups[0]) + [label for label in new[0] if label not in set(groups[0])]
+    else:
+        return None
+    return merge_groups(groups, new, labels)
+
+
+def _extend_summary(summary, parts, chunk):
+    column, _, row_filter = parts
+    selected = chunk if row_filter is None else chunk.select(select_rows(chunk, json.loads(row_filter)))
+    # The stored summary may be in use by a chart being drawn, so the merge goes into a copy
+    new = copy.deepcopy(summary)
+    new.update(selected.numeric(column)[selected.valid(column)])
+    return new
+
+
+def _entry_bytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if isinstance(value, tuple):
+        return sum(_entry_bytes(part) for part in value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes + (64 * len(value) if value.dtype == object else 0)
+    if isinstance(value, ColumnSummary):
+        return value.nbytes()
+    return 0
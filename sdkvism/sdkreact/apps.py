@@ -1,6 +1,24 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_started
+
+
+def _reclaim_stale_uploads(**kwargs):
+    # Once per process, on its first request: ready() must not query the database
+    request_started.disconnect(dispatch_uid='sdkreact.reclaim_stale_uploads')
+    from .uploads import reclaim_stale_uploads
+    reclaim_stale_uploads()
 
 
 class SdkreactConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sdkreact'
+
+    def ready(self):
+        # With gunicorn --preload this runs once in the master, and the forked
+        # workers share the loaded plotting stack and font cache copy-on-write
+        if settings.RENDER_WARMUP:
+            from .charts import warmup
+            warmup()
+        # Uploads left processing by a process that died are failed at startup
+        request_started.connect(_reclaim_stale_uploads, dispatch_uid='sdkreact.reclaim_stale_uploads')
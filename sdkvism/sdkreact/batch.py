@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+
+from .chart_cache import chart_cache, chart_cache_key
+from .specs import ChartError, parse_chart_spec
+from .datasets import get_chart_frame, get_filter_rows, get_frame, get_typed_columns, uses_raw_rows
+
+
+def parse_batch(charts, available_columns):
+    """Validate every spec of a batch before anything is loaded or rendered"""
+    if not isinstance(charts, list) or len(charts) == 0:
+        raise ChartError("Please provide a list of chart specs")
+    if len(charts) > settings.CHART_BATCH_MAX_CHARTS:
+        raise ChartError(f"At most {settings.CHART_BATCH_MAX_CHARTS} charts per batch")
+
+    specs = []
+    for index, data in enumerate(charts):
+        if not isinstance(data, dict):
+            raise ChartError(f"Chart {index}: spec must be an object")
+        try:
+            specs.append(parse_chart_spec(data, available_columns))
+        except ChartError as e:
+            raise ChartError(f"Chart {index}: {e}", status=e.status)
+    return specs
+
+
+def render_batch(file_instance, specs, image_format='png'):
+    """Yield ``(index, result, cache_status)`` for each spec as it finishes
+
+    Cached charts come out first. The remaining raw specs share one frame
+    holding the union of their columns and the dataset's typed column arrays,
+    each narrowed to the rows its filter keeps; aggregated and stock specs
+    draw from their cached groups or OHLC bars. All of them are rendered on
+    a thread pool. A failed chart yields its ChartError as the result
+    instead of stopping the batch.
+    """
+    from .charts import render_chart
+
+    cache = chart_cache()
+    pending = {}
+    for index, spec in enumerate(specs):
+        cache_key = chart_cache_key(file_instance, spec, image_format)
+        result = cache.get(cache_key)
+        if result is None:
+            pending[index] = cache_key
+        else:
+            yield index, result, "hit"
+
+    if not pending:
+        return
+
+    # Full and preview specs each share one frame of the union of their columns
+    columns = {False: [], True: []}
+    for index in pending:
+        if uses_raw_rows(specs[index]):
+            columns[specs[index]['preview']] += [specs[index]['x_column']] + specs[index]['y_columns']
+    frames = {preview: get_frame(file_instance, cols, preview) for preview, cols in columns.items() if cols}
+    typed = {preview: get_typed_columns(file_instance, preview) for preview in frames}
+
+    def _render(index):
+        spec = specs[index]
+        if uses_raw_rows(spec):
+            preview = spec['preview']
+            try:
+                rows = get_filter_rows(file_instance, spec['filter'], preview)
+            except ValueError as e:
+                raise ChartError(str(e))
+            if rows is None:
+                image, meta = render_chart(frames[preview], spec, image_format, typed[preview])
+            else:
+                image, meta = render_chart(frames[preview].iloc[rows], spec, image_format,
+                                           typed[preview].select(rows))
+        else:
+            try:
+                chart_frame = get_chart_frame(file_instance, spec)
+            except ValueError as e:
+                raise ChartError(str(e))
+            image, meta = render_chart(chart_frame, spec, image_format)
+        result = {"image": image, **meta}
+        cache.set(pending[index], result)
+        return result
+
+    executor = ThreadPoolExecutor(max_workers=min(settings.CHART_BATCH_WORKERS, len(pending)))
+    try:
+        futures = {executor.submit(_render, index): index for index in pending}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), "miss"
+            except ChartError as e:
+                yield futures[future], e, "miss"
+    finally:
+        # A client that drops a stream mid-batch should not keep the pool busy
+        executor.shutdown(wait=False, cancel_futures=True)
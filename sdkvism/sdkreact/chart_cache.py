@@ -0,0 +1,38 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def chart_cache():
+    return caches[settings.CHART_CACHE_ALIAS]
+
+
+def chart_cache_key(file_instance, spec, image_format='png'):
+    """Content address of a rendered chart: dataset version, the rows it reads and normalized spec"""
+    # Render workers import this module without Django models, which datasets needs
+    from .datasets import chart_watermark
+
+    return 'chart:' + _chart_digest(file_instance, spec, image_format, chart_watermark(file_instance, spec))
+
+
+def chart_etag(file_instance, spec, image_format='png'):
+    """Strong ETag of a chart, from the dataset row and spec alone so it never loads any data
+
+    Unlike the cache key it changes on every append, even for filtered
+    charts whose filter keeps none of the new rows.
+    """
+    return _chart_digest(file_instance, spec, image_format, file_instance.rows)
+
+
+def _chart_digest(file_instance, spec, image_format, rows):
+    payload = json.dumps({
+        'dataset': file_instance.pk,
+        'version': file_instance.version,
+        'rows': rows,
+        'file': file_instance.file.name,
+        'spec': spec,
+        'format': image_format,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
@@ -0,0 +1,195 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from . import distributions, downsample, ohlc
+from .specs import FIGURE_DPI, FIGURE_SIZE, SCATTER_CELL_PX
+from .typed import TypedColumns
+
+DATA_CONTENT_TYPES = {
+    'json': 'application/json',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+# Scatter data is binned on the same grid as a rendered scatter chart
+_SCATTER_GRID = (FIGURE_SIZE[0] * FIGURE_DPI // SCATTER_CELL_PX, FIGURE_SIZE[1] * FIGURE_DPI // SCATTER_CELL_PX)
+
+
+def _long(names, xs, ys):
+    """Stack per-series x/y arrays into series, x and y columns"""
+    lengths = [len(x) for x in xs]
+    return {
+        'series': np.repeat(np.asarray(names, dtype=object), lengths),
+        'x': np.concatenate(xs) if xs else np.array([]),
+        'y': np.concatenate(ys) if ys else np.array([]),
+    }
+
+
+def _line_columns(typed, spec):
+    x_column = spec['x_column']
+    x_values, x_positions = typed.axis(x_column), typed.positions(x_column)
+    method = spec['downsample'] if spec['downsample'] in downsample.LINE_METHODS + ('none',) else 'lttb'
+    xs, ys = [], []
+    for y_col in spec['y_columns']:
+        y_values = typed.numeric(y_col)
+        rows = downsample.reduce_line(x_positions, y_values, method, spec['max_points'])
+        xs.append(x_values[rows])
+        ys.append(y_values[rows])
+    return _long(spec['y_columns'], xs, ys)
+
+
+def _scatter_columns(typed, spec):
+    x_column = spec['x_column']
+    method = 'none' if spec['downsample'] == 'none' or typed.is_categorical(x_column) else 'bin'
+    x_values = typed.axis(x_column)
+    xs, ys = [], []
+    for y_col in spec['y_columns']:
+        y_values = typed.numeric(y_col)
+        binned = downsample.reduce_scatter(typed.positions(x_column), y_values, method, _SCATTER_GRID)
+        if binned is None:
+            xs.append(x_values)
+            ys.append(y_values)
+        else:
+            cx, cy = binned
+            xs.append(cx.astype('int64').astype('datetime64[ns]') if typed.is_datetime(x_column) else cx)
+            ys.append(cy)
+    return _long(spec['y_columns'], xs, ys)
+
+
+def _category_columns(typed, spec):
+    x_values = typed.axis(spec['x_column'])
+    return _long(spec['y_columns'], [x_values] * len(spec['y_columns']),
+                 [typed.numeric(y_col) for y_col in spec['y_columns']])
+
+
+def _histogram_columns(summaries, spec):
+    names, starts, ends, counts = [], [], [], []
+    for y_col, summary in zip(spec['y_columns'], summaries):
+        counted, edges = distributions.histogram_bins(summary)
+        names.append(np.full(len(counted), y_col, dtype=object))
+        starts.append(edges[:-1])
+        ends.append(edges[1:])
+        counts.append(counted)
+    return {
+        'series': np.concatenate(names),
+        'x': np.concatenate(starts),
+        'x_end': np.concatenate(ends),
+        'y': np.concatenate(counts),
+    }
+
+
+def _summary_columns(summaries, spec):
+    """Five-number summary, mean and count of each series, for box and violin charts"""
+    names = ('min', 'q1', 'median', 'q3', 'max', 'mean')
+    columns = {'series': np.asarray(spec['y_columns'], dtype=object)}
+    for name in names:
+        columns[name] = np.array([summary.get(name, np.nan) for summary in summaries], dtype='float64')
+    columns['count'] = np.array([summary['count'] for summary in summaries], dtype='float64')
+    return columns
+
+
+def _stock_columns(level, spec):
+    names = ('open', 'high', 'low', 'close', 'volume')
+    columns = {'x': level.index.to_numpy(dtype='datetime64[ns]')}
+    for name, column in zip(names, ohlc.ohlc_columns(spec)):
+        columns[name] = level[column].to_numpy(dtype='float64', na_value=np.nan)
+    return columns
+
+
+_BUILDERS = {
+    'line': _line_columns,
+    'area': _line_columns,
+    'combo': _line_columns,
+    'scatter': _scatter_columns,
+    'bar': _category_columns,
+    'pie': _category_columns,
+    'funnel': _category_columns,
+    'sunburst': _category_columns,
+    'waterfall': _category_columns,
+}
+
+# Distribution charts are built from their columns' summaries (see distributions.py)
+_SUMMARY_BUILDERS = {
+    'histogram': _histogram_columns,
+    'box': _summary_columns,
+    'violin': _summary_columns,
+}
+
+
+def chart_columns(uploaded_data, spec, typed=None):
+    """The reduced data a chart would draw, as named NumPy columns
+
+    Line, area and combo series are downsampled and scatter series binned as
+    for rendering; category charts give their (aggregated) values, histograms
+    their bins, box and violin charts a per-series summary and stock charts
+    their OHLC bars. Series that share a table are stacked, tagged by ``series``.
+    """
+    if spec['graph_type'] == 'stock':
+        return _stock_columns(uploaded_data, spec)
+    if typed is None:
+        typed = TypedColumns(uploaded_data)
+    if distributions.is_summarized(spec):
+        return _SUMMARY_BUILDERS[spec['graph_type']](distributions.summaries(uploaded_data, spec, typed), spec)
+    return _BUILDERS[spec['graph_type']](typed, spec)
+
+
+def _x_type(values):
+    if np.issubdtype(values.dtype, np.datetime64):
+        return 'datetime'
+    if values.dtype == object:
+        return 'category'
+    return 'number'
+
+
+def _json_values(values):
+    if np.issubdtype(values.dtype, np.datetime64):
+        # Epoch milliseconds, null for NaT
+        millis = values.astype('datetime64[ms]').astype('int64').astype(object)
+        millis[np.isnat(values)] = None
+        return millis.tolist()
+    if values.dtype.kind == 'f':
+        return np.where(np.isfinite(values), values, None).tolist()
+    if values.dtype == object:
+        return np.where(pd.isna(values), None, values.astype(str)).tolist()
+    return values.tolist()
+
+
+def encode_columns(columns, meta, encoding):
+    """Serialize chart columns as compact JSON or an Arrow IPC stream
+
+    JSON carries ``meta`` at the top level next to the column lists (dates as
+    epoch milliseconds); Arrow carries it as schema metadata.
+    """
+    x = columns.get('x')
+    meta = {**meta, 'x_type': None if x is None else _x_type(x)}
+    if encoding == 'json':
+        payload = {**meta, 'columns': {name: _json_values(values) for name, values in columns.items()}}
+        return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+    table = pa.table({name: pa.array(values, from_pandas=True) for name, values in columns.items()})
+    table = table.replace_schema_metadata({key: json.dumps(value) for key, value in meta.items()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _window_bound(value):
+    if isinstance(value, np.datetime64):
+        return int(value.astype('datetime64[ms]').astype('int64'))
+    return float(value)
+
+
+def chart_data(uploaded_data, spec, encoding, typed=None):
+    """Encode a chart's reduced data and return it with the chart's metadata"""
+    columns = chart_columns(uploaded_data, spec, typed)
+    meta = {
+        "graph_type": spec['graph_type'],
+        "points_rendered": len(next(iter(columns.values()))),
+        "approximate": spec['preview'],
+    }
+    if 'x_window' in uploaded_data.attrs:
+        meta["x_window"] = [_window_bound(bound) for bound in uploaded_data.attrs['x_window']]
+    return encode_columns(columns, meta, encoding), meta
@@ -0,0 +1,408 @@
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.dates as mdates
+import matplotlib.style
+import numpy as np
+from io import BytesIO
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.ticker import MaxNLocator
+
+from . import distributions, downsample, ohlc, timing
+from .specs import FIGURE_DPI, FIGURE_SIZE, IMAGE_CONTENT_TYPES, SCATTER_CELL_PX, ChartError, parse_chart_spec
+from .typed import TypedColumns
+
+STOCK_FIGURE_SIZE = (15, 7)
+# seaborn's "tab10" palette, without importing seaborn
+_PALETTE = matplotlib.colormaps['tab10'].colors
+
+# Chart types that get no series legend or grid
+_NO_LEGEND = ('pie', 'sunburst', 'funnel')
+
+
+def _resolve_style():
+    """Apply the chart style to the global rcParams once, at import time
+
+    Figures copy rcParams when they are created, so after this no request
+    touches matplotlib's global state and renders can run on many threads.
+    """
+    for style in ('seaborn-v0_8', 'seaborn'):
+        try:
+            matplotlib.style.use(style)
+            return style
+        except (OSError, ValueError):
+            continue
+    import seaborn as sns
+    sns.set_style("whitegrid")
+    return 'whitegrid'
+
+
+CHART_STYLE = _resolve_style()
+
+
+def _series_colors(spec):
+    y_columns = spec['y_columns']
+    custom_colors = spec['colors']
+    if spec['color_all'] and custom_colors:
+        return [custom_colors[0]] * len(y_columns)
+    if custom_colors and len(custom_colors) >= len(y_columns):
+        return custom_colors[:len(y_columns)]
+    return [_PALETTE[i % len(_PALETTE)] for i in range(len(y_columns))]
+
+
+def _limit_category_ticks(ax, categorical, points_rendered, points_total):
+    """Stop a downsampled text x-axis from labelling every surviving point"""
+    if points_rendered < points_total and categorical:
+        ax.xaxis.set_major_locator(MaxNLocator(nbins=12))
+
+
+def _line_method(spec):
+    if spec['downsample'] in downsample.LINE_METHODS + ('none',):
+        return spec['downsample']
+    return 'lttb'
+
+
+def _numeric_y(typed, y_col, graph_type):
+    mask = typed.valid(y_col)
+    if not mask.any():
+        raise ChartError(f"Y-axis column must contain numeric values for {graph_type} chart.")
+    return typed.numeric(y_col), mask
+
+
+def render_line(ax, uploaded_data, spec, colors, typed):
+    x_column, y_columns = spec['x_column'], spec['y_columns']
+    x_values, x_positions = typed.axis(x_column), typed.positions(x_column)
+    points_rendered = 0
+    for i, y_col in enumerate(y_columns):
+        y_values = typed.numeric(y_col)
+        rows = downsample.reduce_line(x_positions, y_values, _line_method(spec), spec['max_points'])
+        points_rendered += len(x_values[rows])
+        ax.plot(x_values[rows], y_values[rows],
+                color=colors[i],
+                marker='o' if len(y_columns) < 5 else '',
+                linewidth=2,
+                label=y_col)
+    _limit_category_ticks(ax, typed.is_categorical(x_column), points_rendered, len(uploaded_data) * len(y_columns))
+    return points_rendered
+
+
+def render_bar(ax, uploaded_data, spec, colors, typed):
+    x_column, y_columns = spec['x_column'], spec['y_columns']
+    width = 0.8 / len(y_columns)
+    x_positions = np.arange(len(uploaded_data))
+
+    for i, y_col in enumerate(y_columns):
+        ax.bar(x_positions + i * width,
+               typed.numeric(y_col),
+               width=width,
+               color=colors[i],
+               alpha=0.8,
+               label=y_col)
+
+    ax.set_xticks(x_positions + (len(y_columns)-1)*width/2,
+                  typed.axis(x_column))
+    return len(uploaded_data) * len(y_columns)
+
+
+def render_pie(ax, uploaded_data, spec, colors, typed):
+    if len(spec['y_columns']) > 1:
+        raise ChartError("Pie chart supports only one Y column")
+
+    numeric_values, mask = _numeric_y(typed, spec['y_columns'][0], 'pie')
+    ax.pie(numeric_values[mask],
+           labels=typed.axis(spec['x_column'])[mask],
+           autopct='%1.1f%%',
+           colors=colors[:int(mask.sum())],
+           startangle=90,
+           wedgeprops={'linewidth': 1, 'edgecolor': 'white'})
+    return int(mask.sum())
+
+
+def render_area(ax, uploaded_data, spec, colors, typed):
+    x_column, y_columns = spec['x_column'], spec['y_columns']
+    x_values, x_positions = typed.axis(x_column), typed.positions(x_column)
+    points_rendered = 0
+    for i, y_col in enumerate(y_columns):
+        y_values = typed.numeric(y_col)
+        rows = downsample.reduce_line(x_positions, y_values, _line_method(spec), spec['max_points'])
+        points_rendered += len(x_values[rows])
+        ax.fill_between(x_values[rows],
+                        y_values[rows],
+                        color=colors[i],
+                        alpha=0.4,
+                        label=y_col)
+        ax.plot(x_values[rows],
+                y_values[rows],
+                color=colors[i],
+                alpha=0.8,
+                linewidth=1)
+    _limit_category_ticks(ax, typed.is_categorical(x_column), points_rendered, len(uploaded_data) * len(y_columns))
+    return points_rendered
+
+
+def render_scatter(ax, uploaded_data, spec, colors, typed):
+    x_column = spec['x_column']
+    # Text x columns have no meaningful 2D binning and are drawn as-is
+    method = 'none' if spec['downsample'] == 'none' or typed.is_categorical(x_column) else 'bin'
+    grid = (FIGURE_SIZE[0] * FIGURE_DPI // SCATTER_CELL_PX, FIGURE_SIZE[1] * FIGURE_DPI // SCATTER_CELL_PX)
+    x_values = typed.axis(x_column)
+    points_rendered = 0
+    for i, y_col in enumerate(spec['y_columns']):
+        y_values = typed.numeric(y_col)
+        binned = downsample.reduce_scatter(typed.positions(x_column), y_values, method, grid)
+        if binned is None:
+            xs, ys = x_values, y_values
+        else:
+            xs, ys = binned
+            if typed.is_datetime(x_column):
+                xs = xs.astype('int64').astype('datetime64[ns]')
+        points_rendered += len(xs)
+        ax.scatter(xs,
+                   ys,
+                   color=colors[i],
+                   s=100,
+                   alpha=0.7,
+                   label=y_col)
+    return points_rendered
+
+
+def render_histogram(ax, uploaded_data, spec, colors, typed):
+    points_rendered = 0
+    for i, (y_col, summary) in enumerate(zip(spec['y_columns'], distributions.summaries(uploaded_data, spec, typed))):
+        counts, edges = distributions.histogram_bins(summary)
+        # One weighted value per bin draws the same bars as every raw value would
+        ax.hist(edges[:-1],
+                bins=edges,
+                weights=counts,
+                color=colors[i],
+                alpha=0.7,
+                label=y_col)
+        points_rendered += len(counts)
+    return points_rendered
+
+
+def _summaries(uploaded_data, spec, typed):
+    summaries = distributions.summaries(uploaded_data, spec, typed)
+    if any(summary['count'] == 0 for summary in summaries):
+        raise ChartError(f"Y-axis column must contain numeric values for {spec['graph_type']} chart.")
+    return summaries
+
+
+def render_box(ax, uploaded_data, spec, colors, typed):
+    y_columns = spec['y_columns']
+    summaries = _summaries(uploaded_data, spec, typed)
+    box = ax.bxp([distributions.box_stats(summary, y_col) for y_col, summary in zip(y_columns, summaries)],
+                 patch_artist=True)
+    ax.set_xticks(range(1, len(y_columns)+1), y_columns)
+
+    for patch, color in zip(box['boxes'], colors):
+        patch.set_facecolor(color)
+        patch.set_alpha(0.7)
+    # Five statistics per box plus the outliers drawn
+    return sum(5 + len(summary['fliers']) for summary in summaries)
+
+
+def render_violin(ax, uploaded_data, spec, colors, typed):
+    y_columns = spec['y_columns']
+    violin = ax.violin([distributions.violin_stats(summary) for summary in _summaries(uploaded_data, spec, typed)],
+                       showmeans=True,
+                       showmedians=True)
+
+    for patch, color in zip(violin['bodies'], colors):
+        patch.set_facecolor(color)
+        patch.set_alpha(0.7)
+
+    ax.set_xticks(range(1, len(y_columns)+1), y_columns)
+    return distributions.VIOLIN_POINTS * len(y_columns)
+
+
+def render_funnel(ax, uploaded_data, spec, colors, typed):
+    x_column, y_col = spec['x_column'], spec['y_columns'][0]
+    ax.barh(typed.axis(x_column),
+            typed.numeric(y_col),
+            color=colors[:len(uploaded_data)])
+    ax.invert_yaxis()
+    return len(uploaded_data)
+
+
+def render_sunburst(ax, uploaded_data, spec, colors, typed):
+    if len(spec['y_columns']) != 1:
+        raise ChartError("Sunburst chart needs exactly one Y column")
+
+    numeric_values, mask = _numeric_y(typed, spec['y_columns'][0], 'sunburst')
+    ax.pie(numeric_values[mask],
+           labels=typed.axis(spec['x_column'])[mask],
+           autopct='%1.1f%%',
+           colors=colors[:int(mask.sum())],
+           startangle=90,
+           wedgeprops=dict(width=0.5, edgecolor='w'))
+    return int(mask.sum())
+
+
+def render_waterfall(ax, uploaded_data, spec, colors, typed):
+    x_column, y_col = spec['x_column'], spec['y_columns'][0]
+    steps = typed.numeric(y_col)
+    # A missing step draws no bar but leaves the running total where it was
+    filled = np.nan_to_num(steps)
+    ax.bar(typed.axis(x_column),
+           steps,
+           bottom=np.cumsum(filled) - filled,
+           color=colors[:len(uploaded_data)])
+    return len(uploaded_data)
+
+
+def render_combo(ax, uploaded_data, spec, colors, typed):
+    x_column, y_columns = spec['x_column'], spec['y_columns']
+    if len(y_columns) < 2:
+        raise ChartError("Combo chart needs at least 2 Y columns")
+
+    # Each series is downsampled as on a line chart, matching its chart data
+    x_values, x_positions = typed.axis(x_column), typed.positions(x_column)
+    series = []
+    for y_col in y_columns:
+        y_values = typed.numeric(y_col)
+        rows = downsample.reduce_line(x_positions, y_values, _line_method(spec), spec['max_points'])
+        series.append((x_values[rows], y_values[rows]))
+
+    ax.bar(*series[0],
+           color=colors[0],
+           alpha=0.7,
+           label=y_columns[0])
+
+    ax.plot(*series[1],
+            color=colors[1],
+            marker='o',
+            linewidth=2,
+            label=y_columns[1])
+
+    markers = ['s', '^', 'D', 'v', 'p', '*']
+    for i in range(2, len(y_columns)):
+        ax.plot(*series[i],
+                color=colors[i],
+                marker=markers[(i-2) % len(markers)],
+                linewidth=2,
+                label=y_columns[i])
+    points_rendered = sum(len(x) for x, _ in series)
+    _limit_category_ticks(ax, typed.is_categorical(x_column), points_rendered, len(uploaded_data) * len(y_columns))
+    return points_rendered
+
+
+def render_stock(ax, uploaded_data, spec, colors, typed):
+    """Draw candles from an OHLC level (see ohlc.py), not from raw ticks"""
+    from mplfinance.original_flavor import candlestick_ohlc
+
+    y_columns = spec['y_columns']
+    timeframe = spec['timeframe']
+
+    try:
+        dates = mdates.date2num(uploaded_data.index)
+        candles = np.column_stack([dates, uploaded_data[y_columns[:4]].to_numpy(dtype='float64')])
+
+        ax.figure.set_size_inches(*STOCK_FIGURE_SIZE)
+        candlestick_ohlc(ax, candles, width=0.6 * ohlc.TIMEFRAMES[timeframe][2],
+                         colorup='g', colordown='r')
+
+        ax.xaxis_date()
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d %H:%M'))
+        ax.tick_params(axis='x', labelrotation=45)
+        ax.set_title(f'Stock Price ({timeframe} timeframe)')
+        ax.set_xlabel('Date/Time')
+        ax.set_ylabel('Price')
+
+        if len(y_columns) > 4:
+            ax2 = ax.twinx()
+            ax2.bar(uploaded_data.index, uploaded_data[y_columns[4]],
+                    width=0.01, alpha=0.3, color='blue')
+            ax2.set_ylabel('Volume', color='blue')
+    except Exception as e:
+        raise ChartError(f"Failed to generate stock chart: {str(e)}")
+
+    return len(candles)
+
+
+RENDERERS = {
+    'line': render_line,
+    'bar': render_bar,
+    'pie': render_pie,
+    'area': render_area,
+    'scatter': render_scatter,
+    'histogram': render_histogram,
+    'box': render_box,
+    'violin': render_violin,
+    'funnel': render_funnel,
+    'sunburst': render_sunburst,
+    'waterfall': render_waterfall,
+    'combo': render_combo,
+    'stock': render_stock,
+}
+
+
+def render_chart(uploaded_data, spec, image_format='png', typed=None):
+    """Render a validated chart spec and return the encoded image with its metadata
+
+    Each call builds its own Figure on an Agg canvas and never goes through
+    pyplot, so concurrent renders on different threads cannot interfere.
+    Pass the dataset's ``typed`` columns (see typed.py) to reuse arrays
+    already coerced for earlier charts; otherwise ``uploaded_data`` is
+    coerced just for this one.
+    """
+    graph_type = spec['graph_type']
+    colors = _series_colors(spec)
+
+    try:
+        with timing.stage('draw'):
+            fig = Figure(figsize=FIGURE_SIZE)
+            FigureCanvasAgg(fig)
+            ax = fig.add_subplot()
+
+            if typed is None:
+                typed = TypedColumns(uploaded_data)
+            points_rendered = RENDERERS[graph_type](ax, uploaded_data, spec, colors, typed)
+            if 'x_window' in uploaded_data.attrs:
+                # A tile spans its whole x range even where it has no rows
+                ax.set_xlim(*uploaded_data.attrs['x_window'])
+
+            if graph_type != 'stock':
+                ax.set_xlabel(spec['x_column'], fontsize=12)
+                ax.set_ylabel("Values", fontsize=12)
+                ax.set_title(f"{graph_type.capitalize()} Chart", fontsize=14)
+
+                if graph_type not in _NO_LEGEND:
+                    ax.legend(fontsize=10, bbox_to_anchor=(1.05, 1), loc='upper left')
+                    ax.grid(True, linestyle='--', alpha=0.7)
+
+        with timing.stage('layout'):
+            fig.tight_layout()
+
+        with timing.stage('encode'):
+            buffer = BytesIO()
+            fig.savefig(buffer, format=image_format, dpi=FIGURE_DPI)
+            image = buffer.getvalue()
+            buffer.close()
+        timing.size('encode', len(image))
+    except ChartError:
+        raise
+    except Exception as e:
+        raise ChartError(f"Graph generation failed: {str(e)}", status=500)
+
+    return image, {
+        "graph_type": graph_type,
+        "colors_used": colors[:len(spec['y_columns'])],
+        "points_rendered": points_rendered,
+        "approximate": spec['preview'],
+    }
+
+
+def warmup():
+    """Pay the first render's one-off costs now: font cache, text layout, image encoders
+
+    Called from AppConfig.ready() (see RENDER_WARMUP) and by render farm
+    workers as they start.
+    """
+    import mplfinance.original_flavor  # noqa: F401 - loaded lazily by render_stock
+    import pandas as pd
+
+    frame = pd.DataFrame({'x': [0, 1], 'y': [0, 1]})
+    spec = parse_chart_spec({'x_column': 'x', 'y_columns': ['y']}, frame.columns)
+    for image_format in IMAGE_CONTENT_TYPES:
+        render_chart(frame, spec, image_format)
@@ -0,0 +1,231 @@
+import glob
+import json
+import os
+import shutil
+import threading
+import uuid
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from .distributions import ColumnSummary
+from .sketches import HyperLogLog
+
+SIDECAR_SUFFIX = '.feather'
+
+# Schema metadata key holding each column's distinct-count sketch
+SKETCH_METADATA_KEY = b'sdkreact.hll'
+# Schema metadata key holding each numeric column's distribution summary
+SUMMARY_METADATA_KEY = b'sdkreact.summaries'
+
+# Appended rows live in segment files next to the sidecar, listed in a manifest
+MANIFEST_SUFFIX = '.json'
+SEGMENT_SUFFIX = '.seg'
+
+# Reads start over when an append merged the segments they were about to open
+_READ_ATTEMPTS = 3
+
+
+def sidecar_path(file_path):
+    """Location of the typed columnar copy that sits next to an upload"""
+    return file_path + SIDECAR_SUFFIX
+
+
+def manifest_path(file_path):
+    return sidecar_path(file_path) + MANIFEST_SUFFIX
+
+
+def read_manifest(file_path):
+    """``(base_rows, [(path, rows)])``: rows in the sidecar itself and the segments appended to it, oldest first
+
+    ``base_rows`` is None when nothing was ever appended.
+    """
+    try:
+        with open(manifest_path(file_path)) as handle:
+            manifest = json.load(handle)
+    except FileNotFoundError:
+        return None, []
+    directory = os.path.dirname(file_path)
+    return manifest['base_rows'], [(os.path.join(directory, segment['name']), segment['rows'])
+                                   for segment in manifest['segments']]
+
+
+def read_segments(file_path):
+    return read_manifest(file_path)[1]
+
+
+def write_segments(file_path, segments, base_rows):
+    """Publish a new segment list in one atomic rename"""
+    target = manifest_path(file_path)
+    tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    manifest = {
+        'base_rows': base_rows,
+        'segments': [{'name': os.path.basename(path), 'rows': rows} for path, rows in segments],
+    }
+    try:
+        with open(tmp_path, 'w') as handle:
+            json.dump(manifest, handle)
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def new_segment_path(file_path):
+    return f"{sidecar_path(file_path)}.{uuid.uuid4().hex[:12]}{SEGMENT_SUFFIX}"
+
+
+def newest_path(file_path, segments):
+    """The segment (or the sidecar, without segments) whose schema has every column's current type"""
+    return segments[-1][0] if segments else sidecar_path(file_path)
+
+
+def _segment_files(file_path):
+    return glob.glob(glob.escape(sidecar_path(file_path)) + '.*' + SEGMENT_SUFFIX)
+
+
+def sidecar_files(file_path):
+    """Every existing file holding a sidecar's data: the sidecar, its manifest and segments"""
+    paths = [sidecar_path(file_path), manifest_path(file_path)]
+    return [path for path in paths if os.path.exists(path)] + _segment_files(file_path)
+
+
+def prune_segments(file_path):
+    """Delete segments the manifest no longer lists: merged ones and those of failed appends"""
+    listed = {path for path, _ in read_segments(file_path)}
+    for path in _segment_files(file_path):
+        if path not in listed:
+            os.remove(path)
+
+
+def count_rows(path):
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).count_rows()
+
+
+def read_column_names(file_path):
+    """Read only the schema of a sidecar"""
+    with pa.memory_map(sidecar_path(file_path)) as source:
+        return pa.ipc.open_file(source).schema.names
+
+
+def sketch_metadata(sketches):
+    """Schema metadata storing ``{column: HyperLogLog}``, so appends can keep counting distinct values"""
+    return {SKETCH_METADATA_KEY: json.dumps({col: sketch.dumps() for col, sketch in sketches.items()})}
+
+
+def read_sketches(file_path, segments=None):
+    """``{column: HyperLogLog}`` saved with the newest rows, empty for sidecars written before sketches were kept"""
+    if segments is None:
+        segments = read_segments(file_path)
+    with pa.memory_map(newest_path(file_path, segments)) as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    if SKETCH_METADATA_KEY not in metadata:
+        return {}
+    return {col: HyperLogLog.loads(text) for col, text in json.loads(metadata[SKETCH_METADATA_KEY]).items()}
+
+
+def summary_metadata(summaries):
+    """Schema metadata storing ``{column: ColumnSummary}``, so appends can extend them"""
+    return {SUMMARY_METADATA_KEY: json.dumps({col: summary.dumps() for col, summary in summaries.items()})}
+
+
+def read_summaries(file_path, segments=None, rows=None):
+    """``{column: ColumnSummary}`` saved with the newest rows, empty for sidecars written before summaries were kept
+
+    With ``rows`` they are also empty unless the sidecar and its segments
+    hold exactly that many rows, as while an append has published a
+    segment but not yet saved the new row count.
+    """
+    if segments is None:
+        base_rows, segments = read_manifest(file_path)
+        if rows is not None:
+            if base_rows is None:
+                base_rows = count_rows(sidecar_path(file_path))
+            if base_rows + sum(segment_rows for _, segment_rows in segments) != rows:
+                return {}
+    with pa.memory_map(newest_path(file_path, segments)) as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    if SUMMARY_METADATA_KEY not in metadata:
+        return {}
+    return {col: ColumnSummary.loads(data) for col, data in json.loads(metadata[SUMMARY_METADATA_KEY]).items()}
+
+
+def read_table(file_path, columns=None, limit=None):
+    """A sidecar and its appended segments as one Arrow table, memory-mapped
+
+    With ``limit`` only the first ``limit`` rows are read, so a reader that
+    knows the dataset's row count never sees rows appended after it looked.
+    Segments may have wider types than the rows before them (see
+    appends.py); the table has the widest.
+    """
+    attempt = 0
+    while True:
+        try:
+            tables = _read_tables(file_path, columns, limit)
+        except FileNotFoundError:
+            tables = None
+        if tables is not None:
+            break
+        attempt += 1
+        if attempt == _READ_ATTEMPTS:
+            raise FileNotFoundError(f"Sidecar of {file_path} kept changing while it was read")
+    table = tables[0] if len(tables) == 1 else pa.concat_tables(tables, promote_options='permissive')
+    return table if limit is None or table.num_rows <= limit else table.slice(0, limit)
+
+
+def _read_tables(file_path, columns, limit):
+    """The tables to concatenate, or None when the sidecar was merged with its segments meanwhile"""
+    # The manifest is read first: merging the segments into the sidecar
+    # replaces it before publishing an empty segment list, so a sidecar
+    # that does not hold the rows the manifest says is newer than the list
+    base_rows, segments = read_manifest(file_path)
+    tables = [feather.read_table(sidecar_path(file_path), columns=columns, memory_map=True)]
+    total = tables[0].num_rows
+    if base_rows is not None and total != base_rows:
+        return None
+    for path, rows in segments:
+        if limit is not None and total >= limit:
+            break
+        tables.append(feather.read_table(path, columns=columns, memory_map=True))
+        total += rows
+    return tables
+
+
+def read_columns(file_path, columns=None, limit=None):
+    """Load the requested columns from a sidecar without touching the others"""
+    return read_table(file_path, columns, limit).to_pandas(split_blocks=True)
+
+
+def read_rows(file_path, columns, rows, limit=None):
+    """Load only the given row positions of some columns from a sidecar"""
+    return read_table(file_path, columns, limit).take(pa.array(rows)).to_pandas(split_blocks=True)
+
+
+def has_sidecar(file_path):
+    return os.path.exists(sidecar_path(file_path))
+
+
+def link_sidecar(file_path, new_path):
+    """Give the upload at ``new_path`` the sidecar and segments of ``file_path``, as hard links where possible"""
+    base_rows, segments = read_manifest(file_path)
+    linked = [(new_segment_path(new_path), rows) for _, rows in segments]
+    for source, target in [(sidecar_path(file_path), sidecar_path(new_path))] + \
+            [(source, target) for (source, _), (target, _) in zip(segments, linked)]:
+        link_file(source, target)
+    if base_rows is not None:
+        write_segments(new_path, linked, base_rows)
+
+
+def link_file(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def remove_files(file_path):
+    """Delete an upload together with its sidecar, manifest and segments"""
+    for path in [file_path] + sidecar_files(file_path):
+        if os.path.exists(path):
+            os.remove(path)
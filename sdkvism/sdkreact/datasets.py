@@ -0,0 +1,490 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.utils import timezone
+
+from .aggregate import aggregate_frame, group_totals, is_aggregated
+from .columnar import has_sidecar, read_column_names, read_columns, read_rows, read_summaries, remove_files
+from .distributions import ColumnSummary, is_summarized
+from .filters import count_rows, filter_key, select_rows
+from .ingest import ingest_file
+from .models import UploadedFile
+from .ohlc import TIMEFRAMES, base_frame, derive_level, ohlc_columns, resample_spec
+from . import timing
+from .sketches import sample_indices
+from .tiles import tile_frame
+from .typed import TypedColumns
+
+
+class DatasetNotFound(Exception):
+    """Raised when a dataset id does not resolve to an uploaded file"""
+
+    status = 400
+
+
+class DatasetNotReady(DatasetNotFound):
+    """Raised when a dataset is still being processed, or failed to process"""
+
+    status = 409
+
+
+class LRUStore:
+    """Bounded in-process cache that evicts the least recently used entries"""
+
+    def __init__(self, max_bytes, max_items):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, nbytes):
+        """Store a value, evicting old entries until the budget fits again"""
+        with self._lock:
+            self._pop(key)
+            if nbytes > self.max_bytes:
+                # Never let a single oversized entry flush everything else
+                return value
+            self._entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            while (len(self._entries) > self.max_items
+                   or self.current_bytes > self.max_bytes):
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+        return value
+
+    def entries(self, *prefix):
+        """``(key, value, nbytes)`` of every entry whose key starts with the given prefix"""
+        with self._lock:
+            return [(key, value, nbytes) for key, (value, nbytes) in self._entries.items()
+                    if key[:len(prefix)] == prefix]
+
+    def discard(self, *prefix):
+        """Drop every entry whose key starts with the given prefix"""
+        with self._lock:
+            for key in [k for k in self._entries if k[:len(prefix)] == prefix]:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "max_items": self.max_items,
+            }
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+
+dataset_store = LRUStore(settings.DATASET_STORE_MAX_BYTES, settings.DATASET_STORE_MAX_ITEMS)
+
+
+def dataset_key(file_instance, *parts):
+    """Store key scoped to one version and row count of a dataset, so replaced or appended data is never missed"""
+    return dataset_prefix(file_instance) + parts
+
+
+def dataset_prefix(file_instance):
+    return (file_instance.pk, file_instance.version, file_instance.rows)
+
+
+def ingest_upload(file_instance, on_progress=None, columns=None, on_columns=None):
+    """Stream a new upload into its columnar sidecar, save its column profile
+    and return the column names"""
+    result = ingest_file(file_instance.file.path, on_columns=on_columns, on_progress=on_progress, columns=columns)
+    file_instance.profile = result["profile"]
+    file_instance.rows = result["rows"]
+    file_instance.status = UploadedFile.READY
+    file_instance.error = ''
+    file_instance.progress = {}
+    file_instance.save(update_fields=['profile', 'rows', 'status', 'error', 'progress'])
+    dataset_store.put(dataset_key(file_instance, 'columns'), result["columns"], 0)
+    return result["columns"]
+
+
+def discard_dataset(file_instance, file_name=None):
+    """Forget everything cached for a dataset and delete the stored file ``file_name`` with its sidecar
+
+    Files still shared with another dataset (see share_dataset) are kept.
+    """
+    dataset_store.discard(file_instance.pk)
+    if file_name and not files_shared(file_name, file_instance.pk):
+        remove_files(file_instance.file.storage.path(file_name))
+
+
+def files_shared(file_name, pk):
+    """Whether a dataset other than ``pk`` stores its data in ``file_name``"""
+    return UploadedFile.objects.filter(file=file_name).exclude(pk=pk).exists()
+
+
+def share_dataset(file_instance):
+    """A new ready dataset drawing from the same stored files as ``file_instance``
+
+    Uploads of bytes already stored get their own dataset id this way, so
+    appending to or replacing one never changes data that another client's
+    charts depend on. Appends first give the dataset its own files (see
+    appends.append_rows), and replacing or deleting it leaves shared files alone.
+    """
+    return UploadedFile.objects.create(
+        file=file_instance.file.name,
+        rows=file_instance.rows,
+        profile=file_instance.profile,
+        status=UploadedFile.READY,
+        content_hash=file_instance.content_hash,
+        last_accessed=timezone.now(),
+    )
+
+
+def get_uploaded_file(dataset_id, require_ready=True):
+    """Resolve a dataset id; a missing id raises DatasetNotFound rather than picking some other upload
+
+    Unless ``require_ready`` is False, datasets that are still processing or
+    failed to process raise DatasetNotReady.
+    """
+    if dataset_id in (None, ''):
+        raise DatasetNotFound("dataset_id is required")
+    try:
+        file_instance = UploadedFile.objects.get(pk=int(dataset_id))
+    except (UploadedFile.DoesNotExist, TypeError, ValueError):
+        raise DatasetNotFound(f"Unknown dataset: {dataset_id}")
+
+    if require_ready and file_instance.status == UploadedFile.PROCESSING:
+        raise DatasetNotReady(f"Dataset {file_instance.pk} is still processing")
+    if require_ready and file_instance.status == UploadedFile.FAILED:
+        raise DatasetNotReady(f"Dataset {file_instance.pk} failed to process: {file_instance.error}")
+    if require_ready:
+        get_profile(file_instance)
+        touch_dataset(file_instance)
+    return file_instance
+
+
+def touch_dataset(file_instance):
+    """Note that a dataset was used, writing at most once per UPLOAD_ACCESS_RESOLUTION seconds"""
+    now = timezone.now()
+    last = file_instance.last_accessed
+    if last is None or (now - last).total_seconds() >= settings.UPLOAD_ACCESS_RESOLUTION:
+        file_instance.last_accessed = now
+        UploadedFile.objects.filter(pk=file_instance.pk).update(last_accessed=now)
+
+
+def find_duplicate(content_hash):
+    """A ready dataset holding exactly these bytes (all columns imported), or None
+
+    Datasets still processing or failed, and those whose file is gone, are never reused.
+    """
+    if not content_hash:
+        return None
+    candidates = (UploadedFile.objects.filter(content_hash=content_hash, status=UploadedFile.READY)
+                  .order_by('-pk'))
+    for file_instance in candidates:
+        if os.path.exists(file_instance.file.path):
+            return file_instance
+    return None
+
+
+def get_columns(file_instance):
+    """Column names of a dataset, read from the sidecar schema on a miss"""
+    key = dataset_key(file_instance, 'columns')
+    columns = dataset_store.get(key)
+    if columns is None:
+        file_path = ensure_sidecar(file_instance)
+        columns = dataset_store.put(key, read_column_names(file_path), 0)
+    return columns
+
+
+def get_profile(file_instance):
+    """Per-column profile saved at upload
+
+    Uploads that predate profiles are processed again in the background,
+    like a new upload, and raise DatasetNotReady until that is done.
+    """
+    if not file_instance.profile:
+        # uploads imports this module
+        from .uploads import start_processing
+
+        claimed = UploadedFile.objects.filter(pk=file_instance.pk, version=file_instance.version,
+                                              status=UploadedFile.READY).update(status=UploadedFile.PROCESSING)
+        if claimed:
+            file_instance.status = UploadedFile.PROCESSING
+            start_processing(file_instance)
+        raise DatasetNotReady(f"Dataset {file_instance.pk} is still processing")
+    return file_instance.profile
+
+
+def get_sample_rows(file_instance):
+    """Row positions of the dataset's preview sample, or None when it is small enough to use whole"""
+    key = dataset_key(file_instance, 'sample_rows')
+    rows = dataset_store.get(key)
+    if rows is None:
+        total_rows = next(iter(get_profile(file_instance).values()))["rows"]
+        sample_rows = settings.PREVIEW_SAMPLE_ROWS
+        if settings.PREVIEW_SAMPLE_FRACTION > 0:
+            sample_rows = min(sample_rows, max(1, math.ceil(total_rows * settings.PREVIEW_SAMPLE_FRACTION)))
+        if sample_rows >= total_rows:
+            return None
+        rows = sample_indices(total_rows, sample_rows, [file_instance.pk, file_instance.version])
+        dataset_store.put(key, rows, rows.nbytes)
+    return rows
+
+
+def sample_scale(file_instance):
+    """Factor from preview sample totals to full dataset totals"""
+    rows = get_sample_rows(file_instance)
+    if rows is None:
+        return 1.0
+    return next(iter(get_profile(file_instance).values()))["rows"] / len(rows)
+
+
+def get_frame(file_instance, columns=None, preview=False):
+    """Return a frame holding only the requested columns of a dataset
+
+    With ``preview`` the frame holds only the rows of the dataset's sample.
+    """
+    if columns is None:
+        columns = get_columns(file_instance)
+    columns = list(dict.fromkeys(columns))
+    rows = get_sample_rows(file_instance) if preview else None
+    kind = 'column' if rows is None else 'sample_column'
+
+    series = {col: dataset_store.get(dataset_key(file_instance, kind, col)) for col in columns}
+    missing = [col for col, values in series.items() if values is None]
+    if missing:
+        file_path = ensure_sidecar(file_instance)
+        with timing.stage('load'):
+            if rows is None:
+                loaded = read_columns(file_path, missing, limit=file_instance.rows or None)
+            else:
+                loaded = read_rows(file_path, missing, rows, limit=file_instance.rows or None)
+        _remember_columns(file_instance, loaded, kind)
+        for col in missing:
+            series[col] = loaded[col]
+
+    return pd.DataFrame(series, columns=columns)
+
+
+def get_typed_columns(file_instance, preview=False):
+    """The dataset's columns as coerced NumPy arrays, converted on first use and kept in the store
+
+    Every chart of the same dataset version (and sample) shares the arrays,
+    so a column is parsed to numbers, dates or category codes only once.
+    """
+    preview = preview and get_sample_rows(file_instance) is not None
+    return TypedColumns(lambda col: get_frame(file_instance, [col], preview)[col],
+                        dataset_store, dataset_key(file_instance, 'typed', preview))
+
+
+def get_filter_rows(file_instance, row_filter, preview=False):
+    """Rows of the dataset, or of its preview sample, that a parsed filter keeps
+
+    Returns None without a filter, else a slice or sorted row numbers (see
+    filters.py). Kept per filter, so redrawing the same subset as another
+    chart type skips even the index lookups. Raises ValueError when no row
+    matches, so no chart type is ever drawn from an empty selection.
+    """
+    if row_filter is None:
+        return None
+    preview = preview and get_sample_rows(file_instance) is not None
+    key = dataset_key(file_instance, 'filter', preview, filter_key(row_filter))
+    rows = dataset_store.get(key)
+    if rows is None:
+        typed = get_typed_columns(file_instance, preview)
+        with timing.stage('filter'):
+            rows = select_rows(typed, row_filter)
+        dataset_store.put(key, rows, 0 if isinstance(rows, slice) else rows.nbytes)
+    if count_rows(rows) == 0:
+        raise ValueError("No rows match the filter")
+    return rows
+
+
+def get_row_positions(file_instance, spec):
+    """Positions of the dataset rows a spec reads after its sample and filter, None for every row"""
+    rows = get_sample_rows(file_instance) if spec['preview'] else None
+    selected = get_filter_rows(file_instance, spec['filter'], spec['preview'])
+    if selected is None:
+        return rows
+    if rows is None:
+        return np.arange(selected.start, selected.stop) if isinstance(selected, slice) else selected
+    return rows[selected]
+
+
+def get_groups(file_instance, x_column, y_column, preview=False, row_filter=None):
+    """Group totals of y by x, kept so other aggregations or colors reuse them"""
+    key = dataset_key(file_instance, 'groups', x_column, y_column, preview,
+                      None if row_filter is None else filter_key(row_filter))
+    groups = dataset_store.get(key)
+    if groups is None:
+        scale = sample_scale(file_instance) if preview else 1.0
+        typed = get_typed_columns(file_instance, preview)
+        rows = get_filter_rows(file_instance, row_filter, preview)
+        if rows is not None:
+            typed = typed.select(rows)
+        with timing.stage('aggregate'):
+            groups = group_totals(typed, x_column, y_column, scale)
+        labels, sums, counts = groups
+        nbytes = sum(len(label) for label in labels) + sums.nbytes + counts.nbytes
+        dataset_store.put(key, groups, nbytes)
+    return groups
+
+
+def get_summary(file_instance, column, preview=False, row_filter=None):
+    """Distribution summary of a column (see distributions.py), kept so histogram, box and violin charts share it
+
+    A whole numeric column's summary was saved with the sidecar as it was
+    written, so only filtered rows, previews and other columns are
+    summarized here.
+    """
+    key = dataset_key(file_instance, 'summary', column, preview,
+                      None if row_filter is None else filter_key(row_filter))
+    summary = dataset_store.get(key)
+    if summary is None:
+        if row_filter is None and not preview:
+            summary = _saved_summaries(file_instance).get(column)
+        if summary is None:
+            typed = get_typed_columns(file_instance, preview)
+            rows = get_filter_rows(file_instance, row_filter, preview)
+            if rows is not None:
+                typed = typed.select(rows)
+            with timing.stage('summarize'):
+                summary = ColumnSummary()
+                summary.update(typed.numeric(column)[typed.valid(column)])
+        dataset_store.put(key, summary, summary.nbytes())
+    return summary
+
+
+def _saved_summaries(file_instance):
+    """Column summaries saved with the sidecar, empty unless they cover exactly the dataset's rows"""
+    try:
+        return read_summaries(file_instance.file.path, rows=file_instance.rows)
+    except FileNotFoundError:
+        # Uploads from before sidecars get theirs when their rows are first read
+        return {}
+
+
+def get_ohlc_level(file_instance, x_column, columns, timeframe):
+    """One level of a dataset's OHLC pyramid, derived from the next finer level
+
+    Levels are built on first use and kept per column mapping, so switching
+    timeframe only aggregates already aggregated bars. Each level notes the
+    time of its last tick, which lets appended ticks extend it in place.
+    """
+    key = dataset_key(file_instance, 'ohlc', x_column, tuple(columns), timeframe)
+    level = dataset_store.get(key)
+    if level is None:
+        parent_timeframe = TIMEFRAMES[timeframe][1]
+        if parent_timeframe is None:
+            frame = get_frame(file_instance, [x_column] + columns)
+            with timing.stage('resample'):
+                parent = base_frame(frame[x_column], frame[columns], columns)
+            last_tick = parent.index[-1] if len(parent) else None
+        else:
+            parent = get_ohlc_level(file_instance, x_column, columns, parent_timeframe)
+            last_tick = parent.attrs['last_tick']
+        with timing.stage('resample'):
+            level = derive_level(parent, timeframe, columns)
+        level.attrs['last_tick'] = last_tick
+        dataset_store.put(key, level, int(level.memory_usage(index=True).sum()))
+    return level
+
+
+def chart_watermark(file_instance, spec):
+    """Rows of the dataset a chart depends on, for its cache key
+
+    Usually every row, but a filtered chart only reads up to the last row
+    its filter keeps, so appended rows it does not keep leave its key (and
+    cached image) alone. Previews and tiles depend on the row count itself.
+    """
+    if spec['filter'] is None or spec['preview'] or spec['tile'] is not None:
+        return file_instance.rows
+    try:
+        rows = get_filter_rows(file_instance, spec['filter'])
+    except ValueError:
+        return file_instance.rows
+    if isinstance(rows, slice):
+        return rows.stop
+    return int(rows[-1]) + 1
+
+
+def uses_raw_rows(spec):
+    """False for charts drawn from aggregated categories, OHLC bars, one x-range tile or column summaries"""
+    return (not is_aggregated(spec) and not is_summarized(spec)
+            and spec['graph_type'] != 'stock' and spec['tile'] is None)
+
+
+def get_chart_frame(file_instance, spec):
+    """The frame a chart spec is drawn from: raw columns, aggregated categories, OHLC bars or a tile's rows
+
+    A filter narrows each of them to the rows it keeps. Filtered OHLC bars
+    are resampled from those rows directly rather than from the pyramid.
+    Distribution charts get an empty frame carrying their y columns'
+    summaries in ``attrs['summaries']``.
+    """
+    row_filter = spec['filter']
+    if is_aggregated(spec):
+        return aggregate_frame(spec, [get_groups(file_instance, spec['x_column'], y_col, spec['preview'], row_filter)
+                                      for y_col in spec['y_columns']])
+    if is_summarized(spec):
+        frame = pd.DataFrame()
+        frame.attrs['summaries'] = [get_summary(file_instance, y_col, spec['preview'], row_filter).stats()
+                                    for y_col in spec['y_columns']]
+        return frame
+    rows = get_filter_rows(file_instance, row_filter, spec['preview'])
+    if spec['graph_type'] == 'stock':
+        if rows is None:
+            return get_ohlc_level(file_instance, spec['x_column'], ohlc_columns(spec), spec['timeframe'])
+        frame = get_frame(file_instance, [spec['x_column']] + ohlc_columns(spec)).iloc[rows]
+        with timing.stage('resample'):
+            return resample_spec(frame, spec)
+    if spec['tile'] is not None:
+        frame = get_frame(file_instance, [spec['x_column']] + spec['y_columns'])
+        typed = get_typed_columns(file_instance)
+        if rows is not None:
+            frame, typed = frame.iloc[rows], typed.select(rows)
+        return tile_frame(frame, typed, spec)
+    frame = get_frame(file_instance, [spec['x_column']] + spec['y_columns'], spec['preview'])
+    return frame if rows is None else frame.iloc[rows]
+
+
+def get_chart_typed(file_instance, spec):
+    """Typed columns of the rows get_chart_frame draws, None for charts not drawn from raw rows"""
+    if not uses_raw_rows(spec):
+        return None
+    typed = get_typed_columns(file_instance, spec['preview'])
+    rows = get_filter_rows(file_instance, spec['filter'], spec['preview'])
+    return typed if rows is None else typed.select(rows)
+
+
+def _remember_columns(file_instance, df, kind='column'):
+    for col in df.columns:
+        values = df[col]
+        dataset_store.put(dataset_key(file_instance, kind, col), values,
+                          int(values.memory_usage(deep=True)))
+
+
+def ensure_sidecar(file_instance):
+    """Build the sidecar for uploads that predate columnar caching"""
+    file_path = file_instance.file.path
+    if not has_sidecar(file_path):
+        ingest_file(file_path)
+    return file_path
@@ -0,0 +1,280 @@
+import math
+
+import numpy as np
+
+from .sketches import QuantileSketch, decode_array, encode_array
+
+# Chart types drawn from a per-column summary rather than from every row
+DISTRIBUTION_TYPES = ('histogram', 'box', 'violin')
+
+# Resolution of the histogram every summary keeps; histograms merge
+# neighbouring bins into wider ones and violins smooth them
+SUMMARY_BINS = 4096
+# Outliers a box plot draws on each side at most, spread over the real ones
+FLIERS_MAX = 250
+# Points along each violin's outline, as matplotlib's violinplot uses
+VIOLIN_POINTS = 100
+
+
+def is_summarized(spec):
+    return spec['graph_type'] in DISTRIBUTION_TYPES
+
+
+class ColumnSummary:
+    """Everything histogram, box and violin charts draw of one column's finite values, mergeable
+
+    Built a chunk at a time and merged across chunks, uploads and appends
+    without seeing any value twice: count, mean and variance (Chan's
+    pairwise update), range, a quantile sketch for the quartiles (exact
+    until it first compacts, see sketches.QuantileSketch), the FLIERS_MAX
+    smallest and largest values for whiskers and outliers, and a histogram
+    of SUMMARY_BINS bins. Bin widths are powers of two and bins start at a
+    multiple of their width, so two histograms merge exactly by summing
+    pairs of bins until both cover the merged range; the values fill
+    between a quarter and all of the bins. Drawing from a summary then
+    costs the same whatever the row count.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = self.max = None
+        self.start, self.width = 0.0, 1.0
+        self.counts = np.zeros(SUMMARY_BINS, dtype=np.int64)
+        self.quantiles = QuantileSketch()
+        self.low = self.high = np.empty(0)
+
+    def update(self, values):
+        """Add an array of finite values"""
+        values = np.asarray(values, dtype='float64')
+        if len(values) == 0:
+            return
+        chunk = ColumnSummary()
+        chunk.count = len(values)
+        chunk.mean = float(values.mean())
+        chunk.m2 = float(np.square(values - chunk.mean).sum())
+        chunk.min, chunk.max = float(values.min()), float(values.max())
+        # The finest width that still tells apart the largest values' neighbours
+        chunk.start, chunk.width = _fit(chunk.min, chunk.max, float(np.spacing(max(abs(chunk.min), abs(chunk.max)))))
+        bins = ((values - chunk.start) / chunk.width).astype(np.int64)
+        chunk.counts = np.bincount(np.clip(bins, 0, SUMMARY_BINS - 1), minlength=SUMMARY_BINS)
+        chunk.quantiles.update(values)
+        chunk.low, chunk.high = _extremes(values)
+        self.merge(chunk)
+
+    def merge(self, other):
+        """Fold in another summary, as if this one had seen its values too"""
+        if other.count == 0:
+            return
+        self.quantiles.merge(other.quantiles)
+        self.low, _ = _extremes(np.concatenate((self.low, other.low)))
+        _, self.high = _extremes(np.concatenate((self.high, other.high)))
+        if self.count == 0:
+            self.count, self.mean, self.m2, self.min, self.max = other.count, other.mean, other.m2, other.min, other.max
+            self.start, self.width, self.counts = other.start, other.width, other.counts.copy()
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.mean += delta * other.count / total
+        self.count = total
+        self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+        start, width = _fit(self.min, self.max, max(self.width, other.width))
+        self.counts = (_regroup(self.counts, self.start, self.width, start, width)
+                       + _regroup(other.counts, other.start, other.width, start, width))
+        self.start, self.width = start, width
+
+    def stats(self):
+        """The summary as a dict of what the charts draw (see histogram_bins, violin_stats and box_stats)"""
+        if self.count == 0:
+            return {'count': 0}
+        q1, median, q3 = self.quantiles.quantiles([0.25, 0.5, 0.75])
+        iqr = q3 - q1
+        # Every kept value is a real one, so whiskers land on values as boxplot's do
+        kept = np.concatenate((self.low, self.quantiles.items()[0], self.high))
+        whislo = float(kept[kept >= q1 - 1.5 * iqr].min())
+        whishi = float(kept[kept <= q3 + 1.5 * iqr].max())
+        fliers = np.concatenate((_outliers(self.low, kept[kept < whislo], whislo, below=True),
+                                 _outliers(self.high, kept[kept > whishi], whishi, below=False)))
+
+        if self.min == self.max:
+            # Like np.histogram, a column of one value gets a unit-wide range around it
+            value_range, counts = (self.min - 0.5, self.max + 0.5), np.array([self.count])
+        else:
+            used = np.flatnonzero(self.counts)
+            first, last = int(used[0]), int(used[-1]) + 1
+            value_range = (self.start + first * self.width, self.start + last * self.width)
+            counts = self.counts[first:last]
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'std': math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0,
+            'min': self.min,
+            'max': self.max,
+            'q1': float(q1),
+            'median': float(median),
+            'q3': float(q3),
+            'whislo': whislo,
+            'whishi': whishi,
+            'fliers': fliers,
+            'range': value_range,
+            'counts': counts,
+        }
+
+    def nbytes(self):
+        return self.counts.nbytes + self.quantiles.nbytes() + self.low.nbytes + self.high.nbytes
+
+    def dumps(self):
+        return {
+            'count': self.count, 'mean': self.mean, 'm2': self.m2, 'min': self.min, 'max': self.max,
+            'start': self.start, 'width': self.width, 'counts': encode_array(self.counts),
+            'quantiles': self.quantiles.dumps(), 'low': encode_array(self.low), 'high': encode_array(self.high),
+        }
+
+    @classmethod
+    def loads(cls, data):
+        summary = cls()
+        summary.count, summary.mean, summary.m2 = data['count'], data['mean'], data['m2']
+        summary.min, summary.max, summary.start, summary.width = data['min'], data['max'], data['start'], data['width']
+        summary.counts = decode_array(data['counts'], np.int64)
+        summary.quantiles = QuantileSketch.loads(data['quantiles'])
+        summary.low, summary.high = decode_array(data['low'], 'float64'), decode_array(data['high'], 'float64')
+        return summary
+
+
+def column_summary(values):
+    """ColumnSummary.stats of an array of finite values"""
+    summary = ColumnSummary()
+    summary.update(values)
+    return summary.stats()
+
+
+def _fit(lo, hi, width):
+    """``(start, width)`` of the bins covering lo..hi: the smallest power-of-two multiple of ``width`` that fits"""
+    span = hi / SUMMARY_BINS - lo / SUMMARY_BINS
+    if span > 0:
+        width = max(width, 2.0 ** math.ceil(math.log2(span)))
+    while True:
+        start = math.floor(lo / width) * width
+        if start > lo:
+            # lo / width underflowed to -0.0
+            start -= width
+        if hi < start + SUMMARY_BINS * width:
+            return start, width
+        width *= 2
+
+
+def _regroup(counts, start, width, new_start, new_width):
+    """Counts of bins at ``(start, width)`` summed into the wider, aligned bins at ``(new_start, new_width)``"""
+    if (start, width) == (new_start, new_width):
+        return counts
+    # new_start <= start < new_start + new_width, so old bins fill new bins from the first on
+    doublings = math.frexp(new_width)[1] - math.frexp(width)[1]
+    if 2 ** doublings <= SUMMARY_BINS:
+        index = (round((start - new_start) / width) + np.arange(SUMMARY_BINS)) // 2 ** doublings
+    else:
+        # A new bin is wider than all the old ones together, so they span two new bins at most
+        boundary = (new_start + new_width - start) / width
+        index = (np.arange(SUMMARY_BINS) >= min(boundary, SUMMARY_BINS)).astype(np.int64)
+    # Empty old bins may lie past the new ones; every filled one fits
+    index = np.minimum(index, SUMMARY_BINS - 1)
+    return np.bincount(index, weights=counts, minlength=SUMMARY_BINS).astype(np.int64)
+
+
+def _extremes(values):
+    """The FLIERS_MAX smallest and the FLIERS_MAX largest values, sorted"""
+    if len(values) <= FLIERS_MAX:
+        values = np.sort(values)
+        return values, values
+    return (np.sort(np.partition(values, FLIERS_MAX - 1)[:FLIERS_MAX]),
+            np.sort(np.partition(values, len(values) - FLIERS_MAX)[-FLIERS_MAX:]))
+
+
+def _spread(values):
+    """At most FLIERS_MAX of the values, evenly spaced in sorted order and keeping both extremes"""
+    if len(values) <= FLIERS_MAX:
+        return values
+    return np.sort(values)[np.linspace(0, len(values) - 1, FLIERS_MAX).round().astype(np.int64)]
+
+
+def _outliers(extremes, kept, whisker, below):
+    """Values beyond a whisker: exactly the kept extremes when all of them are there, else spread over the sketch"""
+    beyond = extremes[extremes < whisker] if below else extremes[extremes > whisker]
+    if len(beyond) < len(extremes) or len(extremes) < FLIERS_MAX:
+        return beyond
+    return _spread(np.union1d(beyond, kept))
+
+
+def summaries(uploaded_data, spec, typed):
+    """Summaries of the spec's y columns, precomputed in ``uploaded_data.attrs`` or taken from ``typed`` now"""
+    if 'summaries' in uploaded_data.attrs:
+        return uploaded_data.attrs['summaries']
+    return [column_summary(typed.numeric(col)[typed.valid(col)]) for col in spec['y_columns']]
+
+
+def histogram_bins(summary):
+    """``(counts, edges)`` at about the resolution of ``np.histogram(bins='auto')``
+
+    The 'auto' bin width (the smaller of the Sturges and Freedman-Diaconis
+    widths, the latter held to at least half the square-root width) comes
+    from the summary's count, range and quartiles; whole groups of the
+    summary's bins are merged to approach it.
+    """
+    if summary['count'] == 0:
+        # np.histogram's answer for no values: one empty bin over [0, 1]
+        return np.zeros(1, dtype=np.int64), np.array([0.0, 1.0])
+    start, stop = summary['range']
+    n = summary['count']
+    spread = summary['max'] - summary['min']
+    width = spread / (math.log2(n) + 1)
+    iqr = summary['q3'] - summary['q1']
+    if iqr > 0:
+        width = min(width, max(2 * iqr / n ** (1 / 3), spread / (2 * math.sqrt(n))))
+    wanted = math.ceil((stop - start) / width) if width > 0 else 1
+    bins = len(summary['counts'])
+    merge = max(1, bins // wanted)
+    groups = np.arange(0, bins, merge)
+    edges = start + (stop - start) * np.append(groups, bins) / bins
+    return np.add.reduceat(summary['counts'], groups), edges
+
+
+def violin_stats(summary):
+    """Statistics for ``Axes.violin``: a Gaussian KDE with Scott's bandwidth, binned
+
+    Smoothing the summary's histogram with the kernel stands in for
+    evaluating the kernel at every value, as violinplot would.
+    """
+    start, stop = summary['range']
+    bins = len(summary['counts'])
+    width = (stop - start) / bins
+    counts = summary['counts'].astype('float64')
+    sigma = summary['std'] * summary['count'] ** (-1 / 5) / width
+    if sigma > 0:
+        half = min(math.ceil(4 * sigma), bins)
+        kernel = np.exp(-0.5 * (np.arange(-half, half + 1) / sigma) ** 2)
+        counts = np.convolve(counts, kernel / kernel.sum())[half:half + bins]
+    centers = start + (np.arange(bins) + 0.5) * width
+    coords = np.linspace(summary['min'], summary['max'], VIOLIN_POINTS)
+    return {
+        'coords': coords,
+        'vals': np.interp(coords, centers, counts / (summary['count'] * width)),
+        'mean': summary['mean'],
+        'median': summary['median'],
+        'min': summary['min'],
+        'max': summary['max'],
+    }
+
+
+def box_stats(summary, label):
+    """Statistics for ``Axes.bxp``, as ``boxplot`` would compute them from every value"""
+    return {
+        'label': label,
+        'med': summary['median'],
+        'q1': summary['q1'],
+        'q3': summary['q3'],
+        'whislo': summary['whislo'],
+        'whishi': summary['whishi'],
+        'mean': summary['mean'],
+        'fliers': summary['fliers'],
+    }
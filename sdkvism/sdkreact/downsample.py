@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+LINE_METHODS = ('lttb', 'minmax')
+SCATTER_METHODS = ('bin',)
+METHODS = ('auto', 'none') + LINE_METHODS + SCATTER_METHODS
+
+
+def is_categorical_axis(values):
+    """True when matplotlib would place the values on a category axis"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return False
+    return not pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values)
+
+
+def lttb(x, y, n_out):
+    """Indices picked by Largest-Triangle-Three-Buckets, first and last always kept"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    bounds = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts, stops = bounds[:-1], bounds[1:]
+    sizes = stops - starts
+    avg_x = np.add.reduceat(x[:n - 1], starts) / sizes
+    avg_y = np.add.reduceat(y[:n - 1], starts) / sizes
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    anchor = 0
+    for i, (start, stop) in enumerate(zip(starts, stops)):
+        ax, ay = x[anchor], y[anchor]
+        area = np.abs((ax - next_x[i]) * (y[start:stop] - ay)
+                      - (ax - x[start:stop]) * (next_y[i] - ay))
+        anchor = start + int(area.argmax())
+        selected[i + 1] = anchor
+    return selected
+
+
+def minmax(x, y, n_buckets):
+    """Indices of the lowest and highest point in each bucket, in row order
+
+    Buckets are equal-width in x when x is sorted, so each one maps onto a
+    pixel column; otherwise they fall back to equal row counts.
+    """
+    n = len(x)
+    if n <= 2 * n_buckets:
+        return np.arange(n)
+
+    if np.all(np.diff(x) >= 0) and x[-1] > x[0]:
+        edges = np.linspace(x[0], x[-1], n_buckets + 1)[1:-1]
+        bucket = np.searchsorted(edges, x, side='right')
+    else:
+        bucket = (np.arange(n) * n_buckets) // n
+
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    bucket_min = np.minimum.reduceat(y, starts)
+    bucket_max = np.maximum.reduceat(y, starts)
+    run = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, n]))
+
+    is_min = y == bucket_min[run]
+    is_max = y == bucket_max[run]
+    _, first_min = np.unique(run[is_min], return_index=True)
+    _, first_max = np.unique(run[is_max], return_index=True)
+    picks = np.concatenate([np.flatnonzero(is_min)[first_min], np.flatnonzero(is_max)[first_max]])
+    return np.unique(picks)
+
+
+def bin2d(x, y, nx, ny):
+    """Centroids and counts of the occupied cells of an nx-by-ny grid"""
+    x_span = (x.max() - x.min()) or 1.0
+    y_span = (y.max() - y.min()) or 1.0
+    ix = np.minimum(((x - x.min()) / x_span * nx).astype(np.int64), nx - 1)
+    iy = np.minimum(((y - y.min()) / y_span * ny).astype(np.int64), ny - 1)
+    cell = ix * ny + iy
+
+    counts = np.bincount(cell, minlength=nx * ny)
+    occupied = np.flatnonzero(counts)
+    cx = np.bincount(cell, weights=x, minlength=nx * ny)[occupied] / counts[occupied]
+    cy = np.bincount(cell, weights=y, minlength=nx * ny)[occupied] / counts[occupied]
+    return cx, cy, counts[occupied]
+
+
+def reduce_line(x, y, method, max_points):
+    """Rows to draw of one line/area series, at most about ``max_points`` of them
+
+    ``x`` holds float axis positions and ``y`` float values (see typed.py).
+    Returns an index usable on any array of the series, ``slice(None)`` when
+    every row is kept.
+    """
+    if method == 'none' or len(x) <= max_points:
+        return slice(None)
+
+    valid = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    if len(valid) <= max_points:
+        return valid
+
+    if method == 'minmax':
+        picked = minmax(x[valid], y[valid], max(max_points // 2, 1))
+    else:
+        picked = lttb(x[valid], y[valid], max_points)
+    return valid[picked]
+
+
+def reduce_scatter(x, y, method, grid):
+    """Collapse a scatter series onto a grid of marker-sized cells
+
+    Returns the cell centroids as ``(x, y)`` float arrays, or None when the
+    series should be drawn as-is: ``method`` is ``'none'``, it already fits
+    the grid, or it has no finite points.
+    """
+    nx, ny = grid
+    if method == 'none' or len(x) <= nx * ny:
+        return None
+
+    valid = np.isfinite(x) & np.isfinite(y)
+    if not valid.any():
+        return None
+
+    cx, cy, _ = bin2d(x[valid], y[valid], nx, ny)
+    return cx, cy
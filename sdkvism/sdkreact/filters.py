@@ -0,0 +1,205 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+# Row selections are either a slice of consecutive rows or a sorted array of
+# row numbers, so a range over a sorted column never materializes its rows
+
+_LEAF_KEYS = ('min', 'max', 'eq', 'in', 'null')
+
+
+def parse_filter(data, available_columns, path='filter'):
+    """Validate a filter and return it normalized, or None when there is none
+
+    A filter is a condition, a list of conditions (all must hold), or
+    ``{"and": [...]}`` / ``{"or": [...]}`` nesting further filters. A
+    condition names a ``column`` and one test: an inclusive range with
+    ``min`` and/or ``max``, ``eq`` one value, ``in`` a list of values, or
+    ``null`` true/false. Ranges and equality never match nulls. Raises
+    ValueError naming the offending part.
+    """
+    if data is None:
+        return None
+    if isinstance(data, list):
+        data = {'and': data}
+    if not isinstance(data, dict):
+        raise ValueError(f"{path} must be an object or a list of conditions")
+
+    for combinator in ('and', 'or'):
+        if combinator in data:
+            children = data[combinator]
+            if len(data) != 1 or not isinstance(children, list) or len(children) == 0:
+                raise ValueError(f"{path}.{combinator} must be the only key and hold a list of filters")
+            return {combinator: [parse_filter(child, available_columns, f"{path}.{combinator}[{i}]")
+                                 for i, child in enumerate(children)]}
+
+    column = data.get('column')
+    if column not in available_columns:
+        raise ValueError(f"{path}: unknown column {column!r}")
+    unknown = set(data) - {'column'} - set(_LEAF_KEYS)
+    if unknown:
+        raise ValueError(f"{path}: unknown keys {', '.join(sorted(unknown))}")
+    tests = [key for key in _LEAF_KEYS if key in data]
+
+    if tests and set(tests) <= {'min', 'max'}:
+        return {'column': column, 'min': _scalar(data.get('min'), path), 'max': _scalar(data.get('max'), path)}
+    if len(tests) != 1:
+        raise ValueError(f"{path}: give one of min/max, eq, in or null")
+    if tests == ['eq']:
+        return {'column': column, 'in': [_scalar(data['eq'], path)]}
+    if tests == ['in']:
+        values = data['in']
+        if not isinstance(values, list) or len(values) == 0:
+            raise ValueError(f"{path}.in must be a non-empty list")
+        return {'column': column, 'in': [_scalar(value, path) for value in values]}
+    if not isinstance(data['null'], bool):
+        raise ValueError(f"{path}.null must be true or false")
+    return {'column': column, 'null': data['null']}
+
+
+def _scalar(value, path):
+    if value is not None and not isinstance(value, (str, int, float)):
+        raise ValueError(f"{path}: values must be numbers, strings or dates")
+    return value
+
+
+def filter_key(tree):
+    """Stable text form of a normalized filter, for cache keys"""
+    return json.dumps(tree, sort_keys=True)
+
+
+def select_rows(typed, tree):
+    """Rows of ``typed`` (see typed.py) a normalized filter keeps
+
+    Numeric and date columns are answered from their sorted index, or
+    directly by binary search when the column is already sorted, and text
+    columns from per-category row lists, so a condition costs
+    O(log n + k) for the k rows it keeps rather than a scan of every row.
+    """
+    if 'and' in tree:
+        rows = select_rows(typed, tree['and'][0])
+        for child in tree['and'][1:]:
+            rows = _intersect(rows, select_rows(typed, child))
+        return rows
+    if 'or' in tree:
+        rows = select_rows(typed, tree['or'][0])
+        for child in tree['or'][1:]:
+            rows = _union(rows, select_rows(typed, child))
+        return rows
+    if typed.is_categorical(tree['column']):
+        return _category_rows(typed, tree)
+    return _ordered_rows(typed, tree)
+
+
+def count_rows(rows):
+    if isinstance(rows, slice):
+        return rows.stop - rows.start
+    return len(rows)
+
+
+def concat_rows(rows, more, offset):
+    """Rows kept of a dataset followed by ``more`` kept of rows appended at ``offset``"""
+    if isinstance(more, slice):
+        more = slice(more.start + offset, more.stop + offset)
+        if isinstance(rows, slice):
+            return _union(rows, more)
+    else:
+        more = more + offset
+    if count_rows(more) == 0:
+        return rows
+    return np.concatenate((_as_array(rows), _as_array(more)))
+
+
+def _ordered_rows(typed, tree):
+    col = tree['column']
+    is_sorted = typed.is_sorted(col)
+    if is_sorted:
+        values = typed.positions(col)
+    else:
+        order, values = typed.sorted_index(col)
+
+    if 'null' in tree:
+        # NaN sorts last, so the nulls are the tail of the index
+        first_null = int(np.searchsorted(values, np.nan, side='left'))
+        spans = [(first_null, len(values))] if tree['null'] else [(0, first_null)]
+    elif 'in' in tree:
+        spans = []
+        for value in tree['in']:
+            position = _position(typed, col, value)
+            spans.append((int(np.searchsorted(values, position, side='left')),
+                           int(np.searchsorted(values, position, side='right'))))
+    else:
+        lo = -np.inf if tree['min'] is None else _position(typed, col, tree['min'])
+        hi = np.inf if tree['max'] is None else _position(typed, col, tree['max'])
+        spans = [(int(np.searchsorted(values, lo, side='left')), int(np.searchsorted(values, hi, side='right')))]
+
+    if is_sorted:
+        rows = slice(*spans[0])
+        for span in spans[1:]:
+            rows = _union(rows, slice(*span))
+        return rows
+    return np.sort(np.concatenate([order[start:stop] for start, stop in spans]))
+
+
+def _position(typed, col, value):
+    """A filter value on the column's position scale (see TypedColumns.positions)"""
+    try:
+        if typed.is_datetime(col):
+            stamp = pd.Timestamp(value)
+            if stamp.tz is not None:
+                stamp = stamp.tz_convert(None)
+            if pd.isna(stamp):
+                raise ValueError
+            return float(stamp.value)
+        return float(value)
+    except (TypeError, ValueError):
+        kind = 'date' if typed.is_datetime(col) else 'number'
+        raise ValueError(f"Filter value {value!r} is not a {kind} for column {col}")
+
+
+def _category_rows(typed, tree):
+    col = tree['column']
+    if 'min' in tree:
+        raise ValueError(f"Range filters need a numeric or date column, {col} is text")
+    rows, offsets = typed.postings(col)
+    if 'null' in tree:
+        # Nulls (code -1) come first in the row lists
+        if tree['null']:
+            return rows[offsets[0]:offsets[1]]
+        return np.sort(rows[offsets[1]:])
+
+    _, labels = typed.codes(col)
+    wanted = np.flatnonzero(np.isin(labels.astype(str), [str(value) for value in tree['in']]))
+    groups = [rows[offsets[code + 1]:offsets[code + 2]] for code in wanted]
+    if len(groups) == 1:
+        return groups[0]
+    return np.sort(np.concatenate(groups)) if groups else np.array([], dtype='int64')
+
+
+def _as_array(rows):
+    if isinstance(rows, slice):
+        return np.arange(rows.start, rows.stop)
+    return rows
+
+
+def _intersect(a, b):
+    if isinstance(a, slice) and isinstance(b, slice):
+        start = max(a.start, b.start)
+        return slice(start, max(start, min(a.stop, b.stop)))
+    if isinstance(a, slice):
+        a, b = b, a
+    if isinstance(b, slice):
+        return a[np.searchsorted(a, b.start):np.searchsorted(a, b.stop)]
+    return np.intersect1d(a, b, assume_unique=True)
+
+
+def _union(a, b):
+    if isinstance(a, slice) and isinstance(b, slice):
+        if b.start == b.stop:
+            return a
+        if a.start == a.stop:
+            return b
+        if a.start <= b.stop and b.start <= a.stop:
+            return slice(min(a.start, b.start), max(a.stop, b.stop))
+    return np.union1d(_as_array(a), _as_array(b))
@@ -0,0 +1,373 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from django.conf import settings
+
+from .columnar import sidecar_path, sketch_metadata, summary_metadata
+from .distributions import ColumnSummary
+from .readers import read_chunks
+from .sketches import HyperLogLog
+
+_STORAGE_TYPES = {
+    'bool': pa.bool_(),
+    'int': pa.int64(),
+    'float': pa.float64(),
+    'string': pa.string(),
+}
+
+_INT_TYPES = [
+    (np.iinfo(np.int8), pa.int8()),
+    (np.iinfo(np.int16), pa.int16()),
+    (np.iinfo(np.int32), pa.int32()),
+    (np.iinfo(np.int64), pa.int64()),
+]
+
+# Integers beyond this magnitude are not exactly representable as float32
+_FLOAT32_EXACT_INT = 2 ** 24
+
+# String values tried with pd.to_datetime to decide if a column holds dates
+_DATETIME_SAMPLE = 100
+
+# Numeric columns entirely inside this range look like years
+_YEAR_RANGE = (1900, 2100)
+
+
+def _column_kind(values):
+    """Storage kind of one parsed chunk column, or None if it is all null"""
+    if values.isna().all():
+        return None
+    if pd.api.types.is_bool_dtype(values):
+        return 'bool'
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return 'datetime'
+    if pd.api.types.is_integer_dtype(values):
+        return 'int'
+    if pd.api.types.is_float_dtype(values):
+        return 'float'
+    return 'string'
+
+
+def _widen(current, new):
+    if current is None or current == new:
+        return new
+    if new is None:
+        return current
+    if {current, new} == {'int', 'float'}:
+        return 'float'
+    return 'string'
+
+
+def _parses_as_datetime(values):
+    sample = values.dropna().astype('string').unique()[:_DATETIME_SAMPLE]
+    if len(sample) == 0:
+        return False
+    try:
+        return bool(pd.to_datetime(pd.Series(sample), errors='coerce', format='mixed').notna().all())
+    except (TypeError, ValueError, OverflowError):
+        return False
+
+
+def _json_scalar(value):
+    if value is None:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return int(value) if float(value).is_integer() else float(value)
+
+
+class ColumnStats:
+    """Running statistics for one column, used to pick its narrowest dtype and
+    to build the column profile stored with the upload"""
+
+    def __init__(self, name, category_max):
+        self.name = name
+        self.category_max = category_max
+        self.kind = None
+        self.count = 0
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self.float32_exact = True
+        self.distinct = set()
+        self.datetime_type = None
+        self.sketch = HyperLogLog()
+        self.summary = ColumnSummary()
+        self.increasing = True
+        self.decreasing = True
+        self.last = None
+        self.datetime_parseable = None
+
+    def update(self, values, kind):
+        self.count += len(values)
+        self.nulls += int(values.isna().sum())
+        widened = _widen(self.kind, kind)
+        if widened == 'string' and self.kind not in (None, 'string'):
+            # Earlier numeric chunks were never collected as categories,
+            # and their range means nothing for a string column
+            self.distinct = None
+            self.min = self.max = None
+        self.kind = widened
+        if kind not in (None, 'int', 'float'):
+            # Only numbers are summarized; charts read other columns' values as they are stored
+            self.summary = None
+
+        if kind in ('int', 'float'):
+            numeric = values.dropna().to_numpy(dtype='float64')
+            finite = numeric[np.isfinite(numeric)]
+            if self.summary is not None:
+                self.summary.update(finite)
+            if len(finite):
+                self.min = float(finite.min()) if self.min is None else min(self.min, float(finite.min()))
+                self.max = float(finite.max()) if self.max is None else max(self.max, float(finite.max()))
+            if kind == 'int':
+                if len(finite) and np.abs(finite).max() > _FLOAT32_EXACT_INT:
+                    self.float32_exact = False
+            elif self.float32_exact:
+                self.float32_exact = bool((numeric.astype('float32').astype('float64') == numeric).all())
+
+        if kind == 'datetime' and self.kind == 'datetime':
+            if self.datetime_type is None:
+                self.datetime_type = pa.timestamp('ns', tz=str(values.dt.tz) if values.dt.tz else None)
+            present = values.dropna()
+            if len(present):
+                self.min = present.min() if self.min is None else min(self.min, present.min())
+                self.max = present.max() if self.max is None else max(self.max, present.max())
+
+        if kind is not None:
+            self.sketch.update(values)
+            self._track_order(values, kind)
+            if kind == 'string' and self.datetime_parseable is None:
+                self.datetime_parseable = _parses_as_datetime(values)
+
+        if self.kind == 'string' and kind is not None and self.distinct is not None:
+            self.distinct.update(values.dropna().astype('string').unique())
+            if len(self.distinct) > self.category_max:
+                self.distinct = None
+
+    def _track_order(self, values, kind):
+        if kind == 'string' or self.kind == 'string':
+            self.increasing = self.decreasing = False
+            return
+        if not (self.increasing or self.decreasing):
+            return
+        present = values.dropna()
+        if len(present) == 0:
+            return
+        if self.last is not None:
+            present = pd.concat([pd.Series([self.last]), present], ignore_index=True)
+        try:
+            self.increasing = self.increasing and present.is_monotonic_increasing
+            self.decreasing = self.decreasing and present.is_monotonic_decreasing
+        except TypeError:
+            self.increasing = self.decreasing = False
+        self.last = present.iloc[-1]
+
+    def profile(self):
+        """JSON-ready summary used for recommendations and request validation"""
+        kind = self.kind
+        if kind == 'datetime' or (kind == 'string' and self.datetime_parseable):
+            column_class = 'datetime'
+        elif kind in ('int', 'float'):
+            column_class = 'numeric'
+        else:
+            column_class = 'categorical'
+
+        exact = kind == 'string' and self.distinct is not None
+        monotonic = None
+        if kind not in (None, 'string', 'bool') and self.count > self.nulls:
+            if self.increasing:
+                monotonic = 'increasing'
+            elif self.decreasing:
+                monotonic = 'decreasing'
+
+        has_range = kind in ('int', 'float', 'datetime')
+        return {
+            "kind": kind,
+            "class": column_class,
+            "rows": self.count,
+            "nulls": self.nulls,
+            "distinct": len(self.distinct) if exact else self.sketch.estimate(),
+            "distinct_exact": exact,
+            "min": _json_scalar(self.min) if has_range else None,
+            "max": _json_scalar(self.max) if has_range else None,
+            "monotonic": monotonic,
+            "datetime_parseable": column_class == 'datetime',
+            "year_like": (kind in ('int', 'float') and self.min is not None
+                          and _YEAR_RANGE[0] < self.min and self.max < _YEAR_RANGE[1]),
+        }
+
+    def arrow_type(self):
+        """Narrowest Arrow type able to hold every value seen"""
+        kind = self.kind or 'float'
+        if kind == 'int':
+            for info, arrow_type in _INT_TYPES:
+                if info.min <= self.min and self.max <= info.max:
+                    return arrow_type
+            return pa.int64()
+        if kind == 'float':
+            return pa.float32() if self.float32_exact else pa.float64()
+        if kind == 'string' and self.is_categorical():
+            return pa.dictionary(pa.int32(), pa.string())
+        return self.storage_type()
+
+    def storage_type(self):
+        """Wide Arrow type used while spooling chunks"""
+        kind = self.kind or 'float'
+        if kind == 'datetime':
+            return self.datetime_type
+        return _STORAGE_TYPES[kind]
+
+    def is_categorical(self):
+        # A categorical only pays off when values actually repeat
+        return (self.distinct is not None and self.count - self.nulls > 0
+                and len(self.distinct) <= (self.count - self.nulls) / 2)
+
+    def categories(self):
+        return pa.array(sorted(self.distinct), type=pa.string())
+
+
+def numeric_summaries(stats):
+    """``{column: ColumnSummary}`` of the columns whose every chunk held numbers"""
+    return {col: column_stats.summary for col, column_stats in stats.items()
+            if column_stats.kind in ('int', 'float') and column_stats.summary is not None}
+
+
+class _SegmentSpool:
+    """Temporary Arrow stream files holding chunks in their storage types
+
+    A new segment starts whenever a chunk forces a column to widen, so
+    already written batches never have to be revisited during the parse.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.paths = []
+        self.schema = None
+        self._writer = None
+
+    def write(self, table):
+        if self.schema is not None and not table.schema.equals(self.schema):
+            self._close_writer()
+        if self._writer is None:
+            path = f"{self.target}.{os.getpid()}.{threading.get_ident()}.part{len(self.paths)}"
+            self.paths.append(path)
+            self.schema = table.schema
+            self._writer = pa.ipc.new_stream(path, self.schema)
+        self._writer.write_table(table)
+
+    def batches(self):
+        self._close_writer()
+        for path in self.paths:
+            with pa.memory_map(path) as source:
+                yield from pa.ipc.open_stream(source)
+
+    def cleanup(self):
+        self._close_writer()
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def _cast_column(column, stats, arrow_type):
+    if pa.types.is_dictionary(arrow_type):
+        column = column.cast(pa.string())
+        dictionary = stats.categories()
+        indices = pc.index_in(column, value_set=dictionary).cast(arrow_type.index_type)
+        return pa.DictionaryArray.from_arrays(indices, dictionary)
+    return column.cast(arrow_type)
+
+
+def ingest_file(file_path, on_columns=None, chunk_rows=None, category_max=None, on_progress=None,
+                columns=None):
+    """Stream an upload into its columnar sidecar with narrowed dtypes
+
+    Peak memory stays proportional to ``chunk_rows``: every chunk is parsed,
+    spooled to disk in a wide storage type and dropped, then the spool is
+    re-read batch by batch and cast to the narrowest dtype seen overall.
+    ``on_progress(phase, bytes_read, bytes_total, rows)`` is called after
+    every parsed chunk ('parsing') and every written batch ('writing').
+    Only ``columns`` are imported when given.
+
+    CSVs go through the pyarrow reader (INGEST_CSV_ENGINE), which infers
+    types from its first block; if a later block contradicts them the
+    file is parsed again with pandas, which widens as it goes.
+    """
+    engine = settings.INGEST_CSV_ENGINE
+    if engine == 'pyarrow':
+        try:
+            return _ingest(file_path, on_columns, chunk_rows, category_max, on_progress, columns, engine)
+        except pa.ArrowInvalid:
+            engine = 'pandas'
+    return _ingest(file_path, on_columns, chunk_rows, category_max, on_progress, columns, engine)
+
+
+def _ingest(file_path, on_columns, chunk_rows, category_max, on_progress, columns, engine):
+    chunk_rows = chunk_rows or settings.INGEST_CHUNK_ROWS
+    category_max = category_max or settings.INGEST_CATEGORY_MAX
+    target = sidecar_path(file_path)
+    tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    spool = _SegmentSpool(target)
+    stats = None
+    bytes_total = os.path.getsize(file_path)
+    rows = 0
+
+    try:
+        for chunk, bytes_read in read_chunks(file_path, chunk_rows, columns, engine):
+            chunk = chunk.reset_index(drop=True)
+            chunk.columns = [str(col) for col in chunk.columns]
+            if stats is None:
+                stats = {col: ColumnStats(col, category_max) for col in chunk.columns}
+                if on_columns is not None:
+                    on_columns(chunk.columns.tolist())
+
+            arrays = {}
+            for col in chunk.columns:
+                column_stats = stats[col]
+                kind = _column_kind(chunk[col])
+                column_stats.update(chunk[col], kind)
+                values = chunk[col].astype('string') if column_stats.kind == 'string' else chunk[col]
+                arrays[col] = pa.array(values, type=column_stats.storage_type(), from_pandas=True)
+            spool.write(pa.table(arrays))
+            rows += len(chunk)
+            del chunk, arrays
+            if on_progress is not None:
+                on_progress('parsing', bytes_read, bytes_total, rows)
+
+        if stats is None:
+            raise ValueError("Uploaded file contains no data")
+
+        sketches = {col: column_stats.sketch for col, column_stats in stats.items()}
+        schema = pa.schema([(col, column_stats.arrow_type()) for col, column_stats in stats.items()],
+                           metadata={**sketch_metadata(sketches), **summary_metadata(numeric_summaries(stats))})
+        written = 0
+        with pa.ipc.new_file(tmp_path, schema) as writer:
+            for batch in spool.batches():
+                writer.write_batch(pa.record_batch(
+                    [_cast_column(batch.column(col), stats[col], schema.field(col).type)
+                     for col in schema.names],
+                    schema=schema,
+                ))
+                written += batch.num_rows
+                if on_progress is not None:
+                    on_progress('writing', bytes_total, bytes_total, written)
+        os.replace(tmp_path, target)
+    finally:
+        spool.cleanup()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return {
+        "columns": list(stats),
+        "rows": next(iter(stats.values())).count if stats else 0,
+        "stats": stats,
+        "profile": {col: column_stats.profile() for col, column_stats in stats.items()},
+    }
@@ -0,0 +1,308 @@
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from ...chart_cache import chart_cache
+from ...specs import GRAPH_TYPES
+from ...datasets import discard_dataset
+from ...models import UploadedFile
+
+FILE_FORMATS = ('csv', 'csv.gz', 'parquet')
+_STATUS_POLL_SECONDS = 0.01
+
+
+def synthetic_frame(rows, numeric=4, categorical=2, categories=20, null_fraction=0.0, seed=0):
+    """Tick data with OHLC columns plus ``num_*`` floats and ``category_*`` labels
+
+    Prices follow a random walk one second apart, so every stock timeframe
+    from 1M upwards has bars to draw.
+    """
+    rng = np.random.default_rng(seed)
+    price = 100 + rng.normal(0, 0.05, rows).cumsum()
+    spread = np.abs(rng.normal(0, 0.02, (rows, 2)))
+    low, high = price - spread[:, 0], price + spread[:, 1]
+    frame = {
+        'ts': pd.date_range('2024-01-01', periods=rows, freq='s'),
+        'open': price,
+        'high': high,
+        'low': low,
+        'close': np.clip(price + rng.normal(0, 0.02, rows), low, high),
+        'volume': rng.integers(1, 1000, rows),
+    }
+    labels = np.array([f'c{i}' for i in range(categories)], dtype=object)
+    for i in range(categorical):
+        frame[f'category_{i}'] = rng.choice(labels, rows)
+    for i in range(numeric):
+        values = rng.normal(size=rows)
+        if null_fraction:
+            values[rng.random(rows) < null_fraction] = np.nan
+        frame[f'num_{i}'] = values
+    return pd.DataFrame(frame)
+
+
+def write_frame(frame, directory, file_format):
+    path = os.path.join(directory, f'benchmark.{file_format}')
+    if file_format == 'parquet':
+        frame.to_parquet(path, index=False)
+    else:
+        frame.to_csv(path, index=False, compression='gzip' if file_format == 'csv.gz' else None)
+    return path
+
+
+def chart_bodies(timeframe, preview=False):
+    """One generate_graph body per graph type over the synthetic_frame columns"""
+    bodies = {}
+    for graph_type in GRAPH_TYPES:
+        if graph_type == 'stock':
+            body = {'x_column': 'ts', 'y_columns': ['open', 'high', 'low', 'close', 'volume'],
+                    'timeframe': timeframe}
+        elif graph_type in ('pie', 'funnel', 'sunburst', 'waterfall'):
+            # Parts of a whole need positive totals
+            body = {'x_column': 'category_0', 'y_columns': ['volume']}
+        elif graph_type == 'bar':
+            body = {'x_column': 'category_0', 'y_columns': ['num_0', 'num_1']}
+        else:
+            body = {'x_column': 'ts', 'y_columns': ['num_0', 'num_1']}
+        bodies[graph_type] = {'graph_type': graph_type, 'preview': preview, **body}
+    return bodies
+
+
+def process_peak_rss_bytes():
+    """High-water mark of this process's resident memory so far, None where unknown
+
+    It covers everything the process did before, not just the measured step,
+    so only the first step to need more memory raises it.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def summarize(name, timings, output_bytes, **extra):
+    timings = np.asarray(timings) * 1000
+    return {
+        'name': name,
+        **extra,
+        'samples': len(timings),
+        'first_ms': round(float(timings[0]), 2),
+        'p50_ms': round(float(np.percentile(timings, 50)), 2),
+        'p95_ms': round(float(np.percentile(timings, 95)), 2),
+        'max_ms': round(float(timings.max()), 2),
+        'output_bytes': int(np.median(output_bytes)),
+        'process_peak_rss_bytes': process_peak_rss_bytes(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Names of the results whose p95 grew past ``tolerance`` times the baseline's"""
+    before = {entry['name']: entry for entry in baseline['results']}
+    regressions = []
+    for entry in results:
+        previous = before.get(entry['name'])
+        if previous and entry['p95_ms'] > previous['p95_ms'] * tolerance:
+            regressions.append(f"{entry['name']}: p95 {previous['p95_ms']}ms -> {entry['p95_ms']}ms")
+    return regressions
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark upload_file (new and already stored content), get_recommendations and "
+        "generate_graph (every graph type) against synthetic data through the test client "
+        "and print the results as JSON. "
+        "Uploads and rendered charts go to a temporary media root, chart cache and test "
+        "database, which are removed afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100_000)
+        parser.add_argument('--numeric', type=int, default=4, help="num_* float columns (at least 2)")
+        parser.add_argument('--categorical', type=int, default=2, help="category_* text columns (at least 1)")
+        parser.add_argument('--categories', type=int, default=20, help="distinct labels per text column")
+        parser.add_argument('--null-fraction', type=float, default=0.0)
+        parser.add_argument('--file-format', choices=FILE_FORMATS, default='csv')
+        parser.add_argument('--graph-types', default=','.join(GRAPH_TYPES),
+                            help="comma-separated graph types to render")
+        parser.add_argument('--timeframe', default='1H', help="stock chart timeframe")
+        parser.add_argument('--preview', action='store_true', help="render charts from the preview sample")
+        parser.add_argument('--repeat', type=int, default=5, help="timed requests per endpoint and graph type")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="write the JSON results here instead of stdout")
+        parser.add_argument('--baseline', help="earlier results to compare against; fails on a p95 regression")
+        parser.add_argument('--tolerance', type=float, default=1.25,
+                            help="p95 may grow to this multiple of the baseline before failing")
+        parser.add_argument('--use-default-db', action='store_true',
+                            help="store the benchmark datasets in the configured database, deleting them afterwards, "
+                                 "instead of a throwaway test database")
+
+    def handle(self, *args, **options):
+        graph_types = [graph_type.strip() for graph_type in options['graph_types'].split(',') if graph_type.strip()]
+        unknown = [graph_type for graph_type in graph_types if graph_type not in GRAPH_TYPES]
+        if unknown:
+            raise CommandError(f"Unknown graph types: {', '.join(unknown)}")
+        if options['numeric'] < 2 or options['categorical'] < 1:
+            raise CommandError("Need at least 2 numeric and 1 categorical column")
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1")
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as handle:
+                baseline = json.load(handle)
+
+        workdir = tempfile.mkdtemp(prefix='sdk-benchmark-')
+        caches = {**settings.CACHES, settings.CHART_CACHE_ALIAS: {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'benchmark-charts',
+        }}
+        setup_test_environment()
+        old_name = None
+        try:
+            if not options['use_default_db']:
+                old_name = connection.settings_dict['NAME']
+                connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            with override_settings(MEDIA_ROOT=os.path.join(workdir, 'media'), CACHES=caches):
+                results = self._run(workdir, graph_types, options)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        report = {
+            'config': {key: options[key] for key in (
+                'rows', 'numeric', 'categorical', 'categories', 'null_fraction', 'file_format',
+                'timeframe', 'preview', 'repeat', 'seed')},
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'pandas': pd.__version__,
+                'numpy': np.__version__,
+            },
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if baseline is not None:
+            regressions = compare(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError("Performance regressions:\n" + "\n".join(regressions))
+
+    def _run(self, workdir, graph_types, options):
+        self.stderr.write(f"Generating {options['rows']} rows as {options['file_format']}")
+        frame = synthetic_frame(options['rows'], options['numeric'], options['categorical'],
+                                options['categories'], options['null_fraction'], options['seed'])
+        path = write_frame(frame, workdir, options['file_format'])
+        del frame
+
+        client = Client()
+        datasets = []
+        try:
+            results = [self._bench_upload(client, path, options['repeat'], datasets)]
+            dataset_id = datasets[-1]
+            results.append(self._bench_duplicate_upload(client, path, options['repeat'], datasets))
+            results.append(self._bench_recommendations(client, dataset_id, options['repeat']))
+            bodies = chart_bodies(options['timeframe'], options['preview'])
+            for graph_type in graph_types:
+                results.append(self._bench_graph(client, dataset_id, bodies[graph_type], options['repeat']))
+        finally:
+            for file_instance in UploadedFile.objects.filter(pk__in=datasets):
+                discard_dataset(file_instance, file_instance.file.name)
+                file_instance.delete()
+        return results
+
+    def _bench_upload(self, client, path, repeat, datasets):
+        """Time from posting the file until its dataset is ready to chart"""
+        self.stderr.write("Benchmarking upload_file")
+        timings, sizes = [], []
+        for _ in range(repeat):
+            with open(path, 'rb') as handle:
+                started = time.perf_counter()
+                response = client.post('/sdkreact/upload_file/', {'file': handle})
+            if response.status_code != 202:
+                raise CommandError(f"upload_file answered {response.status_code}: {response.content[:200]!r}")
+            datasets.append(response.json()['dataset_id'])
+            status = {'status': UploadedFile.PROCESSING}
+            while status['status'] == UploadedFile.PROCESSING:
+                time.sleep(_STATUS_POLL_SECONDS)
+                status = client.get(response.json()['status_url']).json()
+            timings.append(time.perf_counter() - started)
+            if status['status'] != UploadedFile.READY:
+                raise CommandError(f"Upload failed: {status.get('error')}")
+            sizes.append(os.path.getsize(path))
+            # Forget the content hash so the next repeat is parsed again rather than deduplicated
+            content_hash = UploadedFile.objects.get(pk=datasets[-1]).content_hash
+            UploadedFile.objects.filter(pk=datasets[-1]).update(content_hash='')
+        UploadedFile.objects.filter(pk=datasets[-1]).update(content_hash=content_hash)
+        return summarize('upload_file', timings, sizes, endpoint='upload_file')
+
+    def _bench_duplicate_upload(self, client, path, repeat, datasets):
+        """Time re-uploading bytes that are already stored, answered with a dataset sharing them"""
+        self.stderr.write("Benchmarking upload_file with known content")
+        timings, sizes = [], []
+        for _ in range(repeat):
+            with open(path, 'rb') as handle:
+                started = time.perf_counter()
+                response = client.post('/sdkreact/upload_file/', {'file': handle})
+            timings.append(time.perf_counter() - started)
+            if response.status_code != 200 or not response.json()['deduplicated']:
+                raise CommandError(f"Re-upload was not deduplicated: {response.status_code} {response.content[:200]!r}")
+            datasets.append(response.json()['dataset_id'])
+            sizes.append(os.path.getsize(path))
+        return summarize('upload_file:duplicate', timings, sizes, endpoint='upload_file')
+
+    def _bench_recommendations(self, client, dataset_id, repeat):
+        self.stderr.write("Benchmarking get_recommendations")
+        body = {'dataset_id': dataset_id, 'columns': ['ts', 'category_0', 'num_0', 'num_1']}
+        timings, sizes = [], []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = client.post('/sdkreact/get_recommendations/', body, content_type='application/json')
+            timings.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise CommandError(f"get_recommendations answered {response.status_code}: {response.content[:200]!r}")
+            sizes.append(len(response.content))
+        return summarize('get_recommendations', timings, sizes, endpoint='get_recommendations')
+
+    def _bench_graph(self, client, dataset_id, body, repeat):
+        """Time uncached renders; the dataset's columns stay warm after the first"""
+        graph_type = body['graph_type']
+        self.stderr.write(f"Benchmarking generate_graph {graph_type}")
+        timings, sizes = [], []
+        for _ in range(repeat):
+            chart_cache().clear()
+            started = time.perf_counter()
+            response = client.post('/sdkreact/generate_graph/', {'dataset_id': dataset_id, **body},
+                                   content_type='application/json')
+            timings.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise CommandError(f"generate_graph {graph_type} answered {response.status_code}: "
+                                   f"{response.content[:200]!r}")
+            sizes.append(len(response.content))
+        return summarize(f'generate_graph:{graph_type}', timings, sizes,
+                         endpoint='generate_graph', graph_type=graph_type,
+                         points_rendered=response.json()['points_rendered'])
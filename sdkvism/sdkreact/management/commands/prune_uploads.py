@@ -0,0 +1,51 @@
+import argparse
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...retention import delete_dataset, orphan_files, plan_retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete uploaded datasets past the retention rules (age, idle time and a total "
+        "byte quota evicting the least recently used first) together with their sidecars "
+        "and cached data, and with --delete-orphans files in the upload directory that "
+        "belong to no dataset. Only lists them unless run with --no-dry-run. Defaults come "
+        "from the UPLOAD_MAX_* settings; run it periodically, e.g. from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-days', type=float, default=settings.UPLOAD_MAX_AGE_DAYS,
+                            help="delete datasets uploaded longer ago than this (0: keep)")
+        parser.add_argument('--max-idle-days', type=float, default=settings.UPLOAD_MAX_IDLE_DAYS,
+                            help="delete datasets not used for this long (0: keep)")
+        parser.add_argument('--max-bytes', type=int, default=settings.UPLOAD_MAX_BYTES,
+                            help="evict least recently used datasets until files fit (0: no quota)")
+        parser.add_argument('--delete-orphans', action='store_true',
+                            help="also delete files in the upload directory that belong to no dataset")
+        parser.add_argument('--dry-run', action=argparse.BooleanOptionalAction, default=True,
+                            help="only list what would be deleted (the default); --no-dry-run deletes it")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        doomed = plan_retention(options['max_age_days'], options['max_idle_days'], options['max_bytes'])
+        freed = 0
+        for file_instance, reason, nbytes in doomed:
+            self.stdout.write(f"{'Would delete' if dry_run else 'Deleting'} dataset {file_instance.pk} "
+                              f"({file_instance.file.name}, {nbytes} bytes): {reason}")
+            if not dry_run:
+                delete_dataset(file_instance)
+            freed += nbytes
+
+        orphans = orphan_files() if options['delete_orphans'] else []
+        for path in orphans:
+            nbytes = os.path.getsize(path)
+            self.stdout.write(f"{'Would delete' if dry_run else 'Deleting'} orphaned file {path} ({nbytes} bytes)")
+            if not dry_run:
+                os.remove(path)
+            freed += nbytes
+
+        self.stdout.write(f"{len(doomed)} datasets and {len(orphans)} orphaned files, "
+                          f"{freed} bytes {'would be ' if dry_run else ''}freed")
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sdkreact', '0002_uploadedfile_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='profile',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:38
+
+from django.db import migrations, models
+
+
+def fill_rows(apps, schema_editor):
+    UploadedFile = apps.get_model('sdkreact', 'UploadedFile')
+    for file_instance in UploadedFile.objects.exclude(profile={}):
+        file_instance.rows = next(iter(file_instance.profile.values()))['rows']
+        file_instance.save(update_fields=['rows'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sdkreact', '0005_uploadedfile_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='rows',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sdkreact', '0006_uploadedfile_rows'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='progress',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
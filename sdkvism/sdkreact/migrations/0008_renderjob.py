@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sdkreact', '0007_uploadedfile_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderJob',
+            fields=[
+                ('job_id', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('status', models.CharField(default='pending', max_length=16)),
+                ('graph_type', models.CharField(blank=True, default='', max_length=32)),
+                ('meta', models.JSONField(blank=True, default=dict)),
+                ('image', models.BinaryField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('http_status', models.PositiveSmallIntegerField(default=500)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
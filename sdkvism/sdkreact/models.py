@@ -1,5 +1,46 @@
 from django.db import models
 
 class UploadedFile(models.Model):
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PROCESSING, 'Processing'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    ]
+
     file = models.FileField(upload_to='uploads/')
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    version = models.PositiveIntegerField(default=1)
+    # Rows stored; appends grow it without bumping the version
+    rows = models.BigIntegerField(default=0)
+    profile = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=READY)
+    error = models.TextField(blank=True, default='')
+    # Latest progress record while processing, kept here so every worker process sees it
+    progress = models.JSONField(default=dict, blank=True)
+    # Last sign of life from the worker processing the upload; see uploads.reclaim_stale_uploads
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    # sha256 of the uploaded bytes, kept for full imports so an identical
+    # re-upload reuses this dataset instead of being stored and parsed again
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    # Last time a chart or recommendation used the dataset, for retention
+    last_accessed = models.DateTimeField(null=True, blank=True)
+
+
+class RenderJob(models.Model):
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    # Stored in the database so a poll reaching any worker process finds the job
+    job_id = models.CharField(max_length=32, primary_key=True)
+    status = models.CharField(max_length=16, default=PENDING)
+    graph_type = models.CharField(max_length=32, blank=True, default='')
+    # Chart metadata and encoded image of a finished render
+    meta = models.JSONField(default=dict, blank=True)
+    image = models.BinaryField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    http_status = models.PositiveSmallIntegerField(default=500)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
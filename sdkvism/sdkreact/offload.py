@@ -0,0 +1,119 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import JsonResponse
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = None
+
+# Set on the copy of the request context that offloaded work runs in
+_cancelled = contextvars.ContextVar('sdkreact_cancelled', default=None)
+
+# Returned by next() once an iterator is exhausted
+_DONE = object()
+
+
+class ServerBusy(Exception):
+    """Raised when ASYNC_MAX_QUEUE calls are already queued or running on the pool"""
+
+
+class RequestCancelled(Exception):
+    """Raised inside offloaded work once the client it was for has disconnected"""
+
+
+def _get_executor():
+    global _executor, _slots
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.ASYNC_WORKERS, thread_name_prefix='offload')
+            _slots = threading.BoundedSemaphore(settings.ASYNC_MAX_QUEUE)
+        return _executor
+
+
+def raise_if_cancelled():
+    """Stop offloaded work between expensive steps once its client is gone; a no-op anywhere else"""
+    cancelled = _cancelled.get()
+    if cancelled is not None and cancelled.is_set():
+        raise RequestCancelled
+
+
+def _call(cancelled, func, args, kwargs):
+    _cancelled.set(cancelled)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # Pool threads outlive requests, so honour CONN_MAX_AGE like a request thread would
+        close_old_connections()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Await a blocking call run on the bounded pool, keeping the event loop free
+
+    Raises ServerBusy instead of queueing once ASYNC_MAX_QUEUE calls are
+    waiting or running. Cancelling the awaiting task (Django does so when
+    the client disconnects) drops the call if it has not started yet, and
+    makes raise_if_cancelled stop it at its next checkpoint if it has.
+    """
+    executor = _get_executor()
+    if not _slots.acquire(blocking=False):
+        raise ServerBusy("Server is busy, retry later")
+    cancelled = threading.Event()
+    try:
+        future = executor.submit(contextvars.copy_context().run, _call, cancelled, func, args, kwargs)
+    except RuntimeError:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda done: _slots.release())
+    try:
+        return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        cancelled.set()
+        future.cancel()
+        raise
+
+
+async def iterate_in_threads(iterator):
+    """Async iterator over a blocking one, for streaming responses under ASGI
+
+    Each item is pulled on a worker thread, so the event loop keeps
+    serving other requests meanwhile and every item is sent as soon as it
+    is ready. The iterator is closed when the client stops reading early.
+    """
+    pull = sync_to_async(next, thread_sensitive=False)
+    try:
+        while True:
+            item = await pull(iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        try:
+            await sync_to_async(iterator.close, thread_sensitive=False)()
+        except ValueError:
+            # Still producing an item for a client that left; it is closed once garbage collected
+            pass
+
+
+def offloaded(view):
+    """Async version of a sync view: the view runs on the bounded pool while the request waits without a thread
+
+    Under ASGI, Django runs sync views one at a time on a single shared
+    thread; these run ASYNC_WORKERS at a time, and answer 503 with
+    Retry-After once the pool's queue is full.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            return await run_blocking(view, request, *args, **kwargs)
+        except ServerBusy as e:
+            response = JsonResponse({"error": str(e)}, status=503)
+            response['Retry-After'] = '1'
+            return response
+    return wrapper
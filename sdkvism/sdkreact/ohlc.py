@@ -0,0 +1,90 @@
+import pandas as pd
+
+# timeframe -> (grouping frequency, finer timeframe it is derived from, bar length in days)
+# Every level's bins nest exactly inside its parent's, so aggregating the
+# parent's bars gives the same result as resampling the raw ticks.
+TIMEFRAMES = {
+    '1M': ('1min', None, 1 / 1440),
+    '5M': ('5min', '1M', 5 / 1440),
+    '10M': ('10min', '5M', 10 / 1440),
+    '15M': ('15min', '5M', 15 / 1440),
+    '30M': ('30min', '15M', 30 / 1440),
+    '1H': ('1h', '30M', 1 / 24),
+    '4H': ('4h', '1H', 4 / 24),
+    '1D': ('1D', '4H', 1),
+    '1W': ('W', '1D', 7),
+    '1MO': ('M', '1D', 30),
+}
+
+# Calendar periods are labelled by their last day, as resample('W'/'ME') did
+_PERIOD_FREQS = {'W': 'W-SUN', 'M': 'M'}
+
+
+def ohlc_columns(spec):
+    """Open, high, low, close and (optionally) volume columns of a stock spec"""
+    return spec['y_columns'][:5]
+
+
+def _bins(index, freq):
+    if freq in _PERIOD_FREQS:
+        return index.tz_localize(None).to_period(_PERIOD_FREQS[freq]).end_time.normalize()
+    return index.floor(freq)
+
+
+def _aggregations(columns):
+    return dict(zip(columns, ('first', 'max', 'min', 'last', 'sum')))
+
+
+def _ohlc(frame, columns, freq):
+    return frame.groupby(_bins(frame.index, freq)).agg(_aggregations(columns))
+
+
+def base_frame(x_values, y_frame, columns):
+    """Raw ticks indexed by time, sorted, with unparseable rows dropped
+
+    Raises ValueError when the x column cannot be read as dates.
+    """
+    frame = y_frame.apply(pd.to_numeric, errors='coerce')
+    try:
+        # Parsed per value like typed.py's dates, so mixed formats neither warn nor fail
+        frame.index = pd.DatetimeIndex(pd.to_datetime(x_values, format='mixed'))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Failed to generate stock chart: {e}")
+    return frame.dropna(subset=columns[:4]).sort_index()
+
+
+def derive_level(parent, timeframe, columns):
+    """Bars for ``timeframe`` built from its parent level's bars (or raw ticks)"""
+    return _ohlc(parent, columns, TIMEFRAMES[timeframe][0])
+
+
+def append_ticks(level, ticks, timeframe, columns):
+    """A level's bars with appended raw ticks (see base_frame) folded in, or None if they cannot be
+
+    Only ticks after the level's last one extend it: the bar they share
+    with the old ticks is combined and later bars are added, which equals
+    resampling all ticks again. Earlier ticks would change bars in the
+    middle, so the level has to be rebuilt instead.
+    """
+    last_tick = level.attrs.get('last_tick', False)
+    if last_tick is False:
+        return None
+    if len(ticks) == 0:
+        return level
+    if last_tick is not None and ticks.index[0] <= last_tick:
+        return None
+    bars = derive_level(ticks, timeframe, columns)
+    if len(level) and bars.index[0] == level.index[-1]:
+        shared = pd.concat([level.iloc[-1:], bars.iloc[:1]]).groupby(level=0).agg(_aggregations(columns))
+        bars = pd.concat([shared, bars.iloc[1:]])
+        level = level.iloc[:-1]
+    extended = pd.concat([level, bars])
+    extended.attrs['last_tick'] = ticks.index[-1]
+    return extended
+
+
+def resample_spec(uploaded_data, spec):
+    """Resample a raw frame for one stock spec without building the pyramid"""
+    columns = ohlc_columns(spec)
+    base = base_frame(uploaded_data[spec['x_column']], uploaded_data[columns], columns)
+    return derive_level(base, spec['timeframe'], columns)
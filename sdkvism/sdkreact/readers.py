@@ -0,0 +1,198 @@
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+FORMATS = ('csv', 'json', 'ndjson', 'parquet', 'arrow', 'arrow_stream', 'feather_v1')
+
+_COMPRESSION_MAGIC = {
+    b'\x1f\x8b': 'gzip',
+    b'\x28\xb5\x2f\xfd': 'zstd',
+}
+_BINARY_MAGIC = {
+    b'PAR1': 'parquet',
+    b'ARROW1': 'arrow',
+    b'\xff\xff\xff\xff': 'arrow_stream',
+    b'FEA1': 'feather_v1',
+}
+_NDJSON_SUFFIXES = ('.ndjson', '.jsonl')
+_SNIFF_BYTES = 64 * 1024
+
+# Bytes per pyarrow CSV block; types are inferred from the first block
+CSV_BLOCK_BYTES = 16 * 1024 * 1024
+
+
+def _source(file_path, compression):
+    """Open an upload as an Arrow stream and return it with the raw file underneath"""
+    raw = pa.OSFile(file_path)
+    if compression is None:
+        return raw, raw
+    return pa.CompressedInputStream(raw, compression), raw
+
+
+def _looks_like_ndjson(file_path, text):
+    if file_path.lower().removesuffix('.gz').removesuffix('.zst').endswith(_NDJSON_SUFFIXES):
+        return True
+    first_line, newline, rest = text.partition(b'\n')
+    if not newline or not rest.strip():
+        return False
+    try:
+        return isinstance(json.loads(first_line), dict)
+    except ValueError:
+        return False
+
+
+def detect_format(file_path):
+    """Return ``(format, compression)`` of an upload from its leading bytes
+
+    The extension is only consulted to tell newline-delimited JSON from a
+    JSON document when the content alone is ambiguous.
+    """
+    with open(file_path, 'rb') as handle:
+        head = handle.read(_SNIFF_BYTES)
+
+    compression = next((codec for magic, codec in _COMPRESSION_MAGIC.items() if head.startswith(magic)), None)
+    if compression is None:
+        for magic, file_format in _BINARY_MAGIC.items():
+            if head.startswith(magic):
+                return file_format, None
+    else:
+        stream, raw = _source(file_path, compression)
+        with raw:
+            head = stream.read(_SNIFF_BYTES)
+
+    if b'\x00' in head:
+        raise ValueError("Unsupported file format")
+    text = head.lstrip(b'\xef\xbb\xbf \t\r\n')
+    if text.startswith(b'['):
+        return 'json', compression
+    if text.startswith(b'{'):
+        return ('ndjson' if _looks_like_ndjson(file_path, text) else 'json'), compression
+    return 'csv', compression
+
+
+def _unique_names(names):
+    """Repeated column names numbered the way pandas.read_csv does: a, a.1, a.2"""
+    header = set(names)
+    counts = {}
+    unique = []
+    for name in names:
+        renamed = name
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            renamed = f"{name}.{count}"
+            count = count + 1 if renamed in header else counts.get(renamed, 0)
+        counts[renamed] = counts.get(renamed, 0) + 1
+        unique.append(renamed)
+    return unique
+
+
+def _batch_chunks(batches, chunk_rows):
+    """Re-slice Arrow record batches into pandas chunks of at most chunk_rows
+
+    Arrow keeps repeated column names, so they are renamed as pandas would
+    before a chunk could hold two columns under one name.
+    """
+    for batch in batches:
+        if len(set(batch.schema.names)) < batch.num_columns:
+            batch = batch.rename_columns(_unique_names(batch.schema.names))
+        for offset in range(0, batch.num_rows, chunk_rows):
+            yield batch.slice(offset, chunk_rows).to_pandas(date_as_object=False)
+
+
+def _estimated_bytes(chunks, total_rows, bytes_total):
+    """Attach a bytes-read estimate to chunks of a file whose row count is known up front"""
+    rows = 0
+    for chunk in chunks:
+        rows += len(chunk)
+        yield chunk, int(bytes_total * rows / total_rows) if total_rows else bytes_total
+
+
+def _csv_header(file_path, compression):
+    """Column names of a CSV upload's header row, repeats included"""
+    stream, raw = _source(file_path, compression)
+    with raw:
+        return pa_csv.open_csv(stream, read_options=pa_csv.ReadOptions(block_size=CSV_BLOCK_BYTES)).schema.names
+
+
+def _read_csv(file_path, compression, chunk_rows, columns, engine):
+    read_options = pa_csv.ReadOptions(block_size=CSV_BLOCK_BYTES)
+    if engine == 'pyarrow' and columns:
+        # Selected columns may use the renamed form of a repeated header name
+        names = _csv_header(file_path, compression)
+        if len(set(names)) < len(names):
+            read_options = pa_csv.ReadOptions(block_size=CSV_BLOCK_BYTES, column_names=_unique_names(names),
+                                              skip_rows=1)
+    stream, raw = _source(file_path, compression)
+    with raw:
+        if engine == 'pyarrow':
+            reader = pa_csv.open_csv(
+                stream,
+                read_options=read_options,
+                convert_options=pa_csv.ConvertOptions(include_columns=columns or []),
+            )
+            for chunk in _batch_chunks(reader, chunk_rows):
+                yield chunk, raw.tell()
+        else:
+            with pd.read_csv(stream, chunksize=chunk_rows, usecols=columns) as reader:
+                for chunk in reader:
+                    yield chunk, raw.tell()
+
+
+def _read_ndjson(file_path, compression, chunk_rows, columns):
+    stream, raw = _source(file_path, compression)
+    with raw:
+        with pd.read_json(stream, lines=True, chunksize=chunk_rows) as reader:
+            for chunk in reader:
+                yield (chunk[columns] if columns else chunk), raw.tell()
+
+
+def read_chunks(file_path, chunk_rows, columns=None, csv_engine='pyarrow'):
+    """Yield an upload as pandas chunks, each with the file bytes consumed so far
+
+    Columnar formats are streamed batch by batch and only the requested
+    ``columns`` (all when None) are ever decoded.
+    """
+    file_format, compression = detect_format(file_path)
+    bytes_total = os.path.getsize(file_path)
+
+    if file_format == 'csv':
+        yield from _read_csv(file_path, compression, chunk_rows, columns, csv_engine)
+    elif file_format == 'ndjson':
+        yield from _read_ndjson(file_path, compression, chunk_rows, columns)
+    elif file_format == 'json':
+        # A JSON document cannot be split, so it arrives as one chunk
+        stream, raw = _source(file_path, compression)
+        with raw:
+            frame = pd.read_json(stream)
+        yield (frame[columns] if columns else frame), bytes_total
+    elif file_format == 'parquet':
+        parquet = pq.ParquetFile(file_path, memory_map=True)
+        batches = parquet.iter_batches(batch_size=chunk_rows, columns=columns)
+        yield from _estimated_bytes(_batch_chunks(batches, chunk_rows), parquet.metadata.num_rows, bytes_total)
+    elif file_format in ('arrow', 'arrow_stream'):
+        with pa.memory_map(file_path) as source:
+            if file_format == 'arrow':
+                reader = pa.ipc.open_file(source)
+                total_rows = sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+                batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+            else:
+                reader = pa.ipc.open_stream(source)
+                total_rows = 0
+                batches = iter(reader)
+            if columns:
+                batches = (batch.select(columns) for batch in batches)
+            chunks = _batch_chunks(batches, chunk_rows)
+            if total_rows:
+                yield from _estimated_bytes(chunks, total_rows, bytes_total)
+            else:
+                for chunk in chunks:
+                    yield chunk, source.tell()
+    else:
+        table = feather.read_table(file_path, columns=columns, memory_map=True)
+        yield from _estimated_bytes(_batch_chunks(table.to_batches(), chunk_rows), table.num_rows, bytes_total)
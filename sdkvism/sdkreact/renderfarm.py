@@ -0,0 +1,203 @@
+import multiprocessing
+import signal
+import threading
+import time
+import uuid
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.db import connections
+
+from .chart_cache import chart_cache
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = None
+
+
+class RenderFarmBusy(Exception):
+    """Raised when the render queue is already at its configured depth"""
+
+
+def _warm_worker():
+    """Pool initializer: pay for the plotting imports and font cache once per worker"""
+    from .charts import warmup
+    warmup()
+
+
+def _on_timeout(signum, frame):
+    raise TimeoutError
+
+
+def _render_job(file_path, columns, spec, image_format, submitted_at, timeout, rows=None, scale=1.0, limit=None):
+    """Runs inside a pool worker
+
+    Only the sidecar path and the spec (plus the row positions left by a
+    preview sample or filter) are pickled; the worker memory-maps the
+    columns it needs straight from the Feather file.
+    """
+    from .aggregate import aggregate_spec, is_aggregated
+    from .charts import render_chart
+    from .columnar import read_columns, read_rows
+    from .ohlc import resample_spec
+    from .specs import ChartError
+    from .tiles import tile_frame
+    from .typed import TypedColumns
+
+    remaining = timeout - (time.time() - submitted_at)
+    if remaining <= 0:
+        raise ChartError("Render timed out while queued", status=504)
+
+    use_alarm = hasattr(signal, 'SIGALRM')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_timeout)
+        signal.setitimer(signal.ITIMER_REAL, remaining)
+    try:
+        if rows is None:
+            uploaded_data = read_columns(file_path, columns, limit=limit)
+        else:
+            uploaded_data = read_rows(file_path, columns, rows, limit=limit)
+        if is_aggregated(spec):
+            uploaded_data = aggregate_spec(uploaded_data, spec, scale)
+        elif spec['graph_type'] == 'stock':
+            uploaded_data = resample_spec(uploaded_data, spec)
+        elif spec['tile'] is not None:
+            uploaded_data = tile_frame(uploaded_data, TypedColumns(uploaded_data), spec)
+        return render_chart(uploaded_data, spec, image_format)
+    except ValueError as e:
+        raise ChartError(str(e))
+    except TimeoutError:
+        raise ChartError(f"Render exceeded {timeout}s", status=504)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _get_pool():
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.RENDER_FARM_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_warm_worker,
+            )
+        if _slots is None:
+            _slots = threading.BoundedSemaphore(settings.RENDER_FARM_MAX_QUEUE)
+        return _pool
+
+
+def _reset_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def get_job(job_id):
+    """A job's state as ``{"status", "graph_type"}``, plus ``result`` once done or ``error`` and
+    ``http_status`` once failed; None for unknown jobs and jobs older than RENDER_JOB_TTL"""
+    # Render workers import this module without Django models
+    from .models import RenderJob
+
+    job = RenderJob.objects.filter(job_id=job_id, created_at__gte=_job_cutoff()).first()
+    if job is None:
+        return None
+    state = {"status": job.status, "graph_type": job.graph_type}
+    if job.status == RenderJob.DONE:
+        state["result"] = {"image": bytes(job.image), **job.meta}
+    elif job.status == RenderJob.FAILED:
+        state.update(error=job.error, http_status=job.http_status)
+    return state
+
+
+def _job_cutoff():
+    from django.utils import timezone
+    return timezone.now() - timedelta(seconds=settings.RENDER_JOB_TTL)
+
+
+def _create_job(spec, result=None):
+    from .models import RenderJob
+
+    RenderJob.objects.filter(created_at__lt=_job_cutoff()).delete()
+    job_id = uuid.uuid4().hex
+    if result is None:
+        RenderJob.objects.create(job_id=job_id, graph_type=spec['graph_type'])
+    else:
+        _finish_job(job_id, result, spec['graph_type'])
+    return job_id
+
+
+def _finish_job(job_id, result, graph_type):
+    from .models import RenderJob
+
+    meta = {key: value for key, value in result.items() if key != 'image'}
+    RenderJob.objects.update_or_create(job_id=job_id, defaults={
+        "status": RenderJob.DONE, "graph_type": graph_type, "meta": meta, "image": result["image"],
+    })
+
+
+def _fail_job(job_id, error, http_status):
+    from .models import RenderJob
+
+    RenderJob.objects.filter(job_id=job_id).update(status=RenderJob.FAILED, error=error, http_status=http_status)
+
+
+def submit_job(file_path, spec, image_format, cache_key, rows=None, scale=1.0, limit=None):
+    """Queue a render in the pool and return the new job id
+
+    Finished renders are also written to the chart cache under ``cache_key``
+    so the synchronous endpoints pick them up. Preview and filtered renders
+    pass the ``rows`` to read, previews also the ``scale`` from sample to
+    full totals. ``limit`` is the dataset's row count, so rows appended
+    after the job was queued are not drawn.
+    """
+    pool = _get_pool()
+    if not _slots.acquire(blocking=False):
+        raise RenderFarmBusy("Render queue is full, retry later")
+
+    try:
+        job_id = _create_job(spec)
+    except Exception:
+        _slots.release()
+        raise
+    columns = list(dict.fromkeys([spec['x_column']] + spec['y_columns']))
+
+    try:
+        future = pool.submit(_render_job, file_path, columns, spec, image_format,
+                             time.time(), settings.RENDER_FARM_JOB_TIMEOUT, rows, scale, limit)
+    except BrokenProcessPool:
+        _slots.release()
+        _reset_pool(pool)
+        raise
+
+    def _finished(done):
+        _slots.release()
+        try:
+            try:
+                image, meta = done.result()
+            except BrokenProcessPool:
+                _reset_pool(pool)
+                _fail_job(job_id, "Render worker crashed", 500)
+                return
+            except Exception as e:
+                _fail_job(job_id, str(e), getattr(e, 'status', 500))
+                return
+
+            result = {"image": image, **meta}
+            chart_cache().set(cache_key, result)
+            _finish_job(job_id, result, spec['graph_type'])
+        finally:
+            # Runs on the pool's long lived result thread; never leave its DB connection open
+            connections.close_all()
+
+    future.add_done_callback(_finished)
+    return job_id
+
+
+def complete_job(spec, result):
+    """Record a job that was answered from the chart cache without rendering"""
+    return _create_job(spec, result)
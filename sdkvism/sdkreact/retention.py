@@ -0,0 +1,96 @@
+import os
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .columnar import sidecar_files
+from .datasets import discard_dataset
+from .models import UploadedFile
+
+# Files in the upload directory that belong to no dataset are only removed
+# once this old, so a file being saved right now is never taken for one
+ORPHAN_GRACE_SECONDS = 60 * 60
+
+
+def dataset_bytes(file_instance):
+    """Bytes an upload and its sidecar (with appended segments) take on disk"""
+    total = 0
+    for path in [file_instance.file.path] + sidecar_files(file_instance.file.path):
+        if os.path.exists(path):
+            total += os.path.getsize(path)
+    return total
+
+
+def plan_retention(max_age_days=0, max_idle_days=0, max_bytes=0, now=None):
+    """``(file_instance, reason, nbytes)`` of every dataset the retention rules would delete
+
+    Age counts from the upload and idleness from the last access (or the
+    upload, when it was never used); 0 turns a rule off. The byte quota then
+    evicts the least recently used of the remaining datasets until all files
+    fit. Datasets still processing are never deleted, but count towards the quota.
+    Files shared by several datasets (see datasets.share_dataset) count once,
+    and their bytes are only freed with the last dataset holding them.
+    """
+    now = now or timezone.now()
+    datasets = list(UploadedFile.objects.order_by('pk'))
+    holders = Counter(file_instance.file.name for file_instance in datasets)
+    sizes = {}
+    for file_instance in datasets:
+        if file_instance.file.name not in sizes:
+            sizes[file_instance.file.name] = dataset_bytes(file_instance)
+
+    def release(file_instance):
+        holders[file_instance.file.name] -= 1
+        return sizes[file_instance.file.name] if holders[file_instance.file.name] == 0 else 0
+
+    doomed, kept = [], []
+    for file_instance in datasets:
+        last_used = file_instance.last_accessed or file_instance.uploaded_at
+        if file_instance.status == UploadedFile.PROCESSING:
+            continue
+        elif max_age_days and now - file_instance.uploaded_at > timedelta(days=max_age_days):
+            doomed.append((file_instance, 'age', release(file_instance)))
+        elif max_idle_days and now - last_used > timedelta(days=max_idle_days):
+            doomed.append((file_instance, 'idle', release(file_instance)))
+        else:
+            kept.append((last_used, file_instance))
+
+    if max_bytes:
+        total = sum(nbytes for name, nbytes in sizes.items() if holders[name] > 0)
+        for _, file_instance in sorted(kept, key=lambda entry: (entry[0], entry[1].pk)):
+            if total <= max_bytes:
+                break
+            nbytes = release(file_instance)
+            doomed.append((file_instance, 'quota', nbytes))
+            total -= nbytes
+    return doomed
+
+
+def delete_dataset(file_instance):
+    """Delete a dataset's row and files (unless another dataset shares them), and what this process cached for it
+
+    Charts cached for it are keyed by its id and version, which are never
+    reused, so they can no longer be served and age out of the chart cache.
+    """
+    discard_dataset(file_instance, file_instance.file.name)
+    file_instance.delete()
+
+
+def orphan_files(grace_seconds=ORPHAN_GRACE_SECONDS):
+    """Paths in the upload directory that belong to no dataset, such as files of deleted rows"""
+    field = UploadedFile._meta.get_field('file')
+    directory = field.storage.path(field.upload_to)
+    if not os.path.isdir(directory):
+        return []
+
+    known = set()
+    for name in UploadedFile.objects.values_list('file', flat=True):
+        path = field.storage.path(name)
+        known.update(os.path.normpath(known_path) for known_path in [path] + sidecar_files(path))
+
+    cutoff = time.time() - grace_seconds
+    return sorted(entry.path for entry in os.scandir(directory)
+                  if entry.is_file() and os.path.normpath(entry.path) not in known
+                  and entry.stat().st_mtime < cutoff)
@@ -5,3 +5,4 @@ class FileSerializer(serializers.ModelSerializer):
     class Meta:
         model = UploadedFile
         fields = '__all__'
+        read_only_fields = ['version', 'rows', 'profile', 'status', 'error', 'progress', 'content_hash', 'last_accessed']
@@ -0,0 +1,121 @@
+from . import aggregate, downsample, ohlc, tiles
+from .filters import parse_filter
+
+# Kept free of the plotting stack so views that only validate requests, or
+# never render at all, do not import matplotlib
+
+GRAPH_TYPES = ('line', 'bar', 'pie', 'area', 'scatter', 'histogram', 'box', 'violin',
+               'funnel', 'sunburst', 'waterfall', 'combo', 'stock')
+
+FIGURE_SIZE = (10, 6)
+FIGURE_DPI = 120
+# Scatter markers (s=100) are ~17px wide at FIGURE_DPI; bin at half that
+SCATTER_CELL_PX = 8
+
+IMAGE_CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+    'webp': 'image/webp',
+}
+
+
+class ChartError(Exception):
+    """A chart request that cannot be rendered, with the HTTP status to report"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+    def __reduce__(self):
+        # Keep the status when the error crosses a process boundary
+        return (ChartError, (str(self), self.status))
+
+
+def parse_chart_spec(data, available_columns):
+    """Validate a chart request body and return it with defaults applied"""
+    x_column = data.get('x_column')
+    y_columns = data.get('y_columns', [])
+    graph_type = data.get('graph_type', 'line')
+    downsample_method = data.get('downsample', 'auto')
+
+    if not isinstance(y_columns, list) or len(y_columns) == 0:
+        raise ChartError("Please provide a list of Y-axis columns")
+
+    if x_column not in available_columns:
+        raise ChartError("Invalid X-axis column selection")
+
+    for y_col in y_columns:
+        if y_col not in available_columns:
+            raise ChartError(f"Invalid Y-axis column: {y_col}")
+
+    if graph_type not in GRAPH_TYPES:
+        raise ChartError(f"Unsupported graph type: {graph_type}")
+
+    if downsample_method not in downsample.METHODS:
+        raise ChartError(f"Invalid downsample method. Use {', '.join(downsample.METHODS)}")
+
+    try:
+        max_points = int(data.get('max_points') or FIGURE_SIZE[0] * FIGURE_DPI)
+    except (TypeError, ValueError):
+        raise ChartError("max_points must be an integer")
+
+    timeframe = str(data.get('timeframe', '1D')).upper()
+    if graph_type == 'stock':
+        if len(y_columns) < 4:
+            raise ChartError("Stock chart requires Open, High, Low, Close columns")
+        if timeframe not in ohlc.TIMEFRAMES:
+            raise ChartError(f"Invalid timeframe. Use {','.join(ohlc.TIMEFRAMES)}")
+
+    aggregate_method = data.get('aggregate', 'auto')
+    if aggregate_method not in aggregate.METHODS:
+        raise ChartError(f"Invalid aggregate. Use {', '.join(aggregate.METHODS)}")
+
+    top_n = None
+    if graph_type in aggregate.DEFAULT_TOP_N:
+        if aggregate_method == 'auto':
+            aggregate_method = 'sum'
+        try:
+            top_n = int(data.get('top_n') or aggregate.DEFAULT_TOP_N[graph_type])
+        except (TypeError, ValueError):
+            raise ChartError("top_n must be an integer")
+        if top_n < 1:
+            raise ChartError("top_n must be at least 1")
+    else:
+        aggregate_method = 'none'
+
+    zoom, tile = data.get('zoom'), data.get('tile')
+    if zoom is not None or tile is not None:
+        if graph_type not in tiles.TILE_TYPES:
+            raise ChartError(f"Tiles are only available for {', '.join(tiles.TILE_TYPES)} charts")
+        try:
+            zoom, tile = int(zoom or 0), int(tile or 0)
+        except (TypeError, ValueError):
+            raise ChartError("zoom and tile must be integers")
+        if not 0 <= zoom <= tiles.MAX_ZOOM:
+            raise ChartError(f"zoom must be between 0 and {tiles.MAX_ZOOM}")
+        if not 0 <= tile < 2 ** zoom:
+            raise ChartError(f"tile must be between 0 and {2 ** zoom - 1} at zoom {zoom}")
+
+    try:
+        row_filter = parse_filter(data.get('filter'), available_columns)
+    except ValueError as e:
+        raise ChartError(str(e))
+
+    return {
+        'x_column': x_column,
+        'y_columns': y_columns,
+        'graph_type': graph_type,
+        'colors': data.get('colors', []),
+        'color_all': data.get('color_all', False),
+        'downsample': downsample_method,
+        'max_points': max_points,
+        'timeframe': timeframe,
+        'aggregate': aggregate_method,
+        'top_n': top_n,
+        'zoom': zoom,
+        'tile': tile,
+        'filter': row_filter,
+        # Stock bars need every tick for their open/close, and tiles are for
+        # zooming into exact detail, so neither is ever previewed
+        'preview': bool(data.get('preview', False)) and graph_type != 'stock' and tile is None,
+    }
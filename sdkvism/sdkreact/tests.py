@@ -1,3 +1,1191 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from datetime import timedelta
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from asgiref.sync import async_to_sync
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import appends, offload, views
+from .aggregate import OTHER_LABEL, aggregate_frame, group_totals, merge_groups
+from .chart_cache import chart_cache
+from .charts import RENDERERS, render_chart
+from .columnar import has_sidecar, read_column_names, read_columns, read_summaries, sidecar_path
+from .datasets import (
+    LRUStore, dataset_key, dataset_prefix, dataset_store, get_filter_rows, get_groups, get_ohlc_level, get_summary,
+    get_typed_columns,
+)
+from .distributions import ColumnSummary, box_stats, column_summary, histogram_bins
+from .downsample import bin2d, lttb, minmax, reduce_line, reduce_scatter
+from .filters import concat_rows, parse_filter, select_rows
+from .ingest import ingest_file
+from .management.commands.benchmark import chart_bodies, compare, synthetic_frame
+from .models import UploadedFile
+from .ohlc import append_ticks, base_frame, derive_level
+from .readers import detect_format, read_chunks
+from .retention import dataset_bytes, delete_dataset, orphan_files, plan_retention
+from .sketches import HyperLogLog, QuantileSketch, sample_indices
+from .specs import GRAPH_TYPES, parse_chart_spec
+from .timing import record, stage
+from .typed import TypedColumns
+
+
+def sample_frame(rows=500, start='2024-01-01', seed=0):
+    """Rows with a date, a text category, an int and float column and OHLC prices"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'date': pd.date_range(start, periods=rows, freq='7min').astype(str),
+        'cat': rng.choice(['a', 'b', 'c'], rows),
+        'i': rng.integers(0, 100, rows),
+        'f': rng.random(rows),
+        'open': rng.random(rows) + 10,
+        'high': rng.random(rows) + 11,
+        'low': rng.random(rows) + 9,
+        'close': rng.random(rows) + 10,
+    })
+
+
+OHLC_COLUMNS = ['open', 'high', 'low', 'close']
+
+
+def csv_bytes(frame):
+    return frame.to_csv(index=False).encode()
+
+
+def selected(rows, n):
+    """Row numbers of a row selection (a slice or an array)"""
+    return np.arange(n)[rows]
+
+
+class DownsampleTests(SimpleTestCase):
+    def setUp(self):
+        self.x = np.arange(10_000, dtype='float64')
+        self.y = np.sin(self.x / 50) + np.random.default_rng(0).normal(0, 0.1, len(self.x))
+
+    def test_lttb_keeps_endpoints_and_count(self):
+        picked = lttb(self.x, self.y, 500)
+        self.assertEqual(len(picked), 500)
+        self.assertEqual((picked[0], picked[-1]), (0, len(self.x) - 1))
+        self.assertTrue(np.all(np.diff(picked) > 0))
+
+    def test_minmax_keeps_extremes(self):
+        picked = minmax(self.x, self.y, 100)
+        self.assertIn(self.y.argmax(), picked)
+        self.assertIn(self.y.argmin(), picked)
+        self.assertLessEqual(len(picked), 200)
+
+    def test_reduce_line_keeps_short_series_and_drops_nulls(self):
+        self.assertEqual(reduce_line(self.x[:100], self.y[:100], 'lttb', 200), slice(None))
+        y = self.y.copy()
+        y[::3] = np.nan
+        rows = reduce_line(self.x, y, 'minmax', 1000)
+        self.assertTrue(np.isfinite(y[rows]).all())
+        self.assertLessEqual(len(rows), 1000)
+
+    def test_reduce_scatter_bins_onto_grid(self):
+        self.assertIsNone(reduce_scatter(self.x[:50], self.y[:50], 'bin', (10, 10)))
+        self.assertIsNone(reduce_scatter(self.x, self.y, 'none', (10, 10)))
+        cx, cy = reduce_scatter(self.x, self.y, 'bin', (10, 10))
+        self.assertLessEqual(len(cx), 100)
+        self.assertEqual(len(cx), len(cy))
+
+    def test_bin2d_counts_every_point(self):
+        cx, cy, counts = bin2d(self.x, self.y, 20, 20)
+        self.assertEqual(counts.sum(), len(self.x))
+        self.assertTrue((self.x.min() <= cx).all() and (cx <= self.x.max()).all())
+
+
+class RenderTests(SimpleTestCase):
+    def test_concurrent_renders_match_serial_ones(self):
+        frame = sample_frame(200)
+        specs = [parse_chart_spec({'x_column': x, 'y_columns': y, 'graph_type': graph_type}, list(frame.columns))
+                 for x, y, graph_type in (('date', ['f', 'i'], 'line'), ('cat', ['f'], 'bar'),
+                                          ('f', ['i'], 'scatter'), ('cat', ['f'], 'pie'),
+                                          ('date', ['f', 'i'], 'combo'), ('cat', ['f', 'i'], 'box'))]
+        expected = [render_chart(frame, spec)[0] for spec in specs]
+        results = [None] * (len(specs) * 3)
+
+        def render(index):
+            results[index] = render_chart(frame, specs[index % len(specs)])[0]
+
+        threads = [threading.Thread(target=render, args=(index,)) for index in range(len(results))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, expected * 3)
+
+    def test_every_graph_type_has_a_renderer(self):
+        self.assertEqual(set(RENDERERS), set(GRAPH_TYPES))
+        with self.assertRaisesMessage(Exception, 'Unsupported graph type: radar'):
+            parse_chart_spec({'x_column': 'a', 'y_columns': ['a'], 'graph_type': 'radar'}, ['a'])
+
+
+class TypedColumnsTests(SimpleTestCase):
+    def test_conversions_are_made_once_and_shared(self):
+        frame = pd.DataFrame({'n': ['1', 'x', '3'], 'd': ['2024-01-02', 'soon', '2024-01-01'], 'c': ['b', None, 'b']})
+        store = LRUStore(max_bytes=10_000, max_items=100)
+        typed = TypedColumns(frame, store, ('ds', 1))
+        np.testing.assert_array_equal(typed.valid('n'), [True, False, True])
+        self.assertTrue(np.isnat(typed.datetime('d')[1]))
+        codes, labels = typed.codes('c')
+        self.assertEqual((list(codes), list(labels)), ([0, -1, 0], ['b']))
+        self.assertIs(TypedColumns(frame, store, ('ds', 1)).numeric('n'), typed.numeric('n'))
+
+
+class AggregateTests(SimpleTestCase):
+    def setUp(self):
+        self.frame = pd.DataFrame({'cat': ['b', 'a', 'b', 'c', None, 'a', 'd'],
+                                   'y': [1.0, 2.0, 3.0, np.nan, 5.0, 6.0, 0.5]})
+
+    def test_group_totals_match_pandas(self):
+        labels, sums, counts = group_totals(TypedColumns(self.frame), 'cat', 'y')
+        expected = self.frame.groupby('cat', sort=False)['y'].agg(['sum', 'count'])
+        self.assertEqual(list(labels), list(expected.index))
+        np.testing.assert_allclose(sums, expected['sum'])
+        np.testing.assert_array_equal(counts, expected['count'])
+
+    def test_top_n_folds_the_rest(self):
+        groups = [group_totals(TypedColumns(self.frame), 'cat', 'y')]
+        spec = {'x_column': 'cat', 'y_columns': ['y'], 'aggregate': 'sum', 'top_n': 2}
+        frame = aggregate_frame(spec, groups)
+        self.assertEqual(frame['cat'].tolist(), ['a', OTHER_LABEL])
+        self.assertAlmostEqual(frame['y'].sum(), self.frame['y'][self.frame['cat'].notna()].sum())
+
+    def test_mean_and_count(self):
+        groups = [group_totals(TypedColumns(self.frame), 'cat', 'y')]
+        spec = {'x_column': 'cat', 'y_columns': ['y'], 'aggregate': 'mean', 'top_n': 10}
+        self.assertEqual(aggregate_frame(spec, groups)['y'].round(2).fillna(-1).tolist(), [2.0, 4.0, -1, 0.5])
+        spec['aggregate'] = 'count'
+        self.assertEqual(aggregate_frame(spec, groups)['y'].tolist(), [2, 2, 0, 1])
+
+    def test_merge_groups_equals_grouping_everything(self):
+        head, tail = self.frame.iloc[:4], self.frame.iloc[4:]
+        merged = merge_groups(group_totals(TypedColumns(head), 'cat', 'y'),
+                              group_totals(TypedColumns(tail), 'cat', 'y'), ['b', 'a', 'c', 'd'])
+        whole = group_totals(TypedColumns(self.frame), 'cat', 'y')
+        self.assertEqual(list(merged[0]), list(whole[0]))
+        np.testing.assert_allclose(merged[1], whole[1])
+        np.testing.assert_array_equal(merged[2], whole[2])
+
+
+class OhlcTests(SimpleTestCase):
+    def setUp(self):
+        frame = sample_frame(3000)
+        self.ticks = base_frame(frame['date'], frame[OHLC_COLUMNS], OHLC_COLUMNS)
+
+    def test_levels_nest(self):
+        minutes = derive_level(self.ticks, '1M', OHLC_COLUMNS)
+        pd.testing.assert_frame_equal(derive_level(minutes, '1H', OHLC_COLUMNS),
+                                      derive_level(self.ticks, '1H', OHLC_COLUMNS))
+        bars = derive_level(self.ticks, '1H', OHLC_COLUMNS)
+        self.assertEqual(len(bars), self.ticks.index.floor('1h').nunique())
+
+    def test_append_ticks_equals_resampling_everything(self):
+        old, new = self.ticks.iloc[:1000], self.ticks.iloc[1000:]
+        level = derive_level(old, '1H', OHLC_COLUMNS)
+        level.attrs['last_tick'] = old.index[-1]
+        extended = append_ticks(level, new, '1H', OHLC_COLUMNS)
+        pd.testing.assert_frame_equal(extended, derive_level(self.ticks, '1H', OHLC_COLUMNS), check_freq=False)
+        self.assertIsNone(append_ticks(extended, old, '1H', OHLC_COLUMNS))
+
+    def test_unparseable_dates(self):
+        with self.assertRaises(ValueError):
+            base_frame(pd.Series(['nope', 'never']), pd.DataFrame({c: [1, 2] for c in OHLC_COLUMNS}), OHLC_COLUMNS)
+
+    def test_mixed_date_formats(self):
+        dates = pd.Series(['2024-01-01', '01/02/2024 10:00'])
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            ticks = base_frame(dates, pd.DataFrame({c: [1, 2] for c in OHLC_COLUMNS}), OHLC_COLUMNS)
+        self.assertEqual(list(ticks.index), [pd.Timestamp('2024-01-01'), pd.Timestamp('2024-01-02 10:00')])
+
+
+class DistributionTests(SimpleTestCase):
+    def setUp(self):
+        self.values = np.random.default_rng(1).normal(10, 2, 20_000)
+        self.values[:5] = [40, 41, -30, 42, -31]
+
+    def test_summary_matches_numpy(self):
+        summary = column_summary(self.values)
+        for fraction, estimate in zip((25, 50, 75), (summary['q1'], summary['median'], summary['q3'])):
+            self.assertTrue(np.percentile(self.values, fraction - 0.5) < estimate
+                            < np.percentile(self.values, fraction + 0.5))
+        self.assertEqual(summary['count'], len(self.values))
+        self.assertEqual(summary['counts'].sum(), len(self.values))
+        self.assertAlmostEqual(summary['mean'], self.values.mean())
+        self.assertAlmostEqual(summary['std'], self.values.std(ddof=1))
+
+    def test_box_stats_match_matplotlib(self):
+        from matplotlib import cbook
+        # Until the quantile sketch compacts, every statistic is exact
+        small = self.values[:300]
+        expected = cbook.boxplot_stats(small)[0]
+        stats = box_stats(column_summary(small), 'y')
+        for name in ('med', 'q1', 'q3', 'whislo', 'whishi'):
+            self.assertAlmostEqual(stats[name], expected[name])
+        self.assertEqual(sorted(stats['fliers']), sorted(expected['fliers']))
+
+        expected = cbook.boxplot_stats(self.values)[0]
+        stats = box_stats(column_summary(self.values), 'y')
+        for name in ('med', 'q1', 'q3', 'whislo', 'whishi'):
+            self.assertAlmostEqual(stats[name], expected[name], delta=0.05)
+        fliers = stats['fliers']
+        self.assertTrue({40, 41, 42, -30, -31} <= set(fliers) <= set(self.values))
+        self.assertFalse(((fliers >= stats['whislo']) & (fliers <= stats['whishi'])).any())
+        self.assertAlmostEqual(len(fliers), len(expected['fliers']), delta=10)
+
+    def test_histogram_bins_cover_every_value(self):
+        counts, edges = histogram_bins(column_summary(self.values))
+        self.assertEqual(counts.sum(), len(self.values))
+        self.assertEqual(len(edges), len(counts) + 1)
+        self.assertTrue(edges[0] <= self.values.min() < edges[1])
+        self.assertTrue(edges[-2] <= self.values.max() < edges[-1])
+
+    def test_merged_summaries_match_a_single_pass(self):
+        whole = ColumnSummary()
+        whole.update(self.values)
+        merged = ColumnSummary()
+        for part in np.array_split(self.values, 7):
+            summary = ColumnSummary()
+            summary.update(part)
+            merged.merge(ColumnSummary.loads(json.loads(json.dumps(summary.dumps()))))
+        expected, stats = whole.stats(), merged.stats()
+        np.testing.assert_array_equal(stats['counts'], expected['counts'])
+        self.assertEqual(stats['range'], expected['range'])
+        for name in ('count', 'mean', 'std', 'min', 'max'):
+            self.assertAlmostEqual(stats[name], expected[name])
+        for name in ('q1', 'median', 'q3'):
+            self.assertAlmostEqual(stats[name], expected[name], delta=0.05)
+
+    def test_empty_column(self):
+        self.assertEqual(column_summary(np.array([])), {'count': 0})
+        counts, edges = histogram_bins({'count': 0})
+        self.assertEqual((counts.sum(), list(edges)), (0, [0.0, 1.0]))
+
+
+class SketchTests(SimpleTestCase):
+    def test_distinct_estimate(self):
+        sketch = HyperLogLog()
+        sketch.update(pd.Series(np.arange(20_000) % 10_000))
+        self.assertAlmostEqual(sketch.estimate() / 10_000, 1, delta=0.05)
+        small = HyperLogLog()
+        small.update(pd.Series(['a', 'b', None, 'a']))
+        self.assertEqual(small.estimate(), 2)
+
+    def test_merge_and_round_trip(self):
+        left, right, both = HyperLogLog(), HyperLogLog(), HyperLogLog()
+        left.update(pd.Series(np.arange(5000)))
+        right.update(pd.Series(np.arange(3000, 8000)))
+        both.update(pd.Series(np.arange(8000)))
+        left.merge(right)
+        self.assertEqual(left.estimate(), both.estimate())
+        self.assertEqual(HyperLogLog.loads(left.dumps()).estimate(), left.estimate())
+
+    def test_quantile_sketch(self):
+        small = QuantileSketch()
+        small.update(np.arange(10.0))
+        np.testing.assert_allclose(small.quantiles([0.25, 0.5, 0.75]), np.percentile(np.arange(10.0), [25, 50, 75]))
+
+        values = np.random.default_rng(2).random(200_000)
+        merged = QuantileSketch()
+        for part in np.array_split(values, 5):
+            sketch = QuantileSketch()
+            sketch.update(part)
+            merged.merge(QuantileSketch.loads(json.loads(json.dumps(sketch.dumps()))))
+        self.assertLess(merged.nbytes(), 20_000)
+        fractions = np.array([0.01, 0.25, 0.5, 0.75, 0.99])
+        ranks = np.searchsorted(np.sort(values), merged.quantiles(fractions)) / len(values)
+        np.testing.assert_allclose(ranks, fractions, atol=0.005)
+
+    def test_sample_indices_are_stable(self):
+        rows = sample_indices(1000, 100, seed=7)
+        self.assertEqual(len(np.unique(rows)), 100)
+        self.assertTrue(np.all(np.diff(rows) > 0))
+        np.testing.assert_array_equal(rows, sample_indices(1000, 100, seed=7))
+
+
+class FilterTests(SimpleTestCase):
+    def setUp(self):
+        self.frame = pd.DataFrame({
+            'num': [5.0, 1.0, np.nan, 3.0, 2.0, 4.0, np.nan, 1.0],
+            'sorted': [1, 2, 3, 4, 5, 6, 7, 8],
+            'cat': ['a', 'b', None, 'a', 'c', 'b', 'a', None],
+            'date': pd.to_datetime(['2024-01-0%d' % day for day in range(1, 9)]),
+        })
+        self.typed = TypedColumns(self.frame)
+        self.columns = list(self.frame.columns)
+
+    def rows(self, data):
+        return list(selected(select_rows(self.typed, parse_filter(data, self.columns)), len(self.frame)))
+
+    def test_parse_normalizes_conditions(self):
+        self.assertIsNone(parse_filter(None, self.columns))
+        self.assertEqual(parse_filter({'column': 'cat', 'eq': 'a'}, self.columns), {'column': 'cat', 'in': ['a']})
+        self.assertEqual(parse_filter([{'column': 'num', 'min': 1}], self.columns),
+                         {'and': [{'column': 'num', 'min': 1, 'max': None}]})
+
+    def test_parse_rejects_bad_filters(self):
+        for data in ({'column': 'nope', 'eq': 1}, {'column': 'num', 'eq': 1, 'in': [1]},
+                     {'column': 'num', 'in': []}, {'and': []}, {'column': 'num', 'null': 'yes'},
+                     {'column': 'num', 'eq': [1]}, 'num'):
+            with self.subTest(data=data), self.assertRaises(ValueError):
+                parse_filter(data, self.columns)
+
+    def test_ranges_match_pandas(self):
+        self.assertEqual(self.rows({'column': 'num', 'min': 2, 'max': 4}),
+                         list(np.flatnonzero(self.frame['num'].between(2, 4))))
+        self.assertEqual(self.rows({'column': 'sorted', 'min': 3}), [2, 3, 4, 5, 6, 7])
+        self.assertEqual(self.rows({'column': 'date', 'max': '2024-01-03'}), [0, 1, 2])
+
+    def test_equality_and_nulls(self):
+        self.assertEqual(self.rows({'column': 'num', 'eq': 1}), [1, 7])
+        self.assertEqual(self.rows({'column': 'cat', 'in': ['a', 'c']}), [0, 3, 4, 6])
+        self.assertEqual(self.rows({'column': 'cat', 'null': True}), [2, 7])
+        self.assertEqual(self.rows({'column': 'num', 'null': False}), [0, 1, 3, 4, 5, 7])
+
+    def test_and_or_combine(self):
+        self.assertEqual(self.rows([{'column': 'cat', 'eq': 'a'}, {'column': 'num', 'min': 4}]), [0])
+        self.assertEqual(self.rows({'or': [{'column': 'cat', 'eq': 'c'}, {'column': 'sorted', 'max': 2}]}),
+                         [0, 1, 4])
+
+    def test_bad_values_name_the_column(self):
+        with self.assertRaisesMessage(ValueError, 'not a date for column date'):
+            self.rows({'column': 'date', 'min': 'soon'})
+        with self.assertRaisesMessage(ValueError, 'cat is text'):
+            self.rows({'column': 'cat', 'min': 1})
+
+    def test_concat_rows_offsets_appended_rows(self):
+        self.assertEqual(list(concat_rows(np.array([1, 3]), np.array([0, 2]), 10)), [1, 3, 10, 12])
+        self.assertEqual(concat_rows(slice(0, 4), slice(0, 2), 4), slice(0, 6))
+
+
+class ReaderTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.frame = pd.DataFrame({'a': [1, 2, 3], 'b': ['x', 'y', 'z']})
+
+    def write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as handle:
+            handle.write(data)
+        return path
+
+    def test_detect_format_by_content(self):
+        table = pa.Table.from_pandas(self.frame, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        parquet_path = os.path.join(self.directory, 'p.bin')
+        pq.write_table(table, parquet_path)
+        arrow_path = os.path.join(self.directory, 'a.bin')
+        feather.write_feather(table, arrow_path)
+        cases = {
+            self.write('t.csv', b'a,b\n1,x\n'): ('csv', None),
+            self.write('t.dat', b'[{"a": 1}]'): ('json', None),
+            self.write('t.json', b'{"a": [1, 2]}'): ('json', None),
+            self.write('t.txt', b'{"a": 1}\n{"a": 2}\n'): ('ndjson', None),
+            self.write('t.gz', gzip.compress(b'a,b\n1,x\n')): ('csv', 'gzip'),
+            self.write('s.bin', sink.getvalue().to_pybytes()): ('arrow_stream', None),
+            parquet_path: ('parquet', None),
+            arrow_path: ('arrow', None),
+        }
+        for path, expected in cases.items():
+            with self.subTest(path=path):
+                self.assertEqual(detect_format(path), expected)
+
+    def test_detect_format_rejects_binary(self):
+        with self.assertRaisesMessage(ValueError, 'Unsupported file format'):
+            detect_format(self.write('bad.bin', b'\x00\x01\x02garbage'))
+
+    def test_every_format_reads_the_same_rows(self):
+        table = pa.Table.from_pandas(self.frame, preserve_index=False)
+        parquet_path = os.path.join(self.directory, 'rows.parquet')
+        pq.write_table(table, parquet_path)
+        paths = [
+            self.write('rows.csv', csv_bytes(self.frame)),
+            self.write('rows.csv.gz', gzip.compress(csv_bytes(self.frame))),
+            self.write('rows.json', self.frame.to_json(orient='records').encode()),
+            self.write('rows.ndjson', self.frame.to_json(orient='records', lines=True).encode()),
+            parquet_path,
+        ]
+        for path in paths:
+            with self.subTest(path=path):
+                chunks = [chunk for chunk, _ in read_chunks(path, 2)]
+                # A JSON document is parsed whole; the other formats stream
+                self.assertEqual(len(chunks), 1 if path.endswith('.json') else 2)
+                read = pd.concat(chunks, ignore_index=True)
+                self.assertEqual(read['a'].tolist(), [1, 2, 3])
+                self.assertEqual(read['b'].astype(str).tolist(), ['x', 'y', 'z'])
+
+    def test_columns_are_projected(self):
+        path = self.write('rows.csv', csv_bytes(self.frame))
+        for engine in ('pyarrow', 'pandas'):
+            with self.subTest(engine=engine):
+                chunks = [chunk for chunk, _ in read_chunks(path, 10, columns=['b'], csv_engine=engine)]
+                self.assertEqual(list(chunks[0].columns), ['b'])
+
+
+    def test_repeated_csv_headers_are_numbered_like_pandas(self):
+        path = self.write('dup.csv', b'a,a,b,a.1\n1,2,3,4\n')
+        for engine in ('pyarrow', 'pandas'):
+            with self.subTest(engine=engine):
+                chunk = next(read_chunks(path, 10, csv_engine=engine))[0]
+                self.assertEqual(list(chunk.columns), ['a', 'a.2', 'b', 'a.1'])
+                self.assertEqual(chunk.iloc[0].tolist(), [1, 2, 3, 4])
+                projected = next(read_chunks(path, 10, columns=['a.2', 'b'], csv_engine=engine))[0]
+                self.assertEqual(projected.to_dict('list'), {'a.2': [2], 'b': [3]})
+
+class TimingTests(SimpleTestCase):
+    def test_nested_stages_record_their_own_time(self):
+        with self.assertLogs('sdkreact.timing', 'INFO') as logs, record('test') as timer:
+            with stage('outer'):
+                time.sleep(0.02)
+                with stage('inner'):
+                    time.sleep(0.05)
+            timer.status = 200
+        self.assertLess(timer.stages['outer'][0], 0.05)
+        self.assertGreaterEqual(timer.stages['inner'][0], 0.05)
+        self.assertIn('outer;dur=', timer.server_timing())
+        self.assertEqual(json.loads(logs.records[0].getMessage())['endpoint'], 'test')
+
+    def test_stages_outside_a_recording_are_ignored(self):
+        with stage('nothing'):
+            pass
+
+
+class LazyImportTests(SimpleTestCase):
+    def test_views_do_not_load_the_plotting_stack(self):
+        script = ("import django; django.setup(); import sdkreact.urls, sys; "
+                  "print(sorted(m for m in ('matplotlib', 'seaborn', 'mplfinance') if m in sys.modules))")
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'sdkvism.settings', 'RENDER_WARMUP': '0'}
+        cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, env=env, cwd=cwd)
+        self.assertEqual(result.stdout.strip(), '[]', result.stderr)
+
+
+class LRUStoreTests(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        store = LRUStore(max_bytes=1000, max_items=2)
+        store.put(('a',), 1, 10)
+        store.put(('b',), 2, 10)
+        store.get(('a',))
+        store.put(('c',), 3, 10)
+        self.assertEqual((store.get(('a',)), store.get(('b',)), store.get(('c',))), (1, None, 3))
+
+    def test_byte_budget(self):
+        store = LRUStore(max_bytes=100, max_items=10)
+        store.put(('a',), 1, 60)
+        store.put(('b',), 2, 60)
+        self.assertIsNone(store.get(('a',)))
+        self.assertEqual(store.stats()['bytes'], 60)
+
+    def test_oversized_entry_is_returned_but_not_kept(self):
+        store = LRUStore(max_bytes=100, max_items=10)
+        store.put(('a',), 1, 50)
+        self.assertEqual(store.put(('big',), 2, 500), 2)
+        self.assertIsNone(store.get(('big',)))
+        self.assertEqual(store.get(('a',)), 1)
+
+    def test_prefix_entries_and_discard(self):
+        store = LRUStore(max_bytes=1000, max_items=10)
+        store.put((1, 1, 'x'), 'a', 1)
+        store.put((1, 2, 'x'), 'b', 1)
+        store.put((2, 1, 'x'), 'c', 1)
+        self.assertEqual([key for key, _, _ in store.entries(1)], [(1, 1, 'x'), (1, 2, 'x')])
+        store.discard(1, 1)
+        self.assertEqual(store.stats()['entries'], 2)
+        self.assertIsNone(store.get((1, 1, 'x')))
+
+
+class IngestTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as handle:
+            handle.write(data)
+        return path
+
+    def test_chunks_match_a_single_read_with_narrowed_types(self):
+        frame = sample_frame(1000)
+        path = self.write('data.csv', csv_bytes(frame))
+        seen = []
+        result = ingest_file(path, on_columns=seen.append, chunk_rows=128)
+        self.assertEqual((result['rows'], seen), (1000, [list(frame.columns)]))
+        self.assertEqual(read_column_names(path), list(frame.columns))
+        schema = feather.read_table(sidecar_path(path)).schema
+        self.assertEqual(schema.field('i').type, pa.int8())
+        self.assertTrue(pa.types.is_dictionary(schema.field('cat').type))
+        read = read_columns(path)
+        np.testing.assert_array_equal(read['i'], frame['i'])
+        np.testing.assert_allclose(read['f'], frame['f'])
+        self.assertEqual(read['cat'].astype(str).tolist(), frame['cat'].tolist())
+
+    def test_repeated_headers_are_ingested(self):
+        path = self.write('dup.csv', b'a,a,b\n1,2,3\n')
+        self.assertEqual(ingest_file(path)['rows'], 1)
+        self.assertEqual(read_columns(path).iloc[0].to_dict(), {'a': 1, 'a.1': 2, 'b': 3})
+
+    def test_later_chunks_widen_earlier_ones(self):
+        path = self.write('wide.csv', b'n,m\n1,1\n2,2\n2.5,x\n300000,3\n')
+        ingest_file(path, chunk_rows=2)
+        read = read_columns(path)
+        self.assertEqual(read['n'].tolist(), [1.0, 2.0, 2.5, 300000.0])
+        self.assertEqual(read['m'].astype(str).tolist(), ['1', '2', 'x', '3'])
+
+    def test_json_and_bad_files(self):
+        path = self.write('rows.json', b'[{"a": 1, "b": "x"}, {"a": 2, "b": "y"}]')
+        self.assertEqual(ingest_file(path)['rows'], 2)
+        with self.assertRaisesMessage(ValueError, 'Unsupported file format'):
+            ingest_file(self.write('bad.bin', b'\x00\x01\x02garbage'))
+        self.assertFalse(has_sidecar(os.path.join(self.directory, 'bad.bin')))
+
+
+class OffloadTests(SimpleTestCase):
+    def setUp(self):
+        self._reset_pool()
+        self.addCleanup(self._reset_pool)
+
+    def _reset_pool(self):
+        if offload._executor is not None:
+            offload._executor.shutdown(wait=True)
+        offload._executor = None
+        offload._slots = None
+
+    @override_settings(ASYNC_WORKERS=1, ASYNC_MAX_QUEUE=1)
+    def test_full_queue_answers_503(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow_view(request):
+            started.set()
+            release.wait(5)
+            return HttpResponse('done')
+
+        view = offload.offloaded(slow_view)
+        request = RequestFactory().get('/')
+
+        async def scenario():
+            first = asyncio.ensure_future(view(request))
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+            second = await view(request)
+            release.set()
+            return await first, second
+
+        first, second = asyncio.run(scenario())
+        self.assertEqual(first.content, b'done')
+        self.assertEqual(second.status_code, 503)
+        self.assertEqual(second['Retry-After'], '1')
+
+    def test_iterate_in_threads_closes_the_iterator(self):
+        closed = []
+
+        def numbers():
+            try:
+                yield from range(10)
+            finally:
+                closed.append(True)
+
+        async def first_two():
+            stream = offload.iterate_in_threads(numbers())
+            items = [await stream.__anext__(), await stream.__anext__()]
+            await stream.aclose()
+            return items
+
+        self.assertEqual(asyncio.run(first_two()), [0, 1])
+        self.assertEqual(closed, [True])
+
+
+class EndpointTestCase(TransactionTestCase):
+    """Requests against a temporary media directory, with uploads processed by the real background threads"""
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        overridden = override_settings(MEDIA_ROOT=media, REQUEST_TIMING=False)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        dataset_store.clear()
+        chart_cache().clear()
+
+    def upload(self, name, data, **extra):
+        response = self.client.post(reverse('upload_file'), {'file': SimpleUploadedFile(name, data), **extra})
+        self.assertIn(response.status_code, (200, 202), response.content)
+        return response.json()
+
+    def wait(self, dataset_id, timeout=30):
+        """Poll an upload's status until it is no longer processing"""
+        deadline = time.monotonic() + timeout
+        while True:
+            status = self.client.get(reverse('upload_status', args=[dataset_id])).json()
+            if status['status'] != UploadedFile.PROCESSING or time.monotonic() > deadline:
+                return status
+            time.sleep(0.05)
+
+    def ready_dataset(self, frame=None, name='data.csv'):
+        dataset_id = self.upload(name, csv_bytes(sample_frame() if frame is None else frame))['dataset_id']
+        self.assertEqual(self.wait(dataset_id)['status'], UploadedFile.READY)
+        return dataset_id
+
+    def post(self, url_name, body, **extra):
+        return self.client.post(reverse(url_name), body, content_type='application/json', **extra)
+
+    def chart_data(self, **body):
+        response = self.post('generate_graph_data', body)
+        self.assertEqual(response.status_code, 200, response.content)
+        return json.loads(response.content)
+
+
+class UploadTests(EndpointTestCase):
+    def test_upload_is_processed_in_background(self):
+        accepted = self.upload('data.csv', csv_bytes(sample_frame()))
+        self.assertEqual(accepted['status'], UploadedFile.PROCESSING)
+        self.assertFalse(accepted['deduplicated'])
+        status = self.wait(accepted['dataset_id'])
+        self.assertEqual(status['status'], UploadedFile.READY)
+        self.assertEqual(status['rows'], 500)
+        self.assertEqual(status['categories'], list(sample_frame().columns))
+        self.assertEqual(status['profile']['i']['kind'], 'int')
+        self.assertEqual(status['profile']['cat']['distinct'], 3)
+        self.assertEqual(status['profile']['date']['class'], 'datetime')
+        file_instance = UploadedFile.objects.get(pk=accepted['dataset_id'])
+        self.assertTrue(has_sidecar(file_instance.file.path))
+
+    def test_events_end_with_the_settled_status(self):
+        dataset_id = self.ready_dataset()
+        response = self.client.get(reverse('upload_events', args=[dataset_id]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = b''.join(response.streaming_content).decode()
+        self.assertTrue(events.startswith('event: ready\n'))
+
+    @override_settings(ASYNC_VIEWS=True)
+    def test_events_stream_asynchronously_under_asgi(self):
+        dataset_id = self.ready_dataset()
+        response = views.upload_events(RequestFactory().get('/'), dataset_id)
+        self.assertTrue(response.is_async)
+
+        async def collect():
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        self.assertIn(b'event: ready', async_to_sync(collect)())
+
+    def test_failed_upload_reports_its_error(self):
+        dataset_id = self.upload('bad.csv', b'\x00\x01\x02garbage')['dataset_id']
+        status = self.wait(dataset_id)
+        self.assertEqual(status['status'], UploadedFile.FAILED)
+        self.assertIn('Unsupported file format', status['error'])
+        response = self.post('generate_graph', {'dataset_id': dataset_id, 'x_column': 'a', 'y_columns': ['a']})
+        self.assertEqual(response.status_code, 409)
+        replaced = self.upload('good.csv', b'a\n1\n', dataset_id=dataset_id)
+        self.assertEqual(self.wait(replaced['dataset_id'])['status'], UploadedFile.READY)
+
+    def test_upload_in_another_format_with_selected_columns(self):
+        frame = sample_frame()
+        data = gzip.compress(frame.to_json(orient='records', lines=True).encode())
+        dataset_id = self.upload('data.bin', data, columns=['cat', 'f'])['dataset_id']
+        self.assertEqual(self.wait(dataset_id)['categories'], ['cat', 'f'])
+
+    def test_datasets_are_kept_apart_and_reloaded(self):
+        first = self.ready_dataset(pd.DataFrame({'x': [1, 2], 'y': [3, 4]}), 'first.csv')
+        second = self.ready_dataset()
+        dataset_store.clear()
+        response = self.post('generate_graph', {'dataset_id': first, 'x_column': 'x', 'y_columns': ['y']})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(base64.b64decode(response.json()['graph']).startswith(b'\x89PNG'))
+        response = self.post('generate_graph', {'dataset_id': second, 'x_column': 'x', 'y_columns': ['y']})
+        self.assertEqual(response.status_code, 400)
+
+    def test_sidecar_is_rebuilt_for_older_uploads(self):
+        dataset_id = self.ready_dataset()
+        file_instance = UploadedFile.objects.get(pk=dataset_id)
+        self.assertTrue(has_sidecar(file_instance.file.path))
+        os.remove(sidecar_path(file_instance.file.path))
+        dataset_store.clear()
+        response = self.post('generate_graph', {'dataset_id': dataset_id, 'x_column': 'cat', 'y_columns': ['f']})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(has_sidecar(file_instance.file.path))
+
+    def test_duplicate_upload_gets_its_own_dataset_sharing_the_files(self):
+        data = csv_bytes(sample_frame())
+        first = self.upload('data.csv', data)['dataset_id']
+        self.wait(first)
+        second = self.upload('again.csv', data)
+        self.assertTrue(second['deduplicated'])
+        self.assertNotEqual(second['dataset_id'], first)
+        self.assertEqual(self.wait(second['dataset_id'])['rows'], 500)
+        original, shared = UploadedFile.objects.get(pk=first), UploadedFile.objects.get(pk=second['dataset_id'])
+        self.assertEqual(original.file.name, shared.file.name)
+
+    def test_replacing_a_dataset_bumps_its_version(self):
+        dataset_id = self.ready_dataset()
+        body = {'dataset_id': dataset_id, 'x_column': 'x', 'y_columns': ['y']}
+        self.assertEqual(self.post('generate_graph', body).status_code, 400)
+        replaced = self.upload('new.csv', b'x,y\n1,2\n3,4\n', dataset_id=dataset_id)
+        self.assertEqual(replaced['dataset_id'], dataset_id)
+        status = self.wait(dataset_id)
+        self.assertEqual((status['version'], status['categories']), (2, ['x', 'y']))
+        self.assertEqual(self.post('generate_graph', body).json()['cache'], 'miss')
+
+    def test_upload_whose_worker_stopped_is_failed_and_replaceable(self):
+        dataset_id = self.ready_dataset()
+        UploadedFile.objects.filter(pk=dataset_id).update(status=UploadedFile.PROCESSING,
+                                                          heartbeat_at=timezone.now())
+        response = self.client.post(reverse('upload_file'), {
+            'file': SimpleUploadedFile('new.csv', b'x,y\n1,2\n'), 'dataset_id': dataset_id})
+        self.assertEqual(response.status_code, 409)
+        UploadedFile.objects.filter(pk=dataset_id).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        status = self.client.get(reverse('upload_status', args=[dataset_id])).json()
+        self.assertEqual(status['status'], UploadedFile.FAILED)
+        self.assertIn('upload the file again', status['error'])
+        UploadedFile.objects.filter(pk=dataset_id).update(status=UploadedFile.PROCESSING)
+        self.upload('new.csv', b'x,y\n1,2\n', dataset_id=dataset_id)
+        self.assertEqual(self.wait(dataset_id)['categories'], ['x', 'y'])
+
+    def test_dataset_id_is_required(self):
+        self.ready_dataset()
+        response = self.post('generate_graph', {'x_column': 'cat', 'y_columns': ['f']})
+        self.assertEqual(response.status_code, 400)
+        response = self.post('generate_graph', {'dataset_id': 999, 'x_column': 'cat', 'y_columns': ['f']})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('upload_status', args=[999])).status_code, 400)
+
+    def test_missing_profile_is_rebuilt_in_the_background(self):
+        dataset_id = self.ready_dataset()
+        UploadedFile.objects.filter(pk=dataset_id).update(profile={})
+        response = self.post('get_recommendations', {'dataset_id': dataset_id, 'columns': ['cat', 'f']})
+        self.assertEqual(response.status_code, 409)
+        status = self.wait(dataset_id)
+        self.assertEqual(status['status'], UploadedFile.READY)
+        self.assertIn('f', status['profile'])
+
+    def test_recommendations(self):
+        dataset_id = self.ready_dataset()
+        response = self.post('get_recommendations', {'dataset_id': dataset_id, 'columns': ['cat', 'f']})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['recommendations'])
+        self.assertEqual(self.post('get_recommendations', {'dataset_id': dataset_id}).status_code, 400)
+
+
+class ChartTests(EndpointTestCase):
+    def setUp(self):
+        super().setUp()
+        self.frame = sample_frame()
+        self.dataset_id = self.ready_dataset(self.frame)
+
+    def test_generate_graph_renders_and_caches(self):
+        body = {'dataset_id': self.dataset_id, 'x_column': 'date', 'y_columns': ['f', 'i']}
+        first = self.post('generate_graph', body).json()
+        self.assertEqual(first['cache'], 'miss')
+        self.assertTrue(base64.b64decode(first['graph']).startswith(b'\x89PNG'))
+        self.assertEqual(self.post('generate_graph', body).json()['cache'], 'hit')
+        self.assertEqual(self.post('generate_graph', {**body, 'graph_type': 'area'}).json()['cache'], 'miss')
+
+    def test_invalid_specs_are_rejected(self):
+        for body in ({'x_column': 'nope', 'y_columns': ['f']}, {'x_column': 'cat', 'y_columns': []},
+                     {'x_column': 'cat', 'y_columns': ['f', 'i'], 'graph_type': 'pie'},
+                     {'x_column': 'cat', 'y_columns': ['f'], 'graph_type': 'radar'},
+                     {'x_column': 'cat', 'y_columns': ['f'], 'filter': {'column': 'nope', 'eq': 1}}):
+            with self.subTest(body=body):
+                response = self.post('generate_graph', {'dataset_id': self.dataset_id, **body})
+                self.assertEqual(response.status_code, 400)
+
+    def test_image_etag_and_not_modified(self):
+        url = reverse('generate_graph_image')
+        query = {'dataset_id': self.dataset_id, 'x_column': 'cat', 'y_columns': ['f', 'i'], 'graph_type': 'bar'}
+        response = self.client.get(url, query)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, query, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        filtered = {**query, 'filter': {'column': 'f', 'max': 0.5}}
+        filtered_etag = self.post('generate_graph_image', filtered)['ETag']
+        dataset_store.clear()
+        self.assertEqual(self.post('generate_graph_image', filtered, HTTP_IF_NONE_MATCH=filtered_etag).status_code,
+                         304)
+        file_instance = UploadedFile.objects.get(pk=self.dataset_id)
+        self.assertEqual([key[3:] for key, _, _ in dataset_store.entries(*dataset_prefix(file_instance))],
+                         [('columns',)])
+
+        svg = self.client.get(url, {**query, 'image_format': 'svg'})
+        self.assertEqual(svg['Content-Type'], 'image/svg+xml')
+        self.assertNotEqual(svg['ETag'], etag)
+        self.assertEqual(self.client.get(url, {**query, 'image_format': 'gif'}).status_code, 400)
+
+        self.client.post(reverse('append_rows', args=[self.dataset_id]),
+                         {'rows': [{**self.frame.iloc[0].to_dict(), 'f': 99.0}]}, content_type='application/json')
+        changed = self.client.get(url, query, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+
+    def test_bar_chart_aggregates_categories(self):
+        data = self.chart_data(dataset_id=self.dataset_id, x_column='cat', y_columns=['f'], graph_type='bar')
+        expected = self.frame.groupby('cat', sort=False)['f'].sum()
+        self.assertEqual(data['columns']['x'], list(expected.index))
+        np.testing.assert_allclose(data['columns']['y'], expected.values)
+        raw = self.post('generate_graph', {'dataset_id': self.dataset_id, 'x_column': 'cat', 'y_columns': ['f'],
+                                           'graph_type': 'bar', 'aggregate': 'none'}).json()
+        self.assertEqual(raw['points_rendered'], len(self.frame))
+
+    @override_settings(PREVIEW_SAMPLE_ROWS=100)
+    def test_preview_draws_the_sample(self):
+        data = self.chart_data(dataset_id=self.dataset_id, x_column='date', y_columns=['f'], preview=True)
+        self.assertTrue(data['approximate'])
+        self.assertEqual(data['points_rendered'], 100)
+        bars = self.chart_data(dataset_id=self.dataset_id, x_column='cat', y_columns=['f'], graph_type='bar',
+                               aggregate='count', preview=True)
+        self.assertAlmostEqual(sum(bars['columns']['y']), len(self.frame))
+        image = self.client.get(reverse('generate_graph_image'), {'dataset_id': self.dataset_id, 'x_column': 'cat',
+                                                                   'y_columns': ['f'], 'preview': 'true'})
+        self.assertEqual(image['X-Chart-Approximate'], 'true')
+
+    def test_stock_chart_resamples_to_the_timeframe(self):
+        data = self.chart_data(dataset_id=self.dataset_id, x_column='date', y_columns=OHLC_COLUMNS,
+                               graph_type='stock', timeframe='1H')
+        hours = pd.to_datetime(self.frame['date']).dt.floor('1h')
+        self.assertEqual(data['points_rendered'], hours.nunique())
+        np.testing.assert_allclose(data['columns']['high'], self.frame.groupby(hours)['high'].max().values)
+        body = {'dataset_id': self.dataset_id, 'x_column': 'date', 'y_columns': OHLC_COLUMNS, 'graph_type': 'stock'}
+        self.assertEqual(self.post('generate_graph', {**body, 'timeframe': '2Y'}).status_code, 400)
+
+    def test_filter_limits_rows(self):
+        data = self.chart_data(dataset_id=self.dataset_id, x_column='date', y_columns=['f'], downsample='none',
+                               filter=[{'column': 'cat', 'in': ['a']}, {'column': 'f', 'max': 0.5}])
+        expected = ((self.frame['cat'] == 'a') & (self.frame['f'] <= 0.5)).sum()
+        self.assertEqual(data['points_rendered'], expected)
+        bars = self.chart_data(dataset_id=self.dataset_id, x_column='cat', y_columns=['f'], graph_type='bar',
+                               filter={'column': 'i', 'min': 50})
+        expected = self.frame[self.frame['i'] >= 50].groupby('cat')['f'].sum()
+        totals = dict(zip(bars['columns']['x'], bars['columns']['y']))
+        np.testing.assert_allclose([totals[label] for label in expected.index], expected.values)
+
+    def test_filter_matching_no_rows_is_rejected(self):
+        empty = {'column': 'i', 'min': 1000}
+        for graph_type in GRAPH_TYPES:
+            with self.subTest(graph_type=graph_type):
+                body = {'dataset_id': self.dataset_id, 'x_column': 'cat', 'y_columns': ['f'],
+                        'graph_type': graph_type, 'filter': empty}
+                if graph_type == 'stock':
+                    body.update(x_column='date', y_columns=OHLC_COLUMNS)
+                response = self.post('generate_graph', body)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'No rows match the filter'})
+        results = self.post('generate_graphs', {'dataset_id': self.dataset_id, 'charts': [
+            {'x_column': 'cat', 'y_columns': ['f'], 'graph_type': 'area', 'filter': empty}]}).json()['results']
+        self.assertEqual(results[0]['status'], 400)
+
+    def test_downsampled_line(self):
+        data = self.chart_data(dataset_id=self.dataset_id, x_column='date', y_columns=['f'], max_points=50)
+        self.assertLessEqual(data['points_rendered'], 50)
+        self.assertEqual(data['x_type'], 'datetime')
+        body = {'dataset_id': self.dataset_id, 'x_column': 'date', 'y_columns': ['f'], 'downsample': 'none'}
+        self.assertEqual(self.post('generate_graph', body).json()['points_rendered'], 500)
+
+    def test_combo_is_downsampled_like_its_chart_data(self):
+        body = {'dataset_id': self.dataset_id, 'x_column': 'date', 'y_columns': ['f', 'i'], 'graph_type': 'combo',
+                'max_points': 50}
+        rendered = self.post('generate_graph', body).json()['points_rendered']
+        self.assertLessEqual(rendered, 100)
+        self.assertEqual(rendered, self.chart_data(**body)['points_rendered'])
+
+    def test_distribution_summaries(self):
+        histogram = self.chart_data(dataset_id=self.dataset_id, x_column='cat', y_columns=['f'],
+                                    graph_type='histogram')
+        self.assertEqual(sum(histogram['columns']['y']), len(self.frame))
+        box = self.chart_data(dataset_id=self.dataset_id, x_column='cat', y_columns=['f', 'i'], graph_type='box')
+        self.assertEqual(box['columns']['series'], ['f', 'i'])
+        np.testing.assert_allclose(box['columns']['median'], self.frame[['f', 'i']].median().values)
+        for graph_type in ('histogram', 'box', 'violin'):
+            with self.subTest(graph_type=graph_type):
+                response = self.post('generate_graph', {'dataset_id': self.dataset_id, 'x_column': 'cat',
+                                                        'y_columns': ['f', 'i'], 'graph_type': graph_type})
+                self.assertEqual(response.status_code, 200, response.content)
+
+    def test_arrow_encoding(self):
+        response = self.post('generate_graph_data', {'dataset_id': self.dataset_id, 'x_column': 'cat',
+                                                     'y_columns': ['f'], 'graph_type': 'bar', 'encoding': 'arrow'})
+        table = pa.ipc.open_stream(response.content).read_all()
+        self.assertEqual(table.column('x').to_pylist(), list(self.frame['cat'].unique()))
+
+    def test_tiles_split_the_x_range(self):
+        body = {'dataset_id': self.dataset_id, 'x_column': 'i', 'y_columns': ['f'], 'graph_type': 'scatter',
+                'downsample': 'none', 'zoom': 1}
+        left, right = self.chart_data(**body, tile=0), self.chart_data(**body, tile=1)
+        self.assertEqual(left['x_window'][1], right['x_window'][0])
+        self.assertEqual(left['points_rendered'] + right['points_rendered'], len(self.frame))
+        unsorted = {**body, 'x_column': 'f', 'y_columns': ['i'], 'zoom': 2}
+        tiles = [self.chart_data(**unsorted, tile=tile) for tile in range(4)]
+        self.assertEqual(sum(tile['points_rendered'] for tile in tiles), len(self.frame))
+        lo, hi = tiles[1]['x_window']
+        self.assertEqual(tiles[1]['columns']['y'], self.frame['i'][self.frame['f'].between(lo, hi)].tolist())
+        by_date = self.chart_data(dataset_id=self.dataset_id, x_column='date', y_columns=['f'], zoom=2, tile=3)
+        self.assertLess(by_date['points_rendered'], len(self.frame) / 2)
+        for extra in ({'zoom': 1, 'tile': 2}, {'zoom': 'deep'}, {'graph_type': 'bar', 'zoom': 1}):
+            with self.subTest(extra=extra):
+                response = self.post('generate_graph_data', {**body, **extra})
+                self.assertEqual(response.status_code, 400)
+
+    def test_bad_downsample_options(self):
+        for extra in ({'downsample': 'fancy'}, {'max_points': 'many'}):
+            with self.subTest(extra=extra):
+                response = self.post('generate_graph', {'dataset_id': self.dataset_id, 'x_column': 'date',
+                                                        'y_columns': ['f'], **extra})
+                self.assertEqual(response.status_code, 400)
+
+    def test_batch_returns_results_in_request_order(self):
+        charts = [{'x_column': 'cat', 'y_columns': ['f'], 'graph_type': 'bar'},
+                  {'x_column': 'date', 'y_columns': ['f']},
+                  {'x_column': 'f', 'y_columns': ['i'], 'filter': {'column': 'f', 'min': 'high'}}]
+        results = self.post('generate_graphs', {'dataset_id': self.dataset_id, 'charts': charts}).json()['results']
+        self.assertEqual([entry['index'] for entry in results], [0, 1, 2])
+        self.assertTrue(base64.b64decode(results[0]['graph']).startswith(b'\x89PNG'))
+        self.assertEqual(results[2]['status'], 400)
+
+    def test_batch_streams_ndjson(self):
+        charts = [{'x_column': 'cat', 'y_columns': ['f'], 'graph_type': 'pie'},
+                  {'x_column': 'date', 'y_columns': ['i'], 'graph_type': 'area'}]
+        response = self.post('generate_graphs', {'dataset_id': self.dataset_id, 'charts': charts, 'stream': True})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(sorted(entry['index'] for entry in lines), [0, 1])
+
+    @override_settings(CHART_BATCH_MAX_CHARTS=1)
+    def test_batch_validates_every_spec_first(self):
+        charts = [{'x_column': 'cat', 'y_columns': ['f']}, {'x_column': 'cat', 'y_columns': ['f']}]
+        self.assertEqual(self.post('generate_graphs', {'dataset_id': self.dataset_id,
+                                                       'charts': charts}).status_code, 400)
+        bad = [{'x_column': 'cat', 'y_columns': ['nope']}]
+        self.assertEqual(self.post('generate_graphs', {'dataset_id': self.dataset_id,
+                                                       'charts': bad}).status_code, 400)
+
+    @override_settings(RENDER_FARM_WORKERS=1)
+    def test_render_job_runs_in_the_pool(self):
+        response = self.post('submit_render_job', {'dataset_id': self.dataset_id, 'x_column': 'f',
+                                                   'y_columns': ['i'], 'graph_type': 'scatter'})
+        self.assertIn(response.status_code, (200, 202), response.content)
+        job_id = response.json()['job_id']
+        deadline = time.monotonic() + 60
+        while True:
+            job = self.client.get(reverse('render_job_status', args=[job_id]))
+            if job.status_code != 202 or time.monotonic() > deadline:
+                break
+            time.sleep(0.1)
+        self.assertEqual(job.status_code, 200, job.content)
+        self.assertTrue(base64.b64decode(job.json()['graph']).startswith(b'\x89PNG'))
+        self.assertEqual(self.client.get(reverse('render_job_status', args=['nope'])).status_code, 404)
+
+
+    @override_settings(REQUEST_TIMING=True)
+    def test_metrics(self):
+        with self.assertLogs('sdkreact.timing', 'INFO'):
+            response = self.post('generate_graph', {'dataset_id': self.dataset_id, 'x_column': 'cat',
+                                                    'y_columns': ['f']})
+        self.assertIn('encode;dur=', response['Server-Timing'])
+        response = self.client.get(reverse('prometheus_metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('generate_graph', response.content.decode())
+
+
+class AppendTests(EndpointTestCase):
+    def setUp(self):
+        super().setUp()
+        self.old = sample_frame(600)
+        self.new = sample_frame(250, start='2024-01-03 22:00', seed=1)
+        self.new.loc[5, 'cat'] = 'zz'
+        self.dataset_id = self.ready_dataset(self.old)
+
+    def append(self, rows):
+        return self.client.post(reverse('append_rows', args=[self.dataset_id]), {'rows': rows},
+                                content_type='application/json')
+
+    def test_carried_forward_data_matches_a_fresh_upload(self):
+        file_instance = UploadedFile.objects.get(pk=self.dataset_id)
+        typed = get_typed_columns(file_instance)
+        for col in ('i', 'f', 'close'):
+            typed.numeric(col)
+            typed.sorted_index(col)
+        typed.codes('cat')
+        typed.postings('cat')
+        ranged = parse_filter({'column': 'f', 'max': 0.3}, list(self.old.columns))
+        category = parse_filter({'column': 'cat', 'in': ['a', 'zz']}, list(self.old.columns))
+        for row_filter in (None, ranged):
+            get_groups(file_instance, 'cat', 'f', False, row_filter)
+        for row_filter in (ranged, category):
+            get_filter_rows(file_instance, row_filter)
+        for timeframe in ('1H', '1D'):
+            get_ohlc_level(file_instance, 'date', OHLC_COLUMNS, timeframe)
+        for row_filter in (None, ranged):
+            get_summary(file_instance, 'f', False, row_filter)
+
+        response = self.append(self.new.to_dict(orient='records'))
+        self.assertEqual(response.json(), {'dataset_id': self.dataset_id, 'version': 1, 'rows': 850,
+                                           'appended': 250})
+        appended = UploadedFile.objects.get(pk=self.dataset_id)
+        kinds = {key[3] for key, _, _ in dataset_store.entries(*dataset_prefix(appended))}
+        self.assertTrue({'typed', 'groups', 'filter', 'ohlc', 'summary'} <= kinds)
+
+        fresh = UploadedFile.objects.get(pk=self.ready_dataset(pd.concat([self.old, self.new]), 'full.csv'))
+        rows = len(self.old) + len(self.new)
+        appended_typed, fresh_typed = get_typed_columns(appended), get_typed_columns(fresh)
+        for col in ('i', 'f', 'close'):
+            np.testing.assert_array_equal(appended_typed.numeric(col), fresh_typed.numeric(col))
+            np.testing.assert_array_equal(appended_typed.sorted_index(col)[0], fresh_typed.sorted_index(col)[0])
+        for left, right in zip(appended_typed.codes('cat'), fresh_typed.codes('cat')):
+            np.testing.assert_array_equal(left, right)
+        for row_filter in (None, ranged):
+            left, right = get_groups(appended, 'cat', 'f', False, row_filter), get_groups(fresh, 'cat', 'f', False,
+                                                                                          row_filter)
+            self.assertEqual(list(left[0]), list(right[0]))
+            np.testing.assert_allclose(left[1], right[1])
+            np.testing.assert_array_equal(left[2], right[2])
+        for row_filter in (ranged, category):
+            np.testing.assert_array_equal(selected(get_filter_rows(appended, row_filter), rows),
+                                          selected(get_filter_rows(fresh, row_filter), rows))
+        for timeframe in ('1H', '1D'):
+            pd.testing.assert_frame_equal(get_ohlc_level(appended, 'date', OHLC_COLUMNS, timeframe),
+                                          get_ohlc_level(fresh, 'date', OHLC_COLUMNS, timeframe), check_freq=False)
+        for col, profile in fresh.profile.items():
+            for field in ('kind', 'rows', 'nulls', 'min', 'max', 'monotonic', 'distinct'):
+                self.assertEqual(appended.profile[col][field], profile[field], (col, field))
+
+        def assert_same_summary(left, right):
+            left, right = left.stats(), right.stats()
+            np.testing.assert_array_equal(left['counts'], right['counts'])
+            for name in ('count', 'mean', 'std', 'min', 'max'):
+                self.assertAlmostEqual(left[name], right[name])
+            # Quartiles come from sketches that compacted differently
+            for name in ('q1', 'median', 'q3'):
+                self.assertAlmostEqual(left[name], right[name], delta=0.01)
+
+        for row_filter in (None, ranged):
+            assert_same_summary(get_summary(appended, 'f', False, row_filter),
+                                get_summary(fresh, 'f', False, row_filter))
+        saved = read_summaries(appended.file.path, rows=appended.rows)
+        self.assertEqual(sorted(saved), ['close', 'f', 'high', 'i', 'low', 'open'])
+        for col in saved:
+            assert_same_summary(saved[col], read_summaries(fresh.file.path, rows=fresh.rows)[col])
+
+    def test_new_values_widen_the_column(self):
+        row = self.old.iloc[0].to_dict()
+        self.assertEqual(self.append([{**row, 'i': 1.5}, {**row, 'i': 10 ** 6}]).status_code, 200)
+        file_instance = UploadedFile.objects.get(pk=self.dataset_id)
+        self.assertEqual(file_instance.profile['i']['kind'], 'float')
+        values = read_columns(file_instance.file.path, ['i'], limit=file_instance.rows)['i']
+        self.assertEqual(values.dtype, np.float64)
+        self.assertEqual(values.iloc[-2:].tolist(), [1.5, 10 ** 6])
+
+    def test_appended_file_in_any_format(self):
+        data = self.new.head(3).to_json(orient='records', lines=True).encode()
+        response = self.client.post(reverse('append_rows', args=[self.dataset_id]),
+                                    {'file': SimpleUploadedFile('more.ndjson', data)})
+        self.assertEqual(response.json()['rows'], 603)
+
+    @override_settings(APPEND_MAX_SEGMENTS=3)
+    def test_many_appends_read_back_in_order(self):
+        for start in range(0, 250, 25):
+            self.assertEqual(self.append(self.new.iloc[start:start + 25].to_dict(orient='records')).status_code, 200)
+        file_instance = UploadedFile.objects.get(pk=self.dataset_id)
+        stored = read_columns(file_instance.file.path, ['f', 'cat'], limit=file_instance.rows)
+        np.testing.assert_array_equal(stored['f'], pd.concat([self.old, self.new])['f'])
+        self.assertEqual(stored['cat'].astype(str).tolist(), pd.concat([self.old, self.new])['cat'].tolist())
+        self.assertNotIn(self.dataset_id, appends._locks)
+
+    def test_bad_rows_are_rejected(self):
+        row = self.old.iloc[0].to_dict()
+        for rows in ([{'x': 1}], [{**row, 'f': 'abc'}], [], 'rows'):
+            with self.subTest(rows=rows):
+                self.assertEqual(self.append(rows).status_code, 400)
+        self.assertEqual(UploadedFile.objects.get(pk=self.dataset_id).rows, 600)
+
+
+class RetentionTests(EndpointTestCase):
+    def test_quota_evicts_the_least_recently_used(self):
+        old = self.ready_dataset(sample_frame(seed=1))
+        recent = self.ready_dataset(sample_frame(seed=2))
+        now = timezone.now()
+        UploadedFile.objects.filter(pk=old).update(last_accessed=now - timezone.timedelta(days=3))
+        UploadedFile.objects.filter(pk=recent).update(last_accessed=now)
+        quota = dataset_bytes(UploadedFile.objects.get(pk=recent))
+        self.assertEqual([(file_instance.pk, reason) for file_instance, reason, _ in plan_retention(max_bytes=quota)],
+                         [(old, 'quota')])
+        self.assertEqual([file_instance.pk for file_instance, _, _ in plan_retention(max_idle_days=1, now=now)],
+                         [old])
+
+    def test_shared_files_count_once(self):
+        data = csv_bytes(sample_frame())
+        first = self.upload('data.csv', data)['dataset_id']
+        self.wait(first)
+        second = self.upload('data.csv', data)['dataset_id']
+        nbytes = dataset_bytes(UploadedFile.objects.get(pk=first))
+        self.assertEqual(plan_retention(max_bytes=nbytes), [])
+        planned = plan_retention(max_bytes=nbytes - 1)
+        self.assertEqual([file_instance.pk for file_instance, _, _ in planned], [first, second])
+        self.assertEqual([freed for _, _, freed in planned], [0, nbytes])
+
+    def test_prune_deletes_datasets_and_their_files(self):
+        dataset_id = self.ready_dataset()
+        file_instance = UploadedFile.objects.get(pk=dataset_id)
+        stray = os.path.join(os.path.dirname(file_instance.file.path), 'stray.csv')
+        with open(stray, 'w') as handle:
+            handle.write('a\n1\n')
+        os.utime(stray, (0, 0))
+        call_command('prune_uploads', max_bytes=1, stdout=open(os.devnull, 'w'))
+        self.assertTrue(os.path.exists(file_instance.file.path))
+        call_command('prune_uploads', max_bytes=1, dry_run=False, stdout=open(os.devnull, 'w'))
+        self.assertTrue(os.path.exists(stray))
+        self.assertFalse(UploadedFile.objects.exists())
+        self.assertFalse(os.path.exists(file_instance.file.path))
+        self.assertFalse(has_sidecar(file_instance.file.path))
+        call_command('prune_uploads', delete_orphans=True, dry_run=False, stdout=open(os.devnull, 'w'))
+        self.assertFalse(os.path.exists(stray))
+
+    def test_orphan_files(self):
+        dataset_id = self.ready_dataset()
+        file_instance = UploadedFile.objects.get(pk=dataset_id)
+        stray = os.path.join(os.path.dirname(file_instance.file.path), 'stray.csv')
+        with open(stray, 'w') as handle:
+            handle.write('a\n1\n')
+        self.assertEqual(orphan_files(grace_seconds=3600), [])
+        self.assertEqual(orphan_files(grace_seconds=-1), [stray])
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_chart_bodies_fit_the_synthetic_frame(self):
+        frame = synthetic_frame(2000, null_fraction=0.1)
+        self.assertGreater(frame['num_0'].isna().sum(), 0)
+        bodies = chart_bodies('1H')
+        self.assertEqual(set(bodies), set(GRAPH_TYPES))
+        for body in bodies.values():
+            with self.subTest(graph_type=body['graph_type']):
+                parse_chart_spec(body, list(frame.columns))
+
+    def test_compare_flags_p95_regressions(self):
+        baseline = {'results': [{'name': 'a', 'p95_ms': 10.0}, {'name': 'b', 'p95_ms': 10.0}]}
+        results = [{'name': 'a', 'p95_ms': 12.0}, {'name': 'b', 'p95_ms': 13.0}, {'name': 'c', 'p95_ms': 99.0}]
+        self.assertEqual(compare(results, baseline, 1.25), ['b: p95 10.0ms -> 13.0ms'])
+
+    def test_rejects_unknown_graph_types(self):
+        with self.assertRaisesMessage(CommandError, 'Unknown graph types: radar'):
+            call_command('benchmark', graph_types='radar')
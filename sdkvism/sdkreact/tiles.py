@@ -0,0 +1,48 @@
+import numpy as np
+
+# Charts drawn along a continuous x axis, the only ones that can be cut into x-range tiles
+TILE_TYPES = ('line', 'area', 'scatter')
+# Deepest zoom level; zoom z splits the full x extent into 2**z tiles
+MAX_ZOOM = 24
+
+
+def tile_bounds(extent, zoom, tile):
+    """x range ``(lo, hi)`` of one tile of the full ``extent`` at ``zoom``"""
+    lo, hi = extent
+    width = (hi - lo) / 2 ** zoom
+    return lo + tile * width, lo + (tile + 1) * width
+
+
+def tile_frame(frame, typed, spec):
+    """The rows of ``frame`` one tile of ``spec`` draws, with the tile's x range in ``attrs['x_window']``
+
+    ``typed`` holds the full column conversions (see typed.py), so the x
+    column is searched, through its sort order unless it is sorted already,
+    rather than scanned. Each chart keeps reducing to its own point budget,
+    so deeper zoom levels show finer detail of a narrower window. Raises
+    ValueError when x is not numbers or dates.
+    """
+    x_column = spec['x_column']
+    if typed.is_categorical(x_column):
+        raise ValueError("Tiles need a numeric or date x column")
+    lo, hi = typed.extent(x_column)
+    if np.isnan(lo):
+        raise ValueError("The x column has no values to tile")
+    lo, hi = tile_bounds((lo, hi), spec['zoom'], spec['tile'])
+
+    if typed.is_sorted(x_column):
+        positions = typed.positions(x_column)
+        # One row beyond each edge, so lines run off the tile instead of stopping short
+        start = max(int(np.searchsorted(positions, lo, side='left')) - 1, 0)
+        stop = int(np.searchsorted(positions, hi, side='right')) + 1
+        window = frame.iloc[start:stop]
+    else:
+        # The cached sort order finds the tile's rows without scanning the column; they are drawn in row order
+        order, values = typed.sorted_index(x_column)
+        start, stop = np.searchsorted(values, lo, side='left'), np.searchsorted(values, hi, side='right')
+        window = frame.iloc[np.sort(order[start:stop])]
+
+    if typed.is_datetime(x_column):
+        lo, hi = np.datetime64(int(lo), 'ns'), np.datetime64(int(hi), 'ns')
+    window.attrs['x_window'] = (lo, hi)
+    return window
@@ -0,0 +1,208 @@
+import bisect
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current = contextvars.ContextVar('sdkreact_timer', default=None)
+
+
+class Timer:
+    """Per-stage durations and sizes of one request or background job
+
+    Stages may nest; each records only its own (self) time, so the stages
+    of a request add up to no more than its total.
+    """
+
+    def __init__(self, endpoint, labels=None):
+        self.endpoint = endpoint
+        self.labels = dict(labels or {})
+        self.stages = {}
+        self.status = None
+        self.total = None
+        self.started = time.perf_counter()
+        self._children = []
+
+    def add(self, name, seconds, nbytes=None):
+        entry = self.stages.setdefault(name, [0.0, None])
+        entry[0] += seconds
+        if nbytes is not None:
+            entry[1] = (entry[1] or 0) + nbytes
+
+    def server_timing(self):
+        """Value of a Server-Timing header, sizes carried in each stage's desc"""
+        parts = []
+        for name, (seconds, nbytes) in self.stages.items():
+            part = f"{name};dur={seconds * 1000:.1f}"
+            if nbytes is not None:
+                part += f';desc="{nbytes} bytes"'
+            parts.append(part)
+        parts.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+@contextmanager
+def stage(name):
+    """Time a block as one stage of whatever is being recorded; free when nothing is"""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    timer._children.append(0.0)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        timer.add(name, elapsed - timer._children.pop())
+        if timer._children:
+            timer._children[-1] += elapsed
+
+
+def size(name, nbytes):
+    """Add to the bytes a stage of the current recording produced"""
+    timer = _current.get()
+    if timer is not None:
+        timer.add(name, 0.0, nbytes)
+
+
+def label(**labels):
+    """Attach metric labels, such as the graph type, to the current recording"""
+    timer = _current.get()
+    if timer is not None:
+        timer.labels.update(labels)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _series(name, labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return name
+    return name + '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+class Metrics:
+    """Counters and histograms of this process, rendered in the Prometheus text format"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # One count per bucket plus +Inf, then the running sum
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[slot] += 1
+            histogram[-1] += value
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(values)) for key, values in self._histograms.items())
+
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{_series(name, labels)} {value}")
+        for (name, labels), values in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values[:-1]):
+                cumulative += count
+                lines.append(f"{_series(name + '_bucket', labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{_series(name + '_sum', labels)} {values[-1]:.6f}")
+            lines.append(f"{_series(name + '_count', labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def _finish(timer):
+    timer.total = time.perf_counter() - timer.started
+    labels = {'endpoint': timer.endpoint, **timer.labels}
+    metrics.inc('sdkreact_requests_total', {**labels, 'status': timer.status})
+    metrics.observe('sdkreact_request_seconds', labels, timer.total)
+    for name, (seconds, nbytes) in timer.stages.items():
+        metrics.observe('sdkreact_stage_seconds', {**labels, 'stage': name}, seconds)
+        if nbytes is not None:
+            metrics.inc('sdkreact_stage_bytes_total', {**labels, 'stage': name}, nbytes)
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({
+            **labels,
+            'status': timer.status,
+            'total_ms': round(timer.total * 1000, 2),
+            'stages': {name: {'ms': round(seconds * 1000, 2), 'bytes': nbytes}
+                       for name, (seconds, nbytes) in timer.stages.items()},
+        }))
+
+
+@contextmanager
+def record(endpoint, **labels):
+    """Collect the stages run inside the block; logged and counted when it ends
+
+    Set the yielded timer's ``status`` before leaving the block, otherwise
+    the recording is dropped.
+    """
+    timer = Timer(endpoint, labels)
+    token = _current.set(timer)
+    try:
+        yield timer
+    finally:
+        _current.reset(token)
+        if timer.status is not None:
+            _finish(timer)
+
+
+def timed(endpoint):
+    """View decorator: record the view's stages and report them in a Server-Timing header
+
+    DRF responses are rendered inside the recording so JSON serialization
+    shows up as its own stage.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not settings.REQUEST_TIMING:
+                return view(request, *args, **kwargs)
+            with record(endpoint) as timer:
+                response = view(request, *args, **kwargs)
+                if not response.streaming and hasattr(response, 'render') and not response.is_rendered:
+                    with stage('serialize'):
+                        response.render()
+                    size('serialize', len(response.content))
+                timer.status = response.status_code
+            response['Server-Timing'] = timer.server_timing()
+            return response
+        return wrapper
+    return decorator
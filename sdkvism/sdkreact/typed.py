@@ -0,0 +1,252 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from . import timing
+from .downsample import is_categorical_axis
+
+
+def _nbytes(value):
+    arrays = value if isinstance(value, tuple) else (value,)
+    # Object arrays only count their pointers, so add a rough size per element
+    return sum(a.nbytes + (64 * len(a) if a.dtype == object else 0) for a in arrays)
+
+
+class TypedColumns:
+    """Columns of one frame coerced to NumPy arrays once, on first use
+
+    ``source`` is either a DataFrame or a callable returning one column as a
+    Series. With a ``store`` (an LRUStore) the arrays are kept under ``key``
+    and shared by every request for the same dataset version; without one
+    they live as long as this object. Each instance also pins what it has
+    handed out, so a chart never sees a column evicted halfway through.
+    """
+
+    def __init__(self, source, store=None, key=()):
+        self._source = source
+        self._store = store
+        self._key = key
+        self._arrays = {}
+        self._lock = threading.RLock()
+
+    def column(self, col):
+        if callable(self._source):
+            return self._source(col)
+        return self._source[col]
+
+    def _get(self, kind, col, convert):
+        key = self._key + (kind, col)
+        with self._lock:
+            value = self._arrays.get(key)
+            if value is None and self._store is not None:
+                value = self._store.get(key)
+            if value is None:
+                values = self.column(col)
+                with timing.stage('coerce'):
+                    value = convert(values)
+                if self._store is not None:
+                    self._store.put(key, value, _nbytes(value))
+            self._arrays[key] = value
+        return value
+
+    def is_categorical(self, col):
+        return is_categorical_axis(self.column(col))
+
+    def is_datetime(self, col):
+        return pd.api.types.is_datetime64_any_dtype(self.column(col))
+
+    def numeric(self, col):
+        """float64 values with NaN wherever the column is null or not a number"""
+        return self._get('numeric', col, lambda values: pd.to_numeric(values, errors='coerce')
+                         .to_numpy(dtype='float64', na_value=np.nan))
+
+    def valid(self, col):
+        """Null mask of ``numeric``: True where the value is a finite number"""
+        return self._get('valid', col, lambda values: np.isfinite(self.numeric(col)))
+
+    def datetime(self, col):
+        """datetime64[ns] values with NaT wherever the column is not a date"""
+        def to_datetime(values):
+            dates = pd.to_datetime(values, errors='coerce', format='mixed')
+            if dates.dt.tz is not None:
+                dates = dates.dt.tz_convert(None)
+            return dates.to_numpy(dtype='datetime64[ns]')
+        return self._get('datetime', col, to_datetime)
+
+    def codes(self, col):
+        """``(codes, labels)`` of the column's categories in order of first appearance, -1 for nulls"""
+        def factorize(values):
+            codes, labels = pd.factorize(values, sort=False)
+            return codes, np.asarray(labels, dtype=object)
+        return self._get('codes', col, factorize)
+
+    def positions(self, col):
+        """Float positions along an axis: numbers as-is, datetimes as ns, others by row order"""
+        if self.is_datetime(col):
+            def to_ns(values):
+                dates = self.datetime(col)
+                positions = dates.view('int64').astype('float64')
+                positions[np.isnat(dates)] = np.nan
+                return positions
+            return self._get('positions', col, to_ns)
+        if self.is_categorical(col):
+            return np.arange(len(self.column(col)), dtype='float64')
+        return self.numeric(col)
+
+    def extent(self, col):
+        """``[min, max]`` of the column's finite positions, NaN when it has none"""
+        def bounds(values):
+            positions = self.positions(col)
+            finite = positions[np.isfinite(positions)]
+            if len(finite) == 0:
+                return np.array([np.nan, np.nan])
+            return np.array([finite.min(), finite.max()])
+        return self._get('extent', col, bounds)
+
+    def is_sorted(self, col):
+        """True when every position is a number and they never decrease"""
+        return bool(self._get('sorted', col, lambda values: np.array(np.all(np.diff(self.positions(col)) >= 0))))
+
+    def sorted_index(self, col):
+        """``(order, values)``: row numbers sorting the column's positions, NaN last, and the positions in that order"""
+        def argsort(values):
+            positions = self.positions(col)
+            order = np.argsort(positions, kind='stable')
+            return order, positions[order]
+        return self._get('sorted_index', col, argsort)
+
+    def postings(self, col):
+        """``(rows, offsets)``: row numbers grouped by category code, each group in row order
+
+        Nulls come first; the rows of code c are ``rows[offsets[c + 1]:offsets[c + 2]]``.
+        """
+        def group(values):
+            codes, labels = self.codes(col)
+            counts = np.bincount(codes + 1, minlength=len(labels) + 1)
+            return np.argsort(codes, kind='stable'), np.concatenate(([0], np.cumsum(counts)))
+        return self._get('postings', col, group)
+
+    def select(self, rows):
+        """The same columns limited to ``rows`` (a slice or sorted row numbers)"""
+        return SelectedColumns(self, rows)
+
+    def axis(self, col):
+        """Values as matplotlib should place them: dates, numbers, or labels on a category axis"""
+        if self.is_datetime(col):
+            return self.datetime(col)
+        if self.is_categorical(col):
+            return self._get('labels', col, lambda values: values.to_numpy(dtype=object))
+        return self.numeric(col)
+
+
+# Conversions holding one value per row, and the method that returns each,
+# so a row selection can index them instead of converting again
+_ROW_KINDS = {
+    'numeric': 'numeric',
+    'valid': 'valid',
+    'datetime': 'datetime',
+    'codes': 'codes',
+    'positions': 'positions',
+    'labels': 'axis',
+}
+
+
+class SelectedColumns(TypedColumns):
+    """Some rows of another TypedColumns, such as those a filter keeps
+
+    Per-row arrays are sliced out of the parent's (shared, cached) arrays;
+    anything computed across rows, like the extent or sort order, is worked
+    out again for the selection. Category codes keep the parent's labels.
+    """
+
+    def __init__(self, parent, rows):
+        super().__init__(lambda col: parent.column(col).iloc[rows])
+        self._parent = parent
+        self._rows = rows
+
+    def is_categorical(self, col):
+        return self._parent.is_categorical(col)
+
+    def is_datetime(self, col):
+        return self._parent.is_datetime(col)
+
+    def _get(self, kind, col, convert):
+        method = _ROW_KINDS.get(kind)
+        if method is None:
+            return super()._get(kind, col, convert)
+        key = (kind, col)
+        with self._lock:
+            value = self._arrays.get(key)
+            if value is None:
+                value = getattr(self._parent, method)(col)
+                if isinstance(value, tuple):
+                    value = (value[0][self._rows],) + value[1:]
+                else:
+                    value = value[self._rows]
+                self._arrays[key] = value
+        return value
+
+
+def extend_typed(arrays, chunk, offset):
+    """Typed arrays of a dataset after rows were appended, built from the old ones
+
+    ``arrays`` maps ``(kind, col)`` to what the dataset's TypedColumns
+    held before the append and ``chunk`` is a TypedColumns over the new
+    rows, which start at row ``offset``. Per-row arrays are concatenated,
+    category codes renumbered, bounds widened and sort indexes merged, so
+    nothing is converted or sorted again over the old rows. Kinds that
+    cannot be extended (because what they derive from was already
+    evicted) are left out of the result.
+    """
+    extended = {}
+    for (kind, col), old in arrays.items():
+        if kind in ('numeric', 'valid', 'datetime', 'positions', 'labels'):
+            extended[kind, col] = np.concatenate((old, getattr(chunk, _ROW_KINDS[kind])(col)))
+        elif kind == 'codes':
+            extended[kind, col] = _extend_codes(old, chunk.codes(col))
+        elif kind == 'extent':
+            new = chunk.extent(col)
+            extended[kind, col] = np.array([np.fmin(old[0], new[0]), np.fmax(old[1], new[1])])
+        elif kind == 'sorted' and chunk.is_categorical(col):
+            # Categories are placed by row number, which always increases
+            extended[kind, col] = old
+        elif kind == 'sorted':
+            last = arrays.get(('positions' if chunk.is_datetime(col) else 'numeric', col))
+            if last is not None:
+                new = chunk.positions(col)
+                extended[kind, col] = np.array(bool(old) and chunk.is_sorted(col)
+                                               and (len(new) == 0 or len(last) == 0 or new[0] >= last[-1]))
+        elif kind == 'sorted_index' and not chunk.is_categorical(col):
+            order, values = chunk.sorted_index(col)
+            # Ties keep row order, so new rows go after equal old values; NaN sorts last either way
+            at = np.searchsorted(old[1], values, side='right')
+            extended[kind, col] = (np.insert(old[0], at, order + offset), np.insert(old[1], at, values))
+
+    for (kind, col), old in arrays.items():
+        if kind == 'postings' and ('codes', col) in extended:
+            extended[kind, col] = _extend_postings(old, extended['codes', col], offset)
+    return extended
+
+
+def _extend_codes(old, new):
+    """Codes of old rows followed by new ones, new categories numbered after the old in order of appearance"""
+    old_codes, old_labels = old
+    new_codes, new_labels = new
+    index = {label: code for code, label in enumerate(old_labels)}
+    added = [label for label in new_labels if label not in index]
+    index.update((label, len(old_labels) + i) for i, label in enumerate(added))
+    mapping = np.array([index[label] for label in new_labels] + [-1], dtype=old_codes.dtype)
+    labels = np.concatenate((old_labels, np.asarray(added, dtype=object)))
+    return np.concatenate((old_codes, mapping[new_codes])), labels
+
+
+def _extend_postings(old, codes, offset):
+    rows, offsets = old
+    new_codes = codes[0][offset:]
+    # New rows of each category go at the end of its old group, nulls (code -1) first
+    new_rows = np.argsort(new_codes, kind='stable')
+    groups = new_codes[new_rows] + 1
+    at = np.append(offsets, offsets[-1])[np.minimum(groups + 1, len(offsets))]
+    counts = np.bincount(codes[0] + 1, minlength=len(codes[1]) + 1)
+    return np.insert(rows, at, new_rows + offset), np.concatenate(([0], np.cumsum(counts)))
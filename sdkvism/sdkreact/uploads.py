@@ -0,0 +1,177 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.utils import timezone
+
+from . import timing
+from .datasets import discard_dataset, ingest_upload
+from .models import UploadedFile
+
+_executor = None
+_executor_lock = threading.Lock()
+# {pk: version} of the uploads queued or processing in this process, kept alive by the heartbeat thread
+_in_flight = {}
+
+# How often a progress record is rewritten while parsing
+_PROGRESS_INTERVAL = 0.25
+
+
+class ContentHashHandler(FileUploadHandler):
+    """Hash each uploaded file's bytes as they stream in
+
+    Insert it ahead of the storing handlers (``request.upload_handlers.insert(0, ...)``)
+    before the body is read; the hex sha256 of each file field lands in ``hashes``.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.hashes = {}
+        self._hash = None
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self._hash = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self._hash.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.hashes[self.field_name] = self._hash.hexdigest()
+        # Let the next handler build the stored file
+        return None
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.UPLOAD_WORKERS,
+                                           thread_name_prefix='upload')
+            threading.Thread(target=_heartbeat, name='upload-heartbeat', daemon=True).start()
+        return _executor
+
+
+def _heartbeat():
+    """Record every UPLOAD_HEARTBEAT_SECONDS that this process still works on its uploads
+
+    A chunk can take longer to parse than the gap between progress writes,
+    so the heartbeat comes from its own thread rather than from progress.
+    """
+    while True:
+        time.sleep(settings.UPLOAD_HEARTBEAT_SECONDS)
+        with _executor_lock:
+            running = list(_in_flight.items())
+        try:
+            for pk, version in running:
+                UploadedFile.objects.filter(pk=pk, version=version, status=UploadedFile.PROCESSING).update(
+                    heartbeat_at=timezone.now())
+        except DatabaseError:
+            # A missed beat only matters if the next ones are missed too
+            pass
+        finally:
+            connections.close_all()
+
+
+def reclaim_stale_uploads(file_instance=None):
+    """Mark uploads whose worker stopped sending heartbeats as failed and return how many there were
+
+    A worker that dies mid-parse would leave its dataset processing, and
+    impossible to replace, forever. After UPLOAD_STALE_SECONDS without a
+    heartbeat (see _heartbeat) the dataset fails like any failed upload.
+    With ``file_instance`` only that dataset is checked. Runs on the first
+    request of every process (see apps.py), and when a processing dataset
+    is replaced or polled.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.UPLOAD_STALE_SECONDS)
+    stale = Q(status=UploadedFile.PROCESSING) & (
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, uploaded_at__lt=cutoff))
+    candidates = UploadedFile.objects.filter(stale)
+    if file_instance is not None:
+        candidates = candidates.filter(pk=file_instance.pk)
+    with _executor_lock:
+        candidates = candidates.exclude(pk__in=list(_in_flight))
+
+    reclaimed = 0
+    for candidate in candidates:
+        # Filtered again, so a replacement started meanwhile is left alone
+        if UploadedFile.objects.filter(stale, pk=candidate.pk, version=candidate.version).update(
+                status=UploadedFile.FAILED, error="Processing stopped before it finished; upload the file again",
+                progress={}):
+            discard_dataset(candidate)
+            reclaimed += 1
+    return reclaimed
+
+
+def get_progress(file_instance):
+    """Latest progress record of a processing upload, or None if none was written yet"""
+    return file_instance.progress or None
+
+
+def _save_progress(file_instance, phase, bytes_read, bytes_total, rows, columns=None):
+    UploadedFile.objects.filter(pk=file_instance.pk, version=file_instance.version).update(progress={
+        "phase": phase,
+        "bytes_read": bytes_read,
+        "bytes_total": bytes_total,
+        "rows": rows,
+        "columns": columns,
+    }, heartbeat_at=timezone.now())
+
+
+def _process(pk, version, columns):
+    try:
+        file_instance = UploadedFile.objects.get(pk=pk)
+        if file_instance.version != version:
+            # Replaced again before this run started; the newer run owns it
+            return
+
+        last_saved = [0.0]
+        parsed_columns = []
+
+        def on_columns(names):
+            # Published straight away so clients can pick axes while the rest is parsed
+            parsed_columns[:] = names
+            _save_progress(file_instance, 'parsing', 0, file_instance.file.size, 0, parsed_columns)
+
+        def on_progress(phase, bytes_read, bytes_total, rows):
+            now = time.monotonic()
+            if now - last_saved[0] >= _PROGRESS_INTERVAL:
+                last_saved[0] = now
+                _save_progress(file_instance, phase, bytes_read, bytes_total, rows, parsed_columns or None)
+
+        with timing.record('upload_processing') as timer:
+            try:
+                with timing.stage('ingest'):
+                    ingest_upload(file_instance, on_progress, columns, on_columns)
+                timing.size('ingest', file_instance.file.size)
+                timer.status = UploadedFile.READY
+            except Exception as e:
+                discard_dataset(file_instance)
+                UploadedFile.objects.filter(pk=pk, version=version).update(
+                    status=UploadedFile.FAILED, error=str(e), progress={})
+                timer.status = UploadedFile.FAILED
+    finally:
+        with _executor_lock:
+            if _in_flight.get(pk) == version:
+                del _in_flight[pk]
+        # Upload threads are long lived; never leave their DB connection open
+        connections.close_all()
+
+
+def start_processing(file_instance, columns=None):
+    """Parse, convert and profile a saved upload on a background thread
+
+    ``columns`` limits the import to those columns of the upload.
+    """
+    _save_progress(file_instance, 'queued', 0, file_instance.file.size, 0)
+    executor = _get_executor()
+    with _executor_lock:
+        _in_flight[file_instance.pk] = file_instance.version
+    executor.submit(_process, file_instance.pk, file_instance.version, columns)
@@ -6,11 +6,27 @@ from django.conf import settings
 from django.conf.urls.static import static
 from .views import FrontendAppView
 from django.urls import path,re_path
+from .offload import offloaded
+
+
+def _view(view):
+    # Under ASGI (see sdkvism/asgi.py) every endpoint touching datasets or jobs runs on the offload pool
+    return offloaded(view) if settings.ASYNC_VIEWS else view
+
 
 urlpatterns = [
-    path('upload_file/', upload_file, name='upload_file'),
-    path('generate_graph/', generate_graph, name='generate_graph'),
-    path('get_recommendations/', views.get_recommendations, name='get_recommendations'),
+    path('upload_file/', _view(upload_file), name='upload_file'),
+    path('uploads/<int:dataset_id>/', _view(views.upload_status), name='upload_status'),
+    path('uploads/<int:dataset_id>/append/', _view(views.append_rows), name='append_rows'),
+    path('uploads/<int:dataset_id>/events/', _view(views.upload_events), name='upload_events'),
+    path('generate_graph/', _view(generate_graph), name='generate_graph'),
+    path('generate_graphs/', _view(views.generate_graphs), name='generate_graphs'),
+    path('generate_graph_image/', _view(views.generate_graph_image), name='generate_graph_image'),
+    path('generate_graph_data/', _view(views.generate_graph_data), name='generate_graph_data'),
+    path('get_recommendations/', _view(views.get_recommendations), name='get_recommendations'),
+    path('render_jobs/', _view(views.submit_render_job), name='submit_render_job'),
+    path('render_jobs/<str:job_id>/', _view(views.render_job_status), name='render_job_status'),
+    path('metrics/', views.prometheus_metrics, name='prometheus_metrics'),
     path('', FrontendAppView.as_view()),
     re_path(r'^.*', TemplateView.as_view(template_name='index.html')),
 ]
@@ -1,24 +1,41 @@
-import pandas as pd
-import matplotlib
-matplotlib.use('Agg') 
-import matplotlib.pyplot as plt
-import seaborn as sns
+import asyncio
 import base64
-from io import BytesIO
+import json
+import time
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, parser_classes
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
 from .models import UploadedFile
 from .serializers import FileSerializer
-from mplfinance.original_flavor import candlestick_ohlc
-import matplotlib.dates as mdates
-import numpy as np
+from .appends import append_rows as append_to_dataset, read_row_objects, read_upload
+from .batch import parse_batch, render_batch
+from .chartdata import DATA_CONTENT_TYPES, chart_data
+from .chart_cache import chart_cache, chart_cache_key, chart_etag
+from .specs import IMAGE_CONTENT_TYPES, ChartError, parse_chart_spec
+from .datasets import (
+    DatasetNotFound, discard_dataset, ensure_sidecar, find_duplicate, get_chart_frame, get_columns,
+    get_profile, get_chart_typed, get_row_positions, get_uploaded_file, sample_scale, share_dataset,
+)
+from .renderfarm import RenderFarmBusy, complete_job, get_job, submit_job
+from . import timing
+from .offload import iterate_in_threads, raise_if_cancelled
+from .uploads import ContentHashHandler, get_progress, reclaim_stale_uploads, start_processing
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.views.generic import TemplateView
 from django.views.generic import View
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.http import require_GET
+from django.utils.http import parse_etags, quote_etag
 import os
 
-uploaded_data = None  
+# Seconds between status checks on an upload's event stream
+_UPLOAD_EVENT_INTERVAL = 0.5
+
+# Query-string fields that carry a list or a flag when a chart is requested with GET
+_LIST_FIELDS = ('y_columns', 'colors')
+_FLAG_FIELDS = ('color_all', 'preview')
 
 class FrontendAppView(View):
     def get(self, request):
@@ -30,87 +47,194 @@ class FrontendAppView(View):
                 "index.html not found. Did you run 'npm run build'?", status=501,
             )
             
+@timing.timed('upload_file')
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])
 def upload_file(request):
-    """Handle file upload and return available categories"""
-    global uploaded_data
-    
+    """Save an upload and start processing it in the background
+
+    Answers 202 straight away with the dataset id and where to follow its
+    progress. The column names appear in that progress as soon as the first
+    chunk is parsed, the profile once the dataset is ready. CSV (optionally
+    gzip/zstd compressed), JSON, NDJSON, Parquet and Arrow IPC/Feather are
+    recognised by content, and repeating ``columns`` imports only those
+    columns. Passing an existing ``dataset_id`` replaces that dataset's
+    contents and bumps its version, which invalidates every chart cached
+    for it.
+
+    Uploads are hashed as they stream in. Bytes already stored as a full
+    import answer 200 with a new dataset sharing the stored files, marked
+    ``deduplicated``, and are neither saved nor parsed again. Replacing a
+    dataset with its own contents answers 200 with that dataset.
+    """
+    hasher = ContentHashHandler(request)
+    request.upload_handlers.insert(0, hasher)
     if 'file' not in request.data:
         return Response({"error": "No file provided"}, status=400)
+    raise_if_cancelled()
+    columns = request.data.getlist('columns') or None
+    # Imports of selected columns hold different derivatives, so only full imports are shared
+    content_hash = '' if columns else hasher.hashes.get('file', '')
 
-    serializer = FileSerializer(data=request.data)
+    replaced = None
+    if request.data.get('dataset_id'):
+        try:
+            with timing.stage('dataset'):
+                replaced = get_uploaded_file(request.data.get('dataset_id'), require_ready=False)
+        except DatasetNotFound as e:
+            return Response({"error": str(e)}, status=e.status)
+        if replaced.status == UploadedFile.PROCESSING:
+            # Unless its worker died, which fails it and lets it be replaced
+            if not reclaim_stale_uploads(replaced):
+                return Response({"error": f"Dataset {replaced.pk} is still processing"}, status=409)
+            replaced.refresh_from_db()
+        if content_hash and replaced.content_hash == content_hash and replaced.status == UploadedFile.READY:
+            return _upload_accepted(replaced, "File unchanged, dataset kept", deduplicated=True)
+    else:
+        with timing.stage('dataset'):
+            duplicate = find_duplicate(content_hash)
+        if duplicate is not None:
+            with timing.stage('save'):
+                file_instance = share_dataset(duplicate)
+            return _upload_accepted(file_instance, "File already uploaded, stored data reused", deduplicated=True)
+
+    serializer = FileSerializer(replaced, data=request.data)
     if serializer.is_valid():
-        serializer.save()
+        with timing.stage('save'):
+            if replaced is not None:
+                old_name = replaced.file.name
+                serializer.save(version=replaced.version + 1, status=UploadedFile.PROCESSING,
+                                error='', profile={}, content_hash=content_hash)
+                discard_dataset(replaced, old_name)
+            else:
+                serializer.save(status=UploadedFile.PROCESSING, content_hash=content_hash)
         file_instance = serializer.instance
-        file_path = file_instance.file.path
+        timing.size('save', file_instance.file.size)
+        with timing.stage('dispatch'):
+            start_processing(file_instance, columns)
 
-        try:
-            if file_path.endswith('.csv'):
-                df = pd.read_csv(file_path)
-            elif file_path.endswith('.json'):
-                df = pd.read_json(file_path)
-            else:
-                return Response({"error": "Unsupported file format"}, status=400)
-            
-            uploaded_data = df  
-            categories = df.columns.tolist() 
-            
-            return Response({
-                "message": "File uploaded successfully",
-                "categories": categories 
-            }, status=201)
-        except Exception as e:
-            return Response({"error": str(e)}, status=400)
+        return _upload_accepted(file_instance, "File uploaded, processing started")
     
     return Response(serializer.errors, status=400)
 
+@api_view(['GET'])
+def upload_status(request, dataset_id):
+    """Processing state of an upload: progress while parsing, columns and profile once ready"""
+    try:
+        file_instance = get_uploaded_file(dataset_id, require_ready=False)
+    except DatasetNotFound as e:
+        return Response({"error": str(e)}, status=e.status)
+    return Response(_upload_status(file_instance))
+
+@timing.timed('append_rows')
+@api_view(['POST'])
+@parser_classes([JSONParser, MultiPartParser, FormParser])
+def append_rows(request, dataset_id):
+    """Append rows to a ready dataset, as a ``file`` in any upload format or a JSON list of ``rows`` objects
+
+    The rows must have the dataset's columns and are coerced to their types.
+    Derived data is extended rather than rebuilt and the version is kept;
+    only charts that read the new rows are rendered again.
+    """
+    try:
+        with timing.stage('dataset'):
+            file_instance = get_uploaded_file(dataset_id)
+    except DatasetNotFound as e:
+        return Response({"error": str(e)}, status=e.status)
+
+    try:
+        with timing.stage('parse'):
+            if 'file' in request.data:
+                frame = read_upload(request.data['file'])
+            else:
+                frame = read_row_objects(request.data.get('rows'))
+        appended = append_to_dataset(file_instance, frame)
+    except DatasetNotFound as e:
+        return Response({"error": str(e)}, status=e.status)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    return Response({
+        "dataset_id": file_instance.pk,
+        "version": file_instance.version,
+        "rows": file_instance.rows,
+        "appended": appended,
+    })
+
+@require_GET
+def upload_events(request, dataset_id):
+    """Server-sent events with an upload's status, sent on every change until it settles
+
+    With ASYNC_VIEWS the stream is an async generator, so waiting between
+    checks holds no thread and every event is flushed as it is sent.
+    """
+    try:
+        file_instance = get_uploaded_file(dataset_id, require_ready=False)
+    except DatasetNotFound as e:
+        return JsonResponse({"error": str(e)}, status=e.status)
+
+    def events():
+        last = None
+        while True:
+            payload = _current_upload_status(file_instance)
+            if payload is None:
+                return
+            if payload != last:
+                last = payload
+                yield _upload_event(payload)
+            if payload['status'] != UploadedFile.PROCESSING:
+                return
+            time.sleep(_UPLOAD_EVENT_INTERVAL)
+
+    async def async_events():
+        last = None
+        while True:
+            payload = await sync_to_async(_current_upload_status)(file_instance)
+            if payload is None:
+                return
+            if payload != last:
+                last = payload
+                yield _upload_event(payload)
+            if payload['status'] != UploadedFile.PROCESSING:
+                return
+            await asyncio.sleep(_UPLOAD_EVENT_INTERVAL)
+
+    stream = async_events() if settings.ASYNC_VIEWS else events()
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @api_view(['POST'])
 def get_recommendations(request):
     """Analyze data and suggest appropriate chart types"""
-    global uploaded_data
-    
-    if uploaded_data is None:
-        return Response({"error": "No data uploaded yet"}, status=400)
+    try:
+        file_instance = get_uploaded_file(request.data.get('dataset_id'))
+    except DatasetNotFound as e:
+        return Response({"error": str(e)}, status=e.status)
 
     columns = request.data.get('columns', [])
     if not columns:
         return Response({"error": "No columns provided for analysis"}, status=400)
     
     try:
-        recommendations = analyze_data_for_recommendations(uploaded_data, columns)
+        recommendations = analyze_data_for_recommendations(get_profile(file_instance), columns)
         return Response({"recommendations": recommendations})
     except Exception as e:
         return Response({"error": str(e)}, status=500)
 
-def analyze_data_for_recommendations(df, columns):
-    """Analyze the dataframe to suggest chart types"""
+def analyze_data_for_recommendations(profile, columns):
+    """Suggest chart types from the column profile saved at upload"""
     recommendations = []
     
     col_info = {}
     for col in columns:
-        if col in df.columns:
-            dtype = str(df[col].dtype)
-            if dtype.startswith('datetime'):
-                col_type = 'datetime'
-            elif dtype in ['int64', 'float64']:
-                col_type = 'numeric'
-                unique_vals = df[col].nunique()
-                is_temporal = False
-                try:
-                    if pd.api.types.is_numeric_dtype(df[col]):
-                        if (df[col] > 1900).all() and (df[col] < 2100).all():
-                            is_temporal = True
-                except:
-                    pass
-            else:
-                col_type = 'categorical'
-                unique_vals = df[col].nunique()
-            
+        if col in profile:
+            col_type = profile[col]['class']
             col_info[col] = {
                 'type': col_type,
-                'unique_values': unique_vals if col_type != 'datetime' else None,
-                'is_temporal': is_temporal if col_type == 'numeric' else False
+                'unique_values': profile[col]['distinct'] if col_type != 'datetime' else None,
+                'is_temporal': profile[col]['year_like'] if col_type == 'numeric' else False
             }
     
     num_numeric = sum(1 for info in col_info.values() if info['type'] == 'numeric')
@@ -152,298 +276,312 @@ def analyze_data_for_recommendations(df, columns):
     
     return unique_recommendations[:3]
 
+@timing.timed('generate_graph')
 @api_view(['POST'])
 def generate_graph(request):
-    """Generate a graph with multiple graph type support and full color customization"""
-    global uploaded_data
+    """Generate a graph with multiple graph type support and full color customization
+
+    With ``preview`` set the chart is drawn from the dataset's row sample and
+    marked ``approximate``; the exact chart is only rendered without it.
+    ``filter`` limits the chart to matching rows, e.g.
+    ``[{"column": "date", "min": "2024-01-01"}, {"column": "region", "in": ["EU", "US"]}]``
+    (see filters.parse_filter).
+    """
+    try:
+        with timing.stage('dataset'):
+            file_instance = get_uploaded_file(request.data.get('dataset_id'))
+            available_columns = get_columns(file_instance)
+    except DatasetNotFound as e:
+        return Response({"error": str(e)}, status=e.status)
+
+    try:
+        spec = parse_chart_spec(request.data, available_columns)
+    except ChartError as e:
+        return Response({"error": str(e)}, status=e.status)
+    timing.label(graph_type=spec['graph_type'])
+
+    cache_key = chart_cache_key(file_instance, spec)
+    with timing.stage('cache'):
+        result = chart_cache().get(cache_key)
+    cache_status = "hit"
+    if result is None:
+        cache_status = "miss"
+        try:
+            result = _render_and_cache(file_instance, spec, 'png', cache_key)
+        except ChartError as e:
+            return Response({"error": str(e)}, status=e.status)
+
+    with timing.stage('serialize'):
+        graph = base64.b64encode(result["image"]).decode('utf-8')
+    return Response({
+        "graph": graph,
+        "graph_type": result["graph_type"],
+        "colors_used": result["colors_used"],
+        "points_rendered": result["points_rendered"],
+        "approximate": result["approximate"],
+        "cache": cache_status,
+    })
+
+@timing.timed('generate_graph_image')
+@api_view(['GET', 'POST'])
+def generate_graph_image(request):
+    """Return a chart as raw image bytes with a strong ETag
+
+    Accepts the same fields as generate_graph, either as a JSON body or as
+    query parameters (repeat y_columns/colors for lists), plus
+    ``image_format`` (png, svg or webp; ``format`` is taken by DRF). A
+    matching If-None-Match gets a 304 before any data is loaded or
+    rendered. With ``zoom`` and ``tile`` a line, area or scatter chart
+    shows only that x-range tile, rendered and cached on its own.
+    """
+    data = _chart_request_data(request)
+    image_format = str(data.get('image_format', 'png')).lower()
+    if image_format not in IMAGE_CONTENT_TYPES:
+        return Response({"error": f"Invalid image_format. Use {', '.join(IMAGE_CONTENT_TYPES)}"}, status=400)
+    return _chart_bytes_response(request, data, image_format, IMAGE_CONTENT_TYPES[image_format])
+
+@timing.timed('generate_graph_data')
+@api_view(['GET', 'POST'])
+def generate_graph_data(request):
+    """Return the reduced data a chart would draw, for drawing it client side
+
+    Accepts the same fields as generate_graph_image, with ``encoding`` of
+    json (default) or arrow (an Arrow IPC stream) in place of image_format.
+    Tiles (``zoom`` and ``tile``) return only the rows of their x range, at
+    the detail of a full chart.
+    """
+    data = _chart_request_data(request)
+    encoding = str(data.get('encoding', 'json')).lower()
+    if encoding not in DATA_CONTENT_TYPES:
+        return Response({"error": f"Invalid encoding. Use {', '.join(DATA_CONTENT_TYPES)}"}, status=400)
+    return _chart_bytes_response(request, data, encoding, DATA_CONTENT_TYPES[encoding])
+
+def _chart_bytes_response(request, data, output_format, content_type):
+    """Serve a chart's encoded bytes (image or data) with a strong ETag, rendering on a cache miss"""
+    try:
+        with timing.stage('dataset'):
+            file_instance = get_uploaded_file(data.get('dataset_id'))
+            available_columns = get_columns(file_instance)
+        spec = parse_chart_spec(data, available_columns)
+    except DatasetNotFound as e:
+        return Response({"error": str(e)}, status=e.status)
+    except ChartError as e:
+        return Response({"error": str(e)}, status=e.status)
+    timing.label(graph_type=spec['graph_type'])
+
+    etag = quote_etag(chart_etag(file_instance, spec, output_format))
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    if etag in if_none_match or '*' in if_none_match:
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    cache_key = chart_cache_key(file_instance, spec, output_format)
+    with timing.stage('cache'):
+        result = chart_cache().get(cache_key)
+    cache_status = "hit"
+    if result is None:
+        cache_status = "miss"
+        try:
+            result = _render_and_cache(file_instance, spec, output_format, cache_key)
+        except ChartError as e:
+            return Response({"error": str(e)}, status=e.status)
+
+    response = HttpResponse(result["image"], content_type=content_type)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    response['X-Chart-Cache'] = cache_status
+    response['X-Points-Rendered'] = str(result["points_rendered"])
+    response['X-Chart-Approximate'] = 'true' if result["approximate"] else 'false'
+    return response
 
-    if uploaded_data is None:
-        return Response({"error": "No data uploaded yet"}, status=400)
+@api_view(['POST'])
+def generate_graphs(request):
+    """Render a list of chart specs against one dataset in a single request
+
+    ``charts`` holds generate_graph style specs (dataset_id is given once at
+    the top level). Every spec is validated before any rendering starts.
+    Results come back in request order, or with ``stream`` set as NDJSON
+    lines in completion order, each tagged with its ``index``. With
+    ASYNC_VIEWS the lines are produced on worker threads and streamed
+    through an async iterator, so each is flushed as soon as it is ready.
+    """
+    image_format = str(request.data.get('image_format', 'png')).lower()
+    if image_format not in IMAGE_CONTENT_TYPES:
+        return Response({"error": f"Invalid image_format. Use {', '.join(IMAGE_CONTENT_TYPES)}"}, status=400)
 
-    x_column = request.data.get('x_column')
-    y_columns = request.data.get('y_columns', [])
-    graph_type = request.data.get('graph_type', 'line')
-    custom_colors = request.data.get('colors', [])
-    color_all = request.data.get('color_all', False) 
+    try:
+        file_instance = get_uploaded_file(request.data.get('dataset_id'))
+        specs = parse_batch(request.data.get('charts'), get_columns(file_instance))
+    except DatasetNotFound as e:
+        return Response({"error": str(e)}, status=e.status)
+    except ChartError as e:
+        return Response({"error": str(e)}, status=e.status)
 
-    if not isinstance(y_columns, list) or len(y_columns) == 0:
-        return Response({"error": "Please provide a list of Y-axis columns"}, status=400)
+    results = (_batch_entry(index, result, cache_status)
+               for index, result, cache_status in render_batch(file_instance, specs, image_format))
 
-    if x_column not in uploaded_data.columns:
-        return Response({"error": "Invalid X-axis column selection"}, status=400)
+    if request.data.get('stream'):
+        lines = (json.dumps(entry) + "\n" for entry in results)
+        if settings.ASYNC_VIEWS:
+            lines = iterate_in_threads(lines)
+        return StreamingHttpResponse(lines, content_type='application/x-ndjson')
 
-    for y_col in y_columns:   
-        if y_col not in uploaded_data.columns:
-            return Response({"error": f"Invalid Y-axis column: {y_col}"}, status=400)
+    return Response({"results": sorted(results, key=lambda entry: entry["index"])})
 
+@api_view(['POST'])
+def submit_render_job(request):
+    """Queue a chart render in the process pool and return a job to poll
+
+    Takes the generate_graph fields. Answers 200 with a finished job when
+    the chart is already cached, 202 when it was queued, and 503 when the
+    queue is full.
+    """
     try:
-        plt.style.use('seaborn-v0_8')
-    except:
-        try:
-            plt.style.use('seaborn')
-        except:
-            sns.set_style("whitegrid")
+        file_instance = get_uploaded_file(request.data.get('dataset_id'))
+        spec = parse_chart_spec(request.data, get_columns(file_instance))
+    except DatasetNotFound as e:
+        return Response({"error": str(e)}, status=e.status)
+    except ChartError as e:
+        return Response({"error": str(e)}, status=e.status)
+
+    cache_key = chart_cache_key(file_instance, spec)
+    cached = chart_cache().get(cache_key)
+    if cached is not None:
+        job_id = complete_job(spec, cached)
+        return Response({"job_id": job_id, "status": "done"}, status=200)
+
+    # The worker reads only the sampled and filtered rows, so it never needs the filter's indexes
+    try:
+        rows = get_row_positions(file_instance, spec)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+    scale = sample_scale(file_instance) if spec['preview'] else 1.0
 
-    plt.figure(figsize=(10, 6))
-    
-    if color_all and custom_colors:
-        colors = [custom_colors[0]] * len(y_columns)
-    elif custom_colors and len(custom_colors) >= len(y_columns):
-        colors = custom_colors[:len(y_columns)]
+    try:
+        job_id = submit_job(ensure_sidecar(file_instance), spec, 'png', cache_key, rows, scale,
+                            file_instance.rows or None)
+    except RenderFarmBusy as e:
+        return Response({"error": str(e)}, status=503)
+
+    return Response({"job_id": job_id, "status": "pending"}, status=202)
+
+@api_view(['GET'])
+def render_job_status(request, job_id):
+    """Report a render job's state, with the chart once it is done"""
+    job = get_job(job_id)
+    if job is None:
+        return Response({"error": "Unknown or expired job"}, status=404)
+
+    if job["status"] == "failed":
+        return Response({"job_id": job_id, "status": "failed", "error": job["error"]},
+                        status=job.get("http_status", 500))
+
+    if job["status"] != "done":
+        return Response({"job_id": job_id, "status": job["status"]}, status=202)
+
+    result = job["result"]
+    return Response({
+        "job_id": job_id,
+        "status": "done",
+        "graph": base64.b64encode(result["image"]).decode('utf-8'),
+        "graph_type": result["graph_type"],
+        "colors_used": result["colors_used"],
+        "points_rendered": result["points_rendered"],
+        "approximate": result["approximate"],
+    })
+
+@require_GET
+def prometheus_metrics(request):
+    """Request counts and per-stage latency histograms of this worker process, in Prometheus text format"""
+    return HttpResponse(timing.metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def _chart_request_data(request):
+    if request.method != 'GET':
+        return request.data
+    data = request.query_params.dict()
+    for field in _LIST_FIELDS:
+        if field in request.query_params:
+            data[field] = request.query_params.getlist(field)
+    for field in _FLAG_FIELDS:
+        if field in data:
+            data[field] = data[field].lower() in ('1', 'true', 'yes')
+    return data
+
+def _upload_accepted(file_instance, message, deduplicated=False):
+    """202 for an upload being processed, 200 when an existing dataset already holds it"""
+    return Response({
+        "message": message,
+        "dataset_id": file_instance.pk,
+        "status": file_instance.status,
+        "status_url": reverse('upload_status', args=[file_instance.pk]),
+        "events_url": reverse('upload_events', args=[file_instance.pk]),
+        "deduplicated": deduplicated,
+    }, status=200 if deduplicated else 202)
+
+def _upload_status(file_instance):
+    payload = {
+        "dataset_id": file_instance.pk,
+        "version": file_instance.version,
+        "status": file_instance.status,
+    }
+    if file_instance.status == UploadedFile.PROCESSING and reclaim_stale_uploads(file_instance):
+        file_instance.refresh_from_db(fields=['status', 'error'])
+        payload["status"] = file_instance.status
+    if file_instance.status == UploadedFile.PROCESSING:
+        payload["progress"] = get_progress(file_instance)
+    elif file_instance.status == UploadedFile.READY:
+        payload["rows"] = file_instance.rows
+        payload["categories"] = get_columns(file_instance)
+        payload["profile"] = file_instance.profile
     else:
-        colors = sns.color_palette("tab10", n_colors=len(y_columns))
+        payload["error"] = file_instance.error
+    return payload
 
+def _current_upload_status(file_instance):
+    """The upload's status payload read afresh from the database, or None once it was deleted"""
     try:
-        if graph_type == 'line':
-            for i, y_col in enumerate(y_columns):
-                plt.plot(uploaded_data[x_column], uploaded_data[y_col], 
-                        color=colors[i], 
-                        marker='o' if len(y_columns) < 5 else '', 
-                        linewidth=2, 
-                        label=y_col)
-
-        elif graph_type == 'bar':
-            width = 0.8 / len(y_columns)
-            x_values = range(len(uploaded_data[x_column]))
-
-            for i, y_col in enumerate(y_columns):
-                plt.bar([x + i * width for x in x_values], 
-                        uploaded_data[y_col], 
-                        width=width, 
-                        color=colors[i], 
-                        alpha=0.8,
-                        label=y_col)
-
-            plt.xticks([x + (len(y_columns)-1)*width/2 for x in x_values], 
-                       uploaded_data[x_column])
-
-        elif graph_type == 'pie':
-            if len(y_columns) > 1:
-                return Response({"error": "Pie chart supports only one Y column"}, status=400)
-            
-            y_col = y_columns[0]
-            numeric_values = pd.to_numeric(uploaded_data[y_col], errors='coerce')
-            mask = ~numeric_values.isna()
-
-            if not mask.any():
-                return Response({"error": "Y-axis column must contain numeric values for pie chart."}, status=400)
-
-            plt.pie(numeric_values[mask], 
-                    labels=uploaded_data[x_column][mask], 
-                    autopct='%1.1f%%',
-                    colors=colors[:len(uploaded_data[x_column][mask])],
-                    startangle=90,
-                    wedgeprops={'linewidth': 1, 'edgecolor': 'white'})
-
-        elif graph_type == 'area':
-            for i, y_col in enumerate(y_columns):
-                plt.fill_between(uploaded_data[x_column], 
-                               uploaded_data[y_col], 
-                               color=colors[i], 
-                               alpha=0.4,
-                               label=y_col)
-                plt.plot(uploaded_data[x_column], 
-                        uploaded_data[y_col], 
-                        color=colors[i], 
-                        alpha=0.8,
-                        linewidth=1)
-
-        elif graph_type == 'scatter':
-            for i, y_col in enumerate(y_columns):
-                plt.scatter(uploaded_data[x_column], 
-                          uploaded_data[y_col], 
-                          color=colors[i], 
-                          s=100,
-                          alpha=0.7,
-                          label=y_col)
-
-        elif graph_type == 'histogram':
-            for i, y_col in enumerate(y_columns):
-                plt.hist(uploaded_data[y_col], 
-                        bins='auto', 
-                        color=colors[i], 
-                        alpha=0.7,
-                        label=y_col)
-
-        elif graph_type == 'box':
-            data_to_plot = [uploaded_data[col] for col in y_columns]
-            box = plt.boxplot(data_to_plot, 
-                            patch_artist=True,
-                            labels=y_columns)
-            
-            for patch, color in zip(box['boxes'], colors):
-                patch.set_facecolor(color)
-                patch.set_alpha(0.7)
-
-        elif graph_type == 'violin':
-            data_to_plot = [uploaded_data[col] for col in y_columns]
-            violin = plt.violinplot(data_to_plot,
-                                  showmeans=True,
-                                  showmedians=True)
-            
-            for patch, color in zip(violin['bodies'], colors):
-                patch.set_facecolor(color)
-                patch.set_alpha(0.7)
-
-            plt.xticks(range(1, len(y_columns)+1), y_columns)
-
-        elif graph_type == 'funnel':
-            y_col = y_columns[0]
-            plt.barh(uploaded_data[x_column], 
-                    uploaded_data[y_col], 
-                    color=colors[:len(uploaded_data[x_column])])
-            plt.gca().invert_yaxis()
-
-        elif graph_type == 'sunburst':
-            if len(y_columns) != 1:
-                return Response({"error": "Sunburst chart needs exactly one Y column"}, status=400)
-            
-            y_col = y_columns[0]
-            numeric_values = pd.to_numeric(uploaded_data[y_col], errors='coerce')
-            mask = ~numeric_values.isna()
-
-            if not mask.any():
-                return Response({"error": "Y-axis column must contain numeric values for sunburst chart."}, status=400)
-
-            plt.pie(numeric_values[mask], 
-                    labels=uploaded_data[x_column][mask], 
-                    autopct='%1.1f%%',
-                    colors=colors[:len(uploaded_data[x_column][mask])],
-                    startangle=90,
-                    wedgeprops=dict(width=0.5, edgecolor='w'))
-
-        elif graph_type == 'waterfall':
-            y_col = y_columns[0]
-            values = uploaded_data[y_col].cumsum()
-            plt.bar(uploaded_data[x_column], 
-                   uploaded_data[y_col], 
-                   bottom=values - uploaded_data[y_col],
-                   color=colors[:len(uploaded_data[x_column])])
-
-        elif graph_type == 'combo':
-            if len(y_columns) < 2:
-                return Response({"error": "Combo chart needs at least 2 Y columns"}, status=400)
-            
-            plt.bar(uploaded_data[x_column], 
-                   uploaded_data[y_columns[0]], 
-                   color=colors[0],
-                   alpha=0.7,
-                   label=y_columns[0])
-            
-            plt.plot(uploaded_data[x_column], 
-                   uploaded_data[y_columns[1]], 
-                   color=colors[1],
-                   marker='o',
-                   linewidth=2,
-                   label=y_columns[1])
-            
-            if len(y_columns) > 2:
-                markers = ['s', '^', 'D', 'v', 'p', '*']
-                for i in range(2, len(y_columns)):
-                    plt.plot(uploaded_data[x_column], 
-                           uploaded_data[y_columns[i]], 
-                           color=colors[i],
-                           marker=markers[(i-2) % len(markers)],
-                           linewidth=2,
-                           label=y_columns[i])
-
-        elif graph_type == 'stock':
-            if len(y_columns) < 4:
-                return Response({"error": "Stock chart requires Open, High, Low, Close columns"}, status=400)
-            
-            try:
-                timeframe = request.data.get('timeframe', '1D').upper()
-                
-                df = uploaded_data.copy()
-                df[x_column] = pd.to_datetime(df[x_column])
-                
-                for col in y_columns[:4]:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-                
-                df = df.set_index(x_column).sort_index()
-                df = df.dropna(subset=y_columns[:4])
-                
-                timeframe_map = {
-                    '1M': '1T',    
-                    '5M': '5T',    
-                    '10M': '10T',   
-                    '15M': '15T',   
-                    '30M': '30T',   
-                    '1H': '1H',  
-                    '4H': '4H',    
-                    '1D': '1D',    
-                    '1W': '1W',  
-                    '1MO': '1M'     
-                }
-                
-                if timeframe not in timeframe_map:
-                    return Response({"error": "Invalid timeframe. Use 1M,5M,10M,15M,30M,1H,4H,1D,1W,1MO"}, status=400)
-                
-                ohlc_dict = {
-                    y_columns[0]: 'first',  
-                    y_columns[1]: 'max',    
-                    y_columns[2]: 'min',    
-                    y_columns[3]: 'last',   
-                }
-                
-                if len(y_columns) > 4:
-                    ohlc_dict[y_columns[4]] = 'sum'
-                
-                resampled_df = df.resample(timeframe_map[timeframe]).agg(ohlc_dict).dropna()
-                
-                resampled_df['date_num'] = mdates.date2num(resampled_df.index)
-                ohlc_columns = ['date_num'] + y_columns[:4]
-                ohlc = resampled_df[ohlc_columns].values
-                
-                plt.close('all')
-                fig, ax = plt.subplots(figsize=(15, 7))
-                
-                candlestick_ohlc(ax, ohlc, width=0.6/len(timeframe_map[timeframe]), 
-                                colorup='g', colordown='r')
-                
-                ax.xaxis_date()
-                ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d %H:%M'))
-                plt.xticks(rotation=45)
-                ax.set_title(f'Stock Price ({timeframe} timeframe)')
-                ax.set_xlabel('Date/Time')
-                ax.set_ylabel('Price')
-                
-                if len(y_columns) > 4:
-                    ax2 = ax.twinx()
-                    ax2.bar(resampled_df.index, resampled_df[y_columns[4]], 
-                        width=0.01, alpha=0.3, color='blue')
-                    ax2.set_ylabel('Volume', color='blue')
-                
-                plt.tight_layout()
-                
-            except Exception as e:
-                plt.close('all')
-                return Response({"error": f"Failed to generate stock chart: {str(e)}"}, status=400)
-
-        if graph_type != 'stock':
-            plt.xlabel(x_column, fontsize=12)
-            plt.ylabel("Values", fontsize=12)
-            plt.title(f"{graph_type.capitalize()} Chart", fontsize=14)
-            
-            if graph_type not in ['pie', 'sunburst', 'funnel']:
-                plt.legend(fontsize=10, bbox_to_anchor=(1.05, 1), loc='upper left')
-                plt.grid(True, linestyle='--', alpha=0.7)
-
-        plt.tight_layout()
-
-        buffer = BytesIO()
-        plt.savefig(buffer, format="png", dpi=120)
-        buffer.seek(0)
-        encoded_image = base64.b64encode(buffer.read()).decode('utf-8')
-        buffer.close()
-        plt.close()
-
-        return Response({
-            "graph": encoded_image,
-            "graph_type": graph_type,
-            "colors_used": colors[:len(y_columns)]
-        })
-
-    except Exception as e:
-        plt.close()
-        return Response({"error": f"Graph generation failed: {str(e)}"}, status=500)
\ No newline at end of file
+        file_instance.refresh_from_db(fields=['version', 'rows', 'status', 'error', 'profile', 'progress'])
+    except UploadedFile.DoesNotExist:
+        return None
+    return _upload_status(file_instance)
+
+def _upload_event(payload):
+    return f"event: {payload['status']}\ndata: {json.dumps(payload)}\n\n"
+
+def _batch_entry(index, result, cache_status):
+    if isinstance(result, ChartError):
+        return {"index": index, "error": str(result), "status": result.status}
+    return {
+        "index": index,
+        "graph": base64.b64encode(result["image"]).decode('utf-8'),
+        "graph_type": result["graph_type"],
+        "colors_used": result["colors_used"],
+        "points_rendered": result["points_rendered"],
+        "approximate": result["approximate"],
+        "cache": cache_status,
+    }
+
+def _render_and_cache(file_instance, spec, output_format, cache_key):
+    """Render a chart, or encode its data for the DATA_CONTENT_TYPES formats, and cache the result
+
+    The encoded bytes are kept under "image" either way.
+    """
+    try:
+        uploaded_data = get_chart_frame(file_instance, spec)
+    except ValueError as e:
+        raise ChartError(str(e))
+    typed = get_chart_typed(file_instance, spec)
+    raise_if_cancelled()
+    if output_format in DATA_CONTENT_TYPES:
+        with timing.stage('encode'):
+            image, meta = chart_data(uploaded_data, spec, output_format, typed)
+        timing.size('encode', len(image))
+    else:
+        # Imported on first render so workers that only upload or recommend never load matplotlib
+        from .charts import render_chart
+        image, meta = render_chart(uploaded_data, spec, output_format, typed)
+    result = {"image": image, **meta}
+    with timing.stage('cache'):
+        chart_cache().set(cache_key, result)
+    return result
@@ -3,6 +3,14 @@ ASGI config for sdkvism project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Request bodies are received without holding a thread (Django spools them
+to a temporary file as they arrive) and the upload, status, chart, batch
+and render job endpoints then run on a bounded thread pool, so slow
+clients and long renders do not tie up Django's single thread for sync
+views. The upload event stream and streamed batches are async iterators,
+sent as they are produced rather than buffered. Set ASYNC_VIEWS=0 to
+serve them as plain sync views instead.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -12,5 +20,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sdkvism.settings')
+# Serve the heavy endpoints as async views (see sdkreact/offload.py)
+os.environ.setdefault('ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -163,4 +163,103 @@ CORS_ALLOW_CREDENTIALS = True
 # Temporarily disable HTTPS requirements for development
 SESSION_COOKIE_SECURE = False
 CSRF_COOKIE_SECURE = False
-SECURE_SSL_REDIRECT = False
\ No newline at end of file
+SECURE_SSL_REDIRECT = False
+
+# Parsed uploads kept in memory per worker, reloaded from the UploadedFile row on a miss
+DATASET_STORE_MAX_BYTES = int(os.environ.get('DATASET_STORE_MAX_BYTES', 512 * 1024 * 1024))
+DATASET_STORE_MAX_ITEMS = int(os.environ.get('DATASET_STORE_MAX_ITEMS', 32))
+
+# Streaming ingestion: rows parsed per chunk and the distinct-value cap for categoricals
+INGEST_CHUNK_ROWS = int(os.environ.get('INGEST_CHUNK_ROWS', 100_000))
+INGEST_CATEGORY_MAX = int(os.environ.get('INGEST_CATEGORY_MAX', 1000))
+# 'pyarrow' (multithreaded, falls back to pandas on type conflicts) or 'pandas'
+INGEST_CSV_ENGINE = os.environ.get('INGEST_CSV_ENGINE', 'pyarrow')
+
+# Rendered chart cache: CHART_CACHE is 'locmem', 'file' or any Django cache backend path
+CHART_CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+}
+CHART_CACHE = os.environ.get('CHART_CACHE', 'locmem')
+CHART_CACHE_ALIAS = 'charts'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    CHART_CACHE_ALIAS: {
+        'BACKEND': CHART_CACHE_BACKENDS.get(CHART_CACHE, CHART_CACHE),
+        'LOCATION': os.environ.get('CHART_CACHE_LOCATION', os.path.join(BASE_DIR, 'chart_cache')),
+        'TIMEOUT': int(os.environ.get('CHART_CACHE_TIMEOUT', 24 * 60 * 60)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('CHART_CACHE_MAX_ENTRIES', 1000)),
+        },
+    },
+}
+
+# Process pool for heavy renders submitted through the render job API
+RENDER_FARM_WORKERS = int(os.environ.get('RENDER_FARM_WORKERS', 2))
+RENDER_FARM_MAX_QUEUE = int(os.environ.get('RENDER_FARM_MAX_QUEUE', 16))
+RENDER_FARM_JOB_TIMEOUT = int(os.environ.get('RENDER_FARM_JOB_TIMEOUT', 60))
+RENDER_JOB_TTL = int(os.environ.get('RENDER_JOB_TTL', 60 * 60))
+
+# Batch chart endpoint: specs accepted per request and threads rendering them
+CHART_BATCH_MAX_CHARTS = int(os.environ.get('CHART_BATCH_MAX_CHARTS', 64))
+CHART_BATCH_WORKERS = int(os.environ.get('CHART_BATCH_WORKERS', 4))
+
+# Preview mode: charts drawn from a fixed per-dataset sample of at most
+# PREVIEW_SAMPLE_ROWS rows, or PREVIEW_SAMPLE_FRACTION of the rows when set
+PREVIEW_SAMPLE_ROWS = int(os.environ.get('PREVIEW_SAMPLE_ROWS', 50_000))
+PREVIEW_SAMPLE_FRACTION = float(os.environ.get('PREVIEW_SAMPLE_FRACTION', 0))
+
+# Background threads parsing uploads after upload_file has answered
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 2))
+
+# Per-stage request timing: Server-Timing headers, the /metrics endpoint and
+# one JSON log line per request on the sdkreact.timing logger, which is only
+# written with REQUEST_TIMING_LOG_LEVEL=INFO
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '1') == '1'
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'sdkreact.timing': {
+            'handlers': ['console'],
+            'level': os.environ.get('REQUEST_TIMING_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
+# Load matplotlib and render a throwaway chart at startup instead of on the
+# first chart request; pair with gunicorn --preload to warm the master once
+RENDER_WARMUP = os.environ.get('RENDER_WARMUP', '0') == '1'
+
+# Upload retention, enforced by `manage.py prune_uploads`: datasets older than
+# UPLOAD_MAX_AGE_DAYS, unused for UPLOAD_MAX_IDLE_DAYS, or least recently used
+# beyond UPLOAD_MAX_BYTES of files on disk are deleted; 0 turns a rule off
+UPLOAD_MAX_AGE_DAYS = float(os.environ.get('UPLOAD_MAX_AGE_DAYS', 0))
+UPLOAD_MAX_IDLE_DAYS = float(os.environ.get('UPLOAD_MAX_IDLE_DAYS', 0))
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 0))
+# Seconds between writes of a dataset's last access time
+UPLOAD_ACCESS_RESOLUTION = int(os.environ.get('UPLOAD_ACCESS_RESOLUTION', 60))
+
+# Async views for ASGI servers (asgi.py turns them on): heavy endpoints run on
+# a pool of ASYNC_WORKERS threads and answer 503 once ASYNC_MAX_QUEUE
+# requests are already queued or running
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', '0') == '1'
+ASYNC_WORKERS = int(os.environ.get('ASYNC_WORKERS', 4))
+ASYNC_MAX_QUEUE = int(os.environ.get('ASYNC_MAX_QUEUE', 64))
+
+# Appended rows are written as segment files next to a dataset's sidecar;
+# once APPEND_MAX_SEGMENTS have piled up they are merged into one
+APPEND_MAX_SEGMENTS = int(os.environ.get('APPEND_MAX_SEGMENTS', 32))
+
+# A processing upload records a heartbeat every UPLOAD_HEARTBEAT_SECONDS; one
+# with none for UPLOAD_STALE_SECONDS lost its worker and is marked failed, so
+# it can be replaced
+UPLOAD_HEARTBEAT_SECONDS = float(os.environ.get('UPLOAD_HEARTBEAT_SECONDS', 10))
+UPLOAD_STALE_SECONDS = float(os.environ.get('UPLOAD_STALE_SECONDS', 120))